@@ -1,7 +1,7 @@
 import torch as torch
 import torch.nn as nn
 import torch.nn.functional as F
-from src.ReLUNetwork import ReLUNetwork
+from src.ReLUNetwork import ReLUNetwork, linear_layer, positive_row_sums
 
 
 #CReLU activation function
@@ -24,12 +24,7 @@ class CReLUNetwork(nn.Module):
     def construct_layers(self) -> None:
         self.layers = nn.ModuleList()
         for i in range(0, self.num_layers):
-            input_size, output_size = self.weights[i].shape[1], self.weights[i].shape[0]
-
-            layer = nn.Linear(input_size, output_size)
-            layer.weight.data = self.weights[i]
-            layer.bias.data = self.biases[i]
-            self.layers.append(layer)
+            self.layers.append(linear_layer(self.weights[i], self.biases[i]))
 
             if i != self.num_layers - 1:
                 self.layers.append(CReLU())
@@ -39,62 +34,33 @@ class CReLUNetwork(nn.Module):
             x = layer(x)
         return x
     
+def split_counts(weight: torch.tensor, bias: torch.tensor) -> torch.tensor:
+    # number of CReLU copies of each neuron of a layer, the bound of its maximum output in the ReLU Network (at least 1)
+    max_weighted_input = torch.ceil(positive_row_sums(weight) + bias.to(torch.float64))
+    return max_weighted_input.clamp(min=1).long()
+
 def transform_ReLU_to_CReLU(ReLU: ReLUNetwork) -> 'CReLUNetwork':
-    CReLUNet = CReLUNetwork([], [])
-    CReLUNet.num_layers = ReLU.num_layers
+    # A neuron whose output can exceed 1 is split into ceil(sum of its positive weights + bias) copies with biases b, b - 1, ...,
+    # whose clipped outputs add up to its ReLU output, and every copy feeds the next layer through the weights of the neuron.
+    # The split counts of a layer are computed at once and the expanded matrices are gathered in one pass. ReLU is not modified.
+    weights = list(ReLU.weights)
+    CReLU_weights, CReLU_biases = [], []
+
     # Last layer doesn't need to be transformed!
     for i in range(ReLU.num_layers - 1):
-        ReLU_weight = ReLU.weights[i]
-        ReLU_bias = ReLU.biases[i]
-        num_neurons = ReLU_weight.shape[0]
-
-        CReLU_weight = None
-        CReLU_bias = None
-        updated_ReLU_weight = None
-
-        for j in range(num_neurons):
-            contributing_weight = ReLU_weight[j]
-            contributing_bias = ReLU_bias[j]
-            max_weighted_input = int(torch.ceil(torch.sum(contributing_weight[contributing_weight > 0]) + contributing_bias).item())  # bound of the maximum output in the ReLU Network  # bound of the maximum output in the ReLU Network
-            # if the max_weighted_input exceeds one then we have to add "neurons", meaning we have to expand the weight matrix and updated the bias
-            if max_weighted_input > 1:
-                for u in range(0, max_weighted_input):
+        weight, bias = weights[i], ReLU.biases[i].to(torch.float64)
+        copies = split_counts(weight, bias)
 
-                    if CReLU_weight is None:
-                        CReLU_weight = contributing_weight
-                    else:
-                        CReLU_weight = torch.vstack((CReLU_weight, contributing_weight))
+        rows = torch.repeat_interleave(torch.arange(weight.shape[0]), copies)
+        first_copy = torch.repeat_interleave(torch.cumsum(copies, dim=0) - copies, copies)
+        offsets = (torch.arange(rows.shape[0]) - first_copy).to(torch.float64) # u for the copy u of a neuron
 
-                    if CReLU_bias is None:
-                        CReLU_bias = torch.tensor([contributing_bias.item()], dtype=torch.float64)
-                    else:
-                        CReLU_bias = torch.hstack((CReLU_bias, torch.tensor([contributing_bias.item() - u], dtype=torch.float64)))
+        # index_select keeps sparse weights sparse
+        CReLU_weights.append(torch.index_select(weight, 0, rows))
+        CReLU_biases.append(bias[rows] - offsets)
+        weights[i + 1] = torch.index_select(weights[i + 1], 1, rows)
 
-                    if updated_ReLU_weight is None:
-                        updated_ReLU_weight = ReLU.weights[i + 1][:, j].view(-1, 1)
-                    else:
-                        updated_ReLU_weight = torch.hstack((updated_ReLU_weight, ReLU.weights[i + 1][:, j].view(-1, 1)))
-            else:
-                if CReLU_weight is None:
-                    CReLU_weight = contributing_weight
-                else:
-                    CReLU_weight = torch.vstack((CReLU_weight, contributing_weight))
-
-                if CReLU_bias is None:
-                    CReLU_bias = torch.tensor([contributing_bias.item()], dtype=torch.float64)
-                else:
-                    CReLU_bias = torch.hstack((CReLU_bias, torch.tensor([contributing_bias.item()], dtype=torch.float64)))
-
-                if updated_ReLU_weight is None:
-                    updated_ReLU_weight = ReLU.weights[i + 1][:, j].view(-1, 1)
-                else:
-                    updated_ReLU_weight = torch.hstack((updated_ReLU_weight, ReLU.weights[i + 1][:, j].view(-1, 1)))
-
-        CReLUNet.weights.append(CReLU_weight)
-        CReLUNet.biases.append(CReLU_bias)
-        ReLU.weights[i + 1] = updated_ReLU_weight
-    
-    CReLUNet.weights.append(ReLU.weights[-1])
-    CReLUNet.biases.append(ReLU.biases[-1])
+    CReLU_weights.append(weights[-1])
+    CReLU_biases.append(ReLU.biases[-1])
 
-    return CReLUNet
\ No newline at end of file
+    return CReLUNetwork(CReLU_weights, CReLU_biases)
@@ -1,6 +1,13 @@
-from src.CReLUNetwork import CReLUNetwork, torch
-from src.utils.math_utils import get_lcm
+from src.CReLUNetwork import CReLUNetwork, torch, split_counts, transform_ReLU_to_CReLU
+from src.utils.math_utils import rational_to_integer, sparse_rational_to_integer
+from src.TLogics import Lukasiewicz
+from src.ReLUNetwork import ReLUNetwork
+from src.utils import Tree
+from src.utils.TermStore import TermStore
 import numpy as np
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 def sigma_activation(x: float):
     return np.minimum(np.maximum(x, 0), 1)
@@ -11,168 +18,566 @@ def is_true(string):
 def is_false(string):
     return string == "0" or string == "(¬1)"
 
+def is_true_node(node: Tree.Node) -> bool:
+    return node.data == "1" or (node.data == "¬" and node.left.data == "0")
+
+def is_false_node(node: Tree.Node) -> bool:
+    return node.data == "0" or (node.data == "¬" and node.left.data == "1")
+
+class ExtractionBudgetExceeded(ValueError):
+    # report says where the extraction stopped and how much it had built, see construct_terms and compose_MV_terms
+    def __init__(self, report: dict) -> None:
+        super().__init__(f"Extraction budget exceeded: {report}")
+        self.report = report
+
+    def __reduce__(self):
+        return (self.__class__, (self.report,))
+
+'''
+SigmaCache memoizes the sigma constructions by their canonical arguments (tuple(w), b) and the lcm for the rational ones.
+The terms are built as nodes of one node table, so a cache shared by all the neurons of all the layers also shares their common subterms.
+Neurons made by transform_ReLU_to_CReLU repeat a weight row with shifted biases and hit the cache for most subproblems.
+'''
+class SigmaCache:
+    # with max_nodes, building more nodes than that raises ExtractionBudgetExceeded
+    def __init__(self, table: Tree.NodeTable = None, max_nodes: int = None) -> None:
+        self.table = Tree.NodeTable() if table is None else table
+        self.max_nodes = max_nodes
+        self.terms = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key: tuple) -> Tree.Node:
+        # None on a miss, the caller builds the term and stores it
+        term = self.terms.get(key)
+        if term is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return term
+
+    def store(self, key: tuple, term: Tree.Node) -> Tree.Node:
+        if self.max_nodes is not None and len(self.table) > self.max_nodes:
+            raise ExtractionBudgetExceeded({"stage": "construct", "max_nodes": self.max_nodes, **self.stats()})
+        self.terms[key] = term
+        return term
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate(), "terms": len(self.terms), "nodes": len(self.table)}
+
+def sigma_key(w, b) -> tuple:
+    return (tuple(np.asarray(w, dtype=np.float64).tolist()), float(b))
+
 # TODO: Type hints
 def sigma_construct_rational(w, b, lcm):
-    integer_w = lcm * w
-    integer_b = lcm * b
+    return Lukasiewicz().generate_formula_from_ast(sigma_construct_rational_node(w, b, lcm, SigmaCache()))
+
+def sigma_construct_rational_node(w, b, lcm, cache: SigmaCache) -> Tree.Node:
+    return sigma_construct_integer_node(lcm * np.asarray(w), lcm * b, lcm, cache)
+
+def sigma_construct_integer_node(integer_w, integer_b, lcm, cache: SigmaCache) -> Tree.Node:
+    # sigma_construct_rational_node for the row and bias already multiplied by lcm
+    key = ("rational", lcm) + sigma_key(integer_w, integer_b)
+    term = cache.lookup(key)
+    if term is not None:
+        return term
 
+    make = cache.table.make
     if (lcm == 1):
-        term = sigma_construct(integer_w, integer_b)
+        term = sigma_construct_node(integer_w, integer_b, cache)
     else:
-        term = f'(δ_{lcm} {sigma_construct(integer_w, integer_b)})'
+        term = make(f'δ{lcm}', sigma_construct_node(integer_w, integer_b, cache))
     for i in range(1, lcm): # this goes to s - 1 by definition of range in python
-        term = f"({term}⊕(δ_{lcm} {sigma_construct(integer_w, integer_b - i)}))"
-    return term
+        term = make("⊕", term, make(f'δ{lcm}', sigma_construct_node(integer_w, integer_b - i, cache)))
+    return cache.store(key, term)
 
 def sigma_construct_rational_from_paper(w, b, lcm):
+    return Lukasiewicz().generate_formula_from_ast(sigma_construct_rational_from_paper_node(w, b, lcm, SigmaCache()))
+
+def sigma_construct_rational_from_paper_node(w, b, lcm, cache: SigmaCache) -> Tree.Node:
+    key = ("paper", lcm) + sigma_key(w, b)
+    term = cache.lookup(key)
+    if term is not None:
+        return term
+
+    make = cache.table.make
     if np.all(w == 0):
        if b <= 0 or b >= 1:
-            return str(int(sigma_activation(b)))
+            term = make(str(int(sigma_activation(b))))
        else:
-            term = f"(δ_{lcm})"
+            term = make(f"δ{lcm}", make("1"))
             for _ in range(1, int(b * lcm)):
-                term = f"({term}⊕(δ_{lcm} 1))"
-            return term
-        
+                term = make("⊕", term, make(f"δ{lcm}", make("1")))
+
     elif np.all(w <= 0):
-        return f"(¬{sigma_construct_rational_from_paper(-1*w, -1*b + 1, lcm)})"
-    
+        term = make("¬", sigma_construct_rational_from_paper_node(-1*w, -1*b + 1, lcm, cache))
+
     elif np.all(w < 1):
         idx = np.where(w > 0)[0][0]
         wl, wr = w.copy(), w.copy()
         wl[idx] = 0
         wr[idx] = 0
-        left = sigma_construct_rational_from_paper(wl, b, lcm)
-        right = sigma_construct_rational_from_paper(wr, b + 1, lcm)
-        if is_false(right):
-            return '0'
-        
-        if is_true(left):
-            return right
-        
-        if is_true(right):
-            term = f"(δ_{lcm} x{idx + 1})"
-            for _ in range(1, int(w[idx] * lcm)): # this goes to s - 1 by definition of range in python
-                term = f"({term}⊕(δ_{lcm} x{idx + 1}))"
-
-            if is_false(left):
-                return term
-            
-            else:
-                return f"({left}⊕{term})"
-            
-        if is_false(left):
-            term = f"(δ_{lcm} x{idx + 1})"
-            for _ in range(1, int(w[idx] * lcm)):
-                term = f"({term}⊕(δ_{lcm} x{idx + 1}))"
-
-            if is_true(right):
-                return term
-            
-            else:
-                return f"({term}⊙{right})"
-            
-        return f"(({left}⊕x{idx+1})⊙{right})"
-    
+        left = sigma_construct_rational_from_paper_node(wl, b, lcm, cache)
+        right = sigma_construct_rational_from_paper_node(wr, b + 1, lcm, cache)
+        atom = make(f"x{idx + 1}")
+
+        scaled_atom = make(f"δ{lcm}", atom)
+        for _ in range(1, int(w[idx] * lcm)): # this goes to s - 1 by definition of range in python
+            scaled_atom = make("⊕", scaled_atom, make(f"δ{lcm}", atom))
+
+        if is_false_node(right):
+            term = make("0")
+
+        elif is_true_node(left):
+            term = right
+
+        elif is_true_node(right):
+            term = scaled_atom if is_false_node(left) else make("⊕", left, scaled_atom)
+
+        elif is_false_node(left):
+            term = make("⊙", scaled_atom, right)
+
+        else:
+            term = make("⊙", make("⊕", left, atom), right)
+
     else:
         idx = np.where(w > 0)[0][0]
         wl, wr = w.copy(), w.copy()
         wl[idx] -= 1
         wr[idx] -= 1
-        left = sigma_construct_rational_from_paper(wl, b, lcm) # results f0
-        right = sigma_construct_rational_from_paper(wr, b + 1, lcm) #results f0 + 1
-
-        if is_false(right): # sigma(f0 ⊕ x) ⊙ 0 = 0 
-            return "0"
-        
-        if is_true(left): # sigma(1 ⊕ x) ⊙ sigma(f0 + 1) = sigma(f0 + 1)
-            return right
-        
-        if is_true(right): # sigma(f0 ⊕ x) ⊙ 1 == sigma(f0 ⊕ x)
-            if is_false(left): # sigma(0 ⊕ x) = x
-                return f"x{idx+1}"
-            else:
-                return f"({left}⊕x{idx+1})"
-            
-        if is_false(left): # sigma(0 ⊕ x) ⊙ sigma(f0 + 1) = x ⊙ sigma(f0 + 1)
-            if is_true(right):
-                return f"x{idx+1}"
-            else:
-                return f"(x{idx+1}⊙{right})"
-            
-        return f"(({left}⊕x{idx+1})⊙{right})"
-    
+        term = sigma_combine(sigma_construct_rational_from_paper_node(wl, b, lcm, cache), sigma_construct_rational_from_paper_node(wr, b + 1, lcm, cache), idx, cache)
+
+    return cache.store(key, term)
+
 def sigma_construct(w, b):
+    return Lukasiewicz().generate_formula_from_ast(sigma_construct_node(w, b, SigmaCache()))
+
+def sigma_construct_node(w, b, cache: SigmaCache) -> Tree.Node:
+    key = sigma_key(w, b)
+    term = cache.lookup(key)
+    if term is not None:
+        return term
+
     if np.all(w == 0):
-       return str(int(sigma_activation(b)))
-        
+        term = cache.table.make(str(int(sigma_activation(b))))
+
     elif np.all(w <= 0):
-        return f"(¬{sigma_construct(-1*w, -1*b + 1)})"
-    
+        term = cache.table.make("¬", sigma_construct_node(-1*w, -1*b + 1, cache))
+
     else:
         idx = np.where(w > 0)[0][0]
         wl, wr = w.copy(), w.copy()
         wl[idx] -= 1
         wr[idx] -= 1
-        left = sigma_construct(wl, b) # results f0
-        right = sigma_construct(wr, b + 1) #results f0 + 1
-
-        if is_false(right): # sigma(f0 ⊕ x) ⊙ 0 = 0 
-            return "0"
-        
-        if is_true(left): # sigma(1 ⊕ x) ⊙ sigma(f0 + 1) = sigma(f0 + 1)
-            return right
-        
-        if is_true(right): # sigma(f0 ⊕ x) ⊙ 1 == sigma(f0 ⊕ x)
-            if is_false(left): # sigma(0 ⊕ x) = x
-                return f"x{idx+1}"
-            else:
-                return f"({left}⊕x{idx+1})"
-            
-        if is_false(left): # sigma(0 ⊕ x) ⊙ sigma(f0 + 1) = x ⊙ sigma(f0 + 1)
-            if is_true(right):
-                return f"x{idx+1}"
-            else:
-                return f"(x{idx+1}⊙{right})"
-            
-        return f"(({left}⊕x{idx+1})⊙{right})"
+        term = sigma_combine(sigma_construct_node(wl, b, cache), sigma_construct_node(wr, b + 1, cache), idx, cache)
 
-def construct_MV_terms(CReLU: CReLUNetwork) -> dict:
-    MV_terms = {}
-    for layer in range(CReLU.num_layers):
-        MV_terms[layer] = {}
-        for neuron in range(CReLU.weights[layer].shape[0]): # number of outputs = number of neurons!
-            w = CReLU.weights[layer][neuron].numpy() # gives us the row associated with the neuron
-            b = CReLU.biases[layer][neuron].item() # gives us the bias associated with the neuron
-            lcm = get_lcm(w + [b]) # TODO we can do this without using lists.
-        
-            MV_term = sigma_construct_rational(w, b, lcm)
-            MV_terms[layer][neuron + 1] = MV_term
-    return MV_terms
+    return cache.store(key, term)
+
+def sigma_construct_integer_from_paper_node(integer_w, integer_b, lcm, cache: SigmaCache) -> Tree.Node:
+    # the construction of the paper works on the rational row
+    return sigma_construct_rational_from_paper_node(integer_w / lcm, integer_b / lcm, lcm, cache)
+
+# the constructions of a row multiplied by its lcm, as in layer_tasks
+sigma_constructions = {"rational": sigma_construct_integer_node, "paper": sigma_construct_integer_from_paper_node}
+
+def sigma_combine(left: Tree.Node, right: Tree.Node, idx: int, cache: SigmaCache) -> Tree.Node:
+    # left is the term of f0 and right the one of f0 + 1, the result is sigma(f0 ⊕ x) ⊙ sigma(f0 + 1)
+    make = cache.table.make
+    if is_false_node(right): # sigma(f0 ⊕ x) ⊙ 0 = 0
+        return make("0")
+
+    if is_true_node(left): # sigma(1 ⊕ x) ⊙ sigma(f0 + 1) = sigma(f0 + 1)
+        return right
+
+    if is_true_node(right): # sigma(f0 ⊕ x) ⊙ 1 == sigma(f0 ⊕ x)
+        if is_false_node(left): # sigma(0 ⊕ x) = x
+            return make(f"x{idx+1}")
+        else:
+            return make("⊕", left, make(f"x{idx+1}"))
+
+    if is_false_node(left): # sigma(0 ⊕ x) ⊙ sigma(f0 + 1) = x ⊙ sigma(f0 + 1)
+        return make("⊙", make(f"x{idx+1}"), right)
+
+    return make("⊙", make("⊕", left, make(f"x{idx+1}")), right)
 
-def construct_MV_terms_from_paper(CReLU):
-    MV_terms = {}
+def layer_tasks(weight: torch.tensor, bias: torch.tensor, layer: int) -> list[tuple[int, int, np.ndarray, int, int, np.ndarray]]:
+    # (layer, neuron, w, b, lcm, support) for every neuron of a layer, the term of a neuron depends on nothing else.
+    # w and b are the row and its bias multiplied by lcm, the lcm of their denominators, as exact integers computed
+    # for the whole layer at once. The row of a sparse weight is given by its stored entries w and their columns support,
+    # never as a dense row; support is None for a dense weight.
+    biases = bias.numpy()
+    if not weight.is_sparse:
+        row_lcms, integer_weights, integer_biases = rational_to_integer(weight.numpy(), biases)
+        return [(layer, neuron + 1, integer_weights[neuron], int(integer_biases[neuron]), int(row_lcms[neuron]), None) for neuron in range(integer_weights.shape[0])]
+
+    weight = weight.coalesce() # entries sorted by row, then by column
+    rows, columns = weight.indices().numpy()
+    row_lcms, integer_values, integer_biases = sparse_rational_to_integer(rows, weight.values().numpy(), biases)
+    bounds = np.searchsorted(rows, np.arange(weight.shape[0] + 1))
+    return [(layer, neuron + 1, integer_values[bounds[neuron]:bounds[neuron + 1]], int(integer_biases[neuron]), int(row_lcms[neuron]), columns[bounds[neuron]:bounds[neuron + 1]])
+            for neuron in range(weight.shape[0])]
+
+def neuron_tasks(CReLU: CReLUNetwork) -> list[tuple[int, int, np.ndarray, int, int, np.ndarray]]:
+    tasks = []
     for layer in range(CReLU.num_layers):
-        MV_terms[layer] = {}
-        for neuron in range(CReLU.weights[layer].shape[0]): # number of outputs = number of neurons!
-            w = CReLU.weights[layer][neuron].numpy() # gives us the row associated with the neuron
-            b = CReLU.biases[layer][neuron].item() # gives us the bias associated with the neuron
-            lcm = get_lcm(w + [b]) # TODO we can do this without using lists.
-            MV_term = sigma_construct_rational_from_paper(w, b, lcm)
-            MV_terms[layer][neuron + 1] = MV_term
+        tasks += layer_tasks(CReLU.weights[layer], CReLU.biases[layer], layer)
+    return tasks
+
+def term_store_key(construction: str, w: np.ndarray, b: int, lcm: int, support: np.ndarray = None) -> bytes:
+    # The exact rational row is given by the integers w, b (as in layer_tasks) and lcm (the atom x_i is the position i in the row,
+    # or the column support[i] of a sparse row)
+    columns = b"" if support is None else b"sparse " + np.asarray(support, dtype=np.int64).tobytes()
+    return hashlib.sha256(f"{construction} {lcm} {int(b)} {len(w)} ".encode() + np.asarray(w, dtype=np.int64).tobytes() + columns).digest()
+
+def rename_atoms(term: Tree.Node, support: np.ndarray, table: Tree.NodeTable) -> Tree.Node:
+    # The term of the stored entries of a sparse row, with x_i renamed to the atom of the column support[i]
+    atoms = {f"x{index + 1}": table.make(f"x{column + 1}") for index, column in enumerate(support.tolist())}
+    return substitute_term(term, atoms, table, {})
+
+def construct_neuron(w: np.ndarray, b: int, lcm: int, construction: str, cache: SigmaCache, store: TermStore = None, support: np.ndarray = None) -> Tree.Node:
+    # The term of one neuron, read from store when it was built before (by any network or process using the same file).
+    # The term of a sparse row is built on its stored entries only, so the memoized subproblems are shared by every
+    # row with the same entries whatever their columns, and then renamed.
+    construct = sigma_constructions[construction]
+    key = term_store_key(construction, w, b, lcm, support) if store is not None else None
+    stored = store.get(key) if store is not None else None
+    if stored is not None:
+        return Tree.import_dag(*stored, cache.table)[0]
+    term = construct(w, b, lcm, cache)
+    if support is not None:
+        term = rename_atoms(term, support, cache.table)
+    if store is not None:
+        store.put(key, *Tree.export_dag([term]))
+    return term
+
+def construct_neuron_terms(tasks: list, construction: str, as_strings: bool, max_nodes: int = None, store: TermStore = None) -> tuple[list, int, int, int, int]:
+    # Runs in the worker processes of construct_terms. Returns the terms of a chunk of neurons (as strings, or as an
+    # export_dag of their nodes since nodes of different processes cannot be shared), the hits and misses of its cache
+    # and those of store
+    cache = SigmaCache(max_nodes=max_nodes)
+    terms = [construct_neuron(w, b, lcm, construction, cache, store, support) for _, _, w, b, lcm, support in tasks]
+    store_hits, store_misses = (store.hits, store.misses) if store is not None else (0, 0)
+    if as_strings:
+        logic = Lukasiewicz()
+        return [logic.generate_formula_from_ast(term) for term in terms], cache.hits, cache.misses, store_hits, store_misses
+    return Tree.export_dag(terms), cache.hits, cache.misses, store_hits, store_misses
+
+def construct_terms(CReLU: CReLUNetwork, construction: str, cache: SigmaCache = None, workers: int = 1, chunksize: int = 16, as_strings: bool = False,
+                    max_nodes: int = None, max_chars: int = None, store: TermStore = None) -> dict:
+    # With workers > 1 the neurons are sent to a process pool in chunks of chunksize, each chunk has its own cache
+    # (whose statistics are added to cache) and the terms are collected in order. Nodes are made in cache.table.
+    # Budgets: more than max_nodes nodes (per cache) or, for strings, more than max_chars characters in all the terms
+    # raise ExtractionBudgetExceeded, whose report tells the neuron where it stopped and how many were done.
+    # With a store, the term of every neuron is looked up on disk first and saved there once built.
+    cache = SigmaCache() if cache is None else cache
+    if max_nodes is None:
+        return construct_cached_terms(CReLU, construction, cache, workers, chunksize, as_strings, max_chars, store)
+    # the budget only holds for this call, a cache passed in keeps its own one afterwards
+    previous_max_nodes, cache.max_nodes = cache.max_nodes, max_nodes
+    try:
+        return construct_cached_terms(CReLU, construction, cache, workers, chunksize, as_strings, max_chars, store)
+    finally:
+        cache.max_nodes = previous_max_nodes
+
+def construct_cached_terms(CReLU: CReLUNetwork, construction: str, cache: SigmaCache, workers: int, chunksize: int, as_strings: bool,
+                           max_chars: int, store: TermStore) -> dict:
+    # construct_terms with the node budget already set on cache
+    tasks = neuron_tasks(CReLU)
+    MV_terms = {layer: {} for layer in range(CReLU.num_layers)}
+    logic = Lukasiewicz()
+    completed, chars = 0, 0
+
+    def check_chars(layer: int, neuron: int) -> None:
+        if max_chars is not None and chars > max_chars:
+            raise ExtractionBudgetExceeded({"stage": "construct", "layer": layer, "neuron": neuron, "completed_neurons": completed,
+                                            "chars": chars, "max_chars": max_chars, **cache.stats()})
+
+    if workers <= 1:
+        for layer, neuron, w, b, lcm, support in tasks:
+            try:
+                term = construct_neuron(w, b, lcm, construction, cache, store, support)
+            except ExtractionBudgetExceeded as error:
+                error.report.update({"layer": layer, "neuron": neuron, "completed_neurons": completed})
+                raise
+            if as_strings:
+                chars += logic.formula_size(term)[1]
+                check_chars(layer, neuron)
+                term = logic.generate_formula_from_ast(term)
+            MV_terms[layer][neuron] = term
+            completed += 1
+        return MV_terms
+
+    chunks = [tasks[start:start + chunksize] for start in range(0, len(tasks), chunksize)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(construct_neuron_terms, chunks, repeat(construction), repeat(as_strings), repeat(cache.max_nodes), repeat(store))
+        try:
+            for chunk, (terms, hits, misses, store_hits, store_misses) in zip(chunks, results):
+                cache.hits += hits
+                cache.misses += misses
+                if store is not None:
+                    store.hits += store_hits
+                    store.misses += store_misses
+                if not as_strings:
+                    terms = Tree.import_dag(*terms, cache.table)
+                for (layer, neuron, _, _, _, _), term in zip(chunk, terms):
+                    if as_strings:
+                        chars += len(term)
+                        check_chars(layer, neuron)
+                    MV_terms[layer][neuron] = term
+                    completed += 1
+        except ExtractionBudgetExceeded as error:
+            error.report.setdefault("completed_neurons", completed)
+            executor.shutdown(wait=False, cancel_futures=True) # the remaining chunks are not waited for
+            raise
     return MV_terms
 
-def compose_MV_terms(CReLU: CReLUNetwork, MV_terms: dict) -> str:
-    for layer in range(1, CReLU.num_layers):
+def construct_MV_term_nodes(CReLU: CReLUNetwork, cache: SigmaCache = None, workers: int = 1, chunksize: int = 16, max_nodes: int = None, store: TermStore = None) -> dict:
+    # Same layout as construct_MV_terms but the terms are nodes of cache.table, built without any string.
+    # cache is shared by every neuron, pass one to keep it (and its statistics) across calls, and store keeps the terms across runs
+    return construct_terms(CReLU, "rational", cache, workers, chunksize, max_nodes=max_nodes, store=store)
+
+def construct_MV_terms(CReLU: CReLUNetwork, cache: SigmaCache = None, workers: int = 1, chunksize: int = 16, max_nodes: int = None, max_chars: int = None,
+                       store: TermStore = None) -> dict:
+    return construct_terms(CReLU, "rational", cache, workers, chunksize, True, max_nodes, max_chars, store)
+
+def construct_MV_terms_from_paper(CReLU, cache: SigmaCache = None, workers: int = 1, chunksize: int = 16, max_nodes: int = None, max_chars: int = None,
+                                  store: TermStore = None):
+    return construct_terms(CReLU, "paper", cache, workers, chunksize, True, max_nodes, max_chars, store)
+
+def check_composition_budget(table: Tree.NodeTable, max_nodes: int, layer: int, neuron: int) -> None:
+    if max_nodes is not None and len(table) > max_nodes:
+        raise ExtractionBudgetExceeded({"stage": "compose", "layer": layer, "neuron": neuron, "nodes": len(table), "max_nodes": max_nodes})
+
+def compose_MV_terms_dag(CReLU: CReLUNetwork, MV_terms: dict, table: Tree.NodeTable = None, max_nodes: int = None) -> tuple[Tree.Node, int]:
+    # Every term is parsed once. The atom x_j of a term of layer l is the node of neuron j of layer l - 1,
+    # so each hidden neuron is stored once and shared by all the neurons of the next layer that use it.
+    # Subterms equal across neurons are shared as well, through the node table.
+    logic = Lukasiewicz()
+    table = Tree.NodeTable() if table is None else table
+    previous_layer = {}
+
+    def make_node(data: str, left: Tree.Node = None, right: Tree.Node = None) -> Tree.Node:
+        if left is None and data in previous_layer:
+            return previous_layer[data]
+        return table.make(data, left, right)
+
+    for layer in range(CReLU.num_layers):
+        current_layer = {}
         for neuron in range(CReLU.weights[layer].shape[0]):
-            for variable in range(CReLU.weights[layer].shape[1]): # number of inputs
-                MV_terms[layer][neuron + 1] = MV_terms[layer][neuron + 1].replace(f'x{variable + 1}', f's{variable + 1}')
-        
+            current_layer[f'x{neuron + 1}'] = logic.parse_formula(MV_terms[layer][neuron + 1], make_node)
+            check_composition_budget(table, max_nodes, layer, neuron + 1)
+        previous_layer = current_layer
+
+    root = previous_layer['x1'] #last layer should only have one neuron
+    return root, Tree.assign_depths(root)
+
+def substitute_term(term: Tree.Node, previous_layer: dict, table: Tree.NodeTable, copies: dict) -> Tree.Node:
+    # Copy of term in table with each atom x_j replaced by previous_layer['x_j'], copies maps the nodes already copied
+    for node in Tree.postorder_nodes(term):
+        if node in copies:
+            continue
+        if node.left == None:
+            copies[node] = previous_layer[node.data] if node.data in previous_layer else table.make(node.data)
+        else:
+            copies[node] = table.make(node.data, copies[node.left], copies[node.right] if node.right != None else None)
+    return copies[term]
+
+def compose_MV_term_nodes(CReLU: CReLUNetwork, MV_terms: dict, table: Tree.NodeTable = None, max_nodes: int = None) -> tuple[Tree.Node, int]:
+    # compose_MV_terms_dag for the terms of construct_MV_term_nodes: the terms of each layer are copied into table
+    # with the atom x_j replaced by the node of neuron j of the previous layer. Subterms shared by the neurons
+    # of a layer are copied once, so the work is linear in the number of distinct nodes of each layer.
+    table = Tree.NodeTable() if table is None else table
+    previous_layer = {}
+
+    for layer in range(CReLU.num_layers):
+        copies = {}
+        current_layer = {}
         for neuron in range(CReLU.weights[layer].shape[0]):
-            for variable in range(CReLU.weights[layer].shape[1]):
-                MV_terms[layer][neuron + 1] = MV_terms[layer][neuron + 1].replace(f's{variable + 1}', MV_terms[layer - 1][variable + 1])
+            current_layer[f'x{neuron + 1}'] = substitute_term(MV_terms[layer][neuron + 1], previous_layer, table, copies)
+            check_composition_budget(table, max_nodes, layer, neuron + 1)
+        previous_layer = current_layer
+
+    root = previous_layer['x1'] #last layer should only have one neuron
+    return root, Tree.assign_depths(root)
+
+def extract_MV_term(CReLU: CReLUNetwork, cache: SigmaCache = None, max_nodes: int = None, store: TermStore = None) -> tuple[Tree.Node, int]:
+    # The formula of the network as a DAG, straight from the weights: no string is built or parsed.
+    # Lukasiewicz().generate_formula_from_ast writes it out when the text is needed.
+    return compose_MV_term_nodes(CReLU, construct_MV_term_nodes(CReLU, cache, max_nodes=max_nodes, store=store), max_nodes=max_nodes)
+
+class ExtractionSession:
+    '''
+    Extraction of a network that changes a little at a time (fine-tuning steps, checkpoints of the same run).
+    The session keeps the weights it last saw, the term of every neuron and its composed node. update compares the
+    rows of the new network with the kept ones, builds the terms of the changed rows only, and composes again only the
+    neurons whose term changed or that use an atom whose composed node changed. The composed nodes live in one node
+    table, so a neuron composed again to the same formula gives back the same node and stops the change from spreading.
+    After each update the table keeps only the nodes the current neurons reach.
+    '''
+    def __init__(self, cache: SigmaCache = None, store: TermStore = None) -> None:
+        self.cache = SigmaCache() if cache is None else cache
+        self.store = store
+        self.table = Tree.NodeTable()
+        self.rows = [] # per layer, the (w, b, support) of each neuron as bytes
+        self.terms = [] # per layer, the term of each neuron (nodes of cache.table)
+        self.composed = [] # per layer, 'x_j' -> composed node of neuron j (nodes of table)
+        self.term_atoms = {}
+        self.root, self.depth = None, 0
+        self.reports = []
+
+    def atoms(self, term: Tree.Node) -> set:
+        if term not in self.term_atoms:
+            self.term_atoms[term] = {node.data for node in Tree.postorder_nodes(term) if node.left == None}
+        return self.term_atoms[term]
+
+    @staticmethod
+    def row_signature(task: tuple) -> tuple:
+        _, _, w, b, lcm, support = task
+        return (np.asarray(w, dtype=np.int64).tobytes(), b, lcm, None if support is None else support.tobytes())
+
+    def update(self, CReLU: CReLUNetwork) -> dict:
+        # Brings the session to CReLU and returns how many neurons of each layer were reused and rebuilt
+        layers = []
+        previous_changed = set()
+        previous_layer = {}
+        for layer in range(CReLU.num_layers):
+            tasks = layer_tasks(CReLU.weights[layer], CReLU.biases[layer], layer)
+            signatures = [self.row_signature(task) for task in tasks]
+            if layer >= len(self.terms):
+                self.rows.append([])
+                self.terms.append([None] * len(tasks))
+                self.composed.append({})
+            elif len(self.terms[layer]) != len(tasks):
+                self.terms[layer] = [None] * len(tasks)
+                self.composed[layer] = {}
+            old_signatures = self.rows[layer] if len(self.rows[layer]) == len(tasks) else [None] * len(tasks)
+            changed = [signature != old for signature, old in zip(signatures, old_signatures)]
+
+            rows = [row for row in range(len(tasks)) if changed[row]]
+            for row in rows:
+                _, _, w, b, lcm, support = tasks[row]
+                self.terms[layer][row] = construct_neuron(w, b, lcm, "rational", self.cache, self.store, support)
+
+            copies = {}
+            current_layer, current_changed = {}, set()
+            composed_rebuilt = 0
+            for neuron, term in enumerate(self.terms[layer]):
+                atom = f'x{neuron + 1}'
+                old = self.composed[layer].get(atom)
+                if old is None or changed[neuron] or not previous_changed.isdisjoint(self.atoms(term)):
+                    current_layer[atom] = substitute_term(term, previous_layer, self.table, copies)
+                    composed_rebuilt += 1
+                    if current_layer[atom] is not old:
+                        current_changed.add(atom)
+                else:
+                    current_layer[atom] = old
+
+            layers.append({"neurons": len(tasks), "terms_rebuilt": len(rows), "terms_reused": len(tasks) - len(rows),
+                           "composed_rebuilt": composed_rebuilt, "composed_reused": len(tasks) - composed_rebuilt})
+            self.rows[layer] = signatures
+            self.composed[layer] = current_layer
+            previous_layer, previous_changed = current_layer, current_changed
+
+        del self.rows[CReLU.num_layers:], self.terms[CReLU.num_layers:], self.composed[CReLU.num_layers:]
+        # the nodes and terms of the replaced neurons are dropped, so the session stays the size of the current network
+        self.table.retain([node for composed in self.composed for node in composed.values()])
+        terms = {term for layer_terms in self.terms for term in layer_terms}
+        self.term_atoms = {term: atoms for term, atoms in self.term_atoms.items() if term in terms}
+        self.root = previous_layer['x1'] #last layer should only have one neuron
+        self.depth = Tree.assign_depths(self.root)
+        report = {"layers": layers, "neurons_reused": sum(info["terms_reused"] for info in layers), "neurons_rebuilt": sum(info["terms_rebuilt"] for info in layers),
+                  "composed_reused": sum(info["composed_reused"] for info in layers), "composed_rebuilt": sum(info["composed_rebuilt"] for info in layers)}
+        self.reports.append(report)
+        return report
+
+    def formula(self) -> str:
+        return Lukasiewicz().generate_formula_from_ast(self.root)
+
+def compose_MV_terms(CReLU: CReLUNetwork, MV_terms: dict, max_nodes: int = None, max_chars: int = None) -> str:
+    # The formula written out in full, its length can grow exponentially with the number of layers: compose_MV_terms_dag
+    # gives the same formula with shared subterms, which the TLogic methods and the solvers take directly.
+    # The length is known before the string is written, beyond max_chars ExtractionBudgetExceeded is raised instead.
+    logic = Lukasiewicz()
+    root, _ = compose_MV_terms_dag(CReLU, MV_terms, max_nodes=max_nodes)
+    if max_chars is not None:
+        tree_nodes, chars = logic.formula_size(root)
+        if chars > max_chars:
+            raise ExtractionBudgetExceeded({"stage": "compose", "chars": chars, "max_chars": max_chars, "tree_nodes": tree_nodes, "nodes": Tree.count_nodes(root)[1]})
+    return logic.generate_formula_from_ast(root)
+
+def sigma_size_bounds(magnitude: int, lcm: int) -> tuple[int, int, int, int]:
+    # Upper bounds for the rational sigma construction of a row whose weights, scaled to integers by lcm, have magnitudes
+    # adding up to magnitude: the distinct memoized subproblems, the nodes they make, and the nodes and atom occurrences
+    # of the term written as a tree. Each step of sigma_construct_node takes one unit of weight off, makes at most three
+    # nodes (⊙, ⊕ and the atom) over two subproblems, and a path is negated at most once; the lcm shifted copies add a δ
+    # and a ⊕ each.
+    states = (magnitude + 1) * (magnitude + lcm)
+    return states, 3 * states + 2 * lcm, lcm * 4 * 2 ** magnitude, lcm * (2 ** magnitude - 1)
+
+def predict_extraction_size(network: ReLUNetwork | CReLUNetwork, max_states: int = 1000000, build_terms: bool = False) -> dict:
+    # Size of the extraction before anything is built. A ReLU network is first transformed, and the split counts of its
+    # neurons are reported. For each neuron, the lcm of its row scales the weights to integers, and the sum of their
+    # magnitudes bounds the construction (see sigma_size_bounds). The bounds only read the weights: the nodes of the
+    # terms and the size of the composed formula, where the atom x_j of a term weighs as much as the formula of neuron j
+    # of the previous layer.
+    # With build_terms the exact sizes are counted as well, which builds the term of every neuron under max_states with
+    # the memoized constructions (nodes only) and so costs as much as the construct step. Neurons over max_states are
+    # reported in skipped_neurons and the exact sizes depending on them are None.
+    logic = Lukasiewicz()
+    if isinstance(network, CReLUNetwork):
+        CReLU, splits = network, [None] * network.num_layers
+    else:
+        CReLU = transform_ReLU_to_CReLU(network)
+        splits = [split_counts(network.weights[layer], network.biases[layer]).tolist() for layer in range(network.num_layers - 1)] + [None]
+
+    cache = SigmaCache()
+    layers, skipped = [], []
+    previous_sizes = {}
+    previous_tree_bound = 1 # the inputs are atoms
+    term_nodes_bound, width = 0, len(f"x{CReLU.weights[0].shape[1]}")
+    for layer in range(CReLU.num_layers):
+        tasks = layer_tasks(CReLU.weights[layer], CReLU.biases[layer], layer)
+        nodes_before = len(cache.table)
+        sizes = {}
+        max_lcm, max_magnitude, layer_nodes_bound, tree_bound = 1, 0, 0, 0
+
+        for _, neuron, w, b, lcm, support in tasks:
+            magnitude = int(np.abs(w).sum())
+            max_lcm, max_magnitude = max(max_lcm, lcm), max(max_magnitude, magnitude)
+            states, nodes, tree_nodes, occurrences = sigma_size_bounds(magnitude, lcm)
+            layer_nodes_bound += nodes
+            tree_bound = max(tree_bound, tree_nodes + occurrences * (previous_tree_bound - 1))
+            if not build_terms:
+                continue
+            if states > max_states:
+                skipped.append({"layer": layer, "neuron": neuron, "lcm": lcm, "weight_magnitude": magnitude, "states": states})
+                sizes[f'x{neuron}'] = None
+                continue
+            term = construct_neuron(w, b, lcm, "rational", cache, support=support)
+            if any(size is None for size in previous_sizes.values()):
+                sizes[f'x{neuron}'] = None # not counted as soon as one neuron of the previous layer was skipped
+            else:
+                sizes[f'x{neuron}'] = logic.formula_size(term, previous_sizes)
+
+        # a node writes at most its label and, for ¬ and δ, four more characters
+        width = max(width, 4 + len(f"δ{max_lcm}"))
+        term_nodes_bound += layer_nodes_bound
+        known = [size for size in sizes.values() if size is not None]
+        layers.append({"neurons": len(tasks), "split_counts": splits[layer], "max_lcm": max_lcm, "max_weight_magnitude": max_magnitude,
+                       "term_nodes_bound": layer_nodes_bound, "formula_tree_nodes_bound": tree_bound,
+                       "term_nodes": len(cache.table) - nodes_before if build_terms else None,
+                       "max_formula_chars": max(chars for _, chars in known) if known else None})
+        previous_sizes, previous_tree_bound = sizes, tree_bound
 
-    return MV_terms[CReLU.num_layers - 1][1] #last layer should only have one neuron
+    output = previous_sizes.get('x1')
+    return {"layers": layers, "term_nodes_bound": term_nodes_bound, "formula_tree_nodes_bound": previous_tree_bound,
+            "formula_chars_bound": previous_tree_bound * width, "term_nodes": len(cache.table) if build_terms else None,
+            "formula_tree_nodes": output[0] if output else None, "formula_chars": output[1] if output else None,
+            "skipped_neurons": skipped, "exact": build_terms and not skipped}
 
 def tensor_to_valuation(tensor: torch.tensor) -> dict:
     val = {}
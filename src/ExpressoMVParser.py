@@ -1,5 +1,4 @@
 from src.TLogics import *
-from itertools import product
 import os
 
 def BinaryVectorEncoder(values: list) -> tuple[dict, dict]:
@@ -18,22 +17,77 @@ def BinaryVectorEncoder(values: list) -> tuple[dict, dict]:
 
     return value_to_binary_vector, binary_vector_to_value
 
-def FormulaToTruthTable(formula: str, TLogic, variables: list[str], values:list, value_to_binary_vector: dict) -> dict:
-
+def TruthValuePositions(TLogic, program, value_array: np.ndarray, valuations: np.ndarray, variables: list[str], chunk_size: int) -> np.ndarray:
+    # The indices in value_array of the values of the formula on the rows of valuations, evaluated with floats
+    outputs = TLogic.evaluate_formula_batch(program, valuations, variables, chunk_size)
+    matches = np.isclose(outputs[:, None], value_array[None, :], rtol=0, atol=1e-9)
+    found = matches.any(axis=1)
+    if not found.all():
+        raise ValueError(f"The formula takes the value {outputs[~found][0]}, which is not one of the truth values {value_array.tolist()}.")
+    return matches.argmax(axis=1)
+
+def TruthTableChunks(formula: str, TLogic, variables: list[str], values: list, chunk_size: int = 65536):
+    # Yields the truth table in blocks of at most chunk_size rows, in the order of product(values, repeat=num_variables).
+    # Each block is (inputs, outputs): the indices in values of the variables of every row and of the value of the formula.
+    # Row r is read as a number in base len(values), so a block is computed from its range of row numbers alone.
+    # When values are the Łukasiewicz chain {0, 1/k, ..., 1} (in any order) the blocks are evaluated with the lookup tables of L_k,
+    # the rows where a subformula leaves L_k (δ_n of a value of L_k need not be in it) are evaluated with floats
     num_variables = len(variables)
+    num_values = len(values)
+    value_array = np.array(values, dtype=np.float64)
+    program = TLogic.compile_formula(formula)
+    place_values = num_values ** np.arange(num_variables - 1, -1, -1, dtype=np.int64)
+
+    chain = None
+    if isinstance(TLogic, Lukasiewicz) and num_values > 1:
+        k = num_values - 1
+        chain_indices = np.rint(value_array * k).astype(np.int64)
+        if np.array_equal(np.sort(chain_indices), np.arange(num_values)) and np.allclose(chain_indices / k, value_array, rtol=0, atol=1e-9):
+            chain = FiniteLukasiewicz(k)
+            position_of_index = np.argsort(chain_indices)
+
+    for start in range(0, num_values ** num_variables, chunk_size):
+        rows = np.arange(start, min(start + chunk_size, num_values ** num_variables), dtype=np.int64)
+        inputs = (rows[:, None] // place_values[None, :]) % num_values
+
+        if chain is not None:
+            outputs = chain.evaluate_formula_indices(program, chain_indices[inputs], variables)
+            undefined = outputs == chain.undefined
+            if not undefined.any():
+                yield inputs, position_of_index[outputs]
+                continue
+            positions = np.empty(len(rows), dtype=np.int64)
+            positions[~undefined] = position_of_index[outputs[~undefined]]
+            positions[undefined] = TruthValuePositions(TLogic, program, value_array, value_array[inputs[undefined]], variables, chunk_size)
+            yield inputs, positions
+            continue
+
+        yield inputs, TruthValuePositions(TLogic, program, value_array, value_array[inputs], variables, chunk_size)
+
+def WriteTruthTableRows(pla_file, formula: str, TLogic, variables: list[str], values: list, value_to_binary_vector: dict, chunk_size: int = 65536) -> None:
+    # Streams the "inputs output" lines of the truth table to pla_file one block at a time, so memory does not grow with the table.
+    # The lines of a block are written as one character matrix: the codes of the inputs, a space, the code of the output and a newline.
+    codes = np.array([[ord(bit) for bit in value_to_binary_vector[value]] for value in values], dtype=np.uint8)
+    num_bits = codes.shape[1]
+    num_variables = len(variables)
+    width = (num_variables + 1) * num_bits + 2
 
-    ast, _ = TLogic.generate_ast(formula)
-
-    possible_combinations = list(product(values, repeat=num_variables))
-
+    for inputs, outputs in TruthTableChunks(formula, TLogic, variables, values, chunk_size):
+        lines = np.empty((len(outputs), width), dtype=np.uint8)
+        lines[:, :num_variables * num_bits] = codes[inputs].reshape(len(outputs), num_variables * num_bits)
+        lines[:, num_variables * num_bits] = ord(" ")
+        lines[:, num_variables * num_bits + 1:-1] = codes[outputs]
+        lines[:, -1] = ord("\n")
+        pla_file.write(lines.tobytes().decode("ascii"))
 
+def FormulaToTruthTable(formula: str, TLogic, variables: list[str], values:list, value_to_binary_vector: dict) -> dict:
+    # The whole table in memory, WriteTruthTableRows streams it instead
+    codes = [value_to_binary_vector[value] for value in values]
     truth_table = {}
 
-    for combination in possible_combinations:
-        assignment = {variables[i]: combination[i] for i in range(num_variables)}
-        output = TLogic.evaluate_formula(ast, assignment)
-        truth_table[''.join([value_to_binary_vector[combination[i]] for i in range(num_variables)])] = value_to_binary_vector[output]
-
+    for inputs, outputs in TruthTableChunks(formula, TLogic, variables, values):
+        for row, output in zip(inputs.tolist(), outputs.tolist()):
+            truth_table[''.join([codes[i] for i in row])] = codes[output]
 
     return truth_table
 
@@ -45,13 +99,10 @@ def ToExpressoMVParser(formula: str, TLogic, variables: list[str], values:list,
 
     size_of_variable = len(next(iter(value_to_binary_vector.values())))
 
-    truth_table = FormulaToTruthTable(formula, TLogic, variables, values, value_to_binary_vector)
-
     with open('espresso_file.pla', 'w+') as espresso_file:
         espresso_file.write(f'.i {num_variables * size_of_variable}\n')
         espresso_file.write(f'.o {size_of_variable}\n') # + 1 because of output
-        for inputs in truth_table.keys():
-            espresso_file.write(f'{inputs} {truth_table[inputs]}\n')
+        WriteTruthTableRows(espresso_file, formula, TLogic, variables, values, value_to_binary_vector)
 
     os.system("src/espresso-logic/bin/espresso espresso_file.pla > out.pla")
 
@@ -145,12 +196,14 @@ def minimize_delta_formulas(formula: str, values: list) -> str:
     return formula
                 
 
-expression = "(¬((δ_2 (((x3⊙(¬x2))⊕x1)⊙((¬x2)⊕x3)))⊕(δ_2 (x1⊙(x3⊙(¬x2))))))"
+# running the module directly minimizes an example, importing it does not touch out.pla and espresso_file.pla
+if __name__ == "__main__":
+    expression = "(¬((δ_2 (((x3⊙(¬x2))⊕x1)⊙((¬x2)⊕x3)))⊕(δ_2 (x1⊙(x3⊙(¬x2))))))"
 
-formula = minimize_delta_formulas(expression, [0, 0.5, 1])
+    formula = minimize_delta_formulas(expression, [0, 0.5, 1])
 
-print(formula)
+    print(formula)
 
-TLogic = Lukasiewicz()
-ast, _ = TLogic.generate_ast(formula)
-print(TLogic.evaluate_formula(ast, {"x1":0 , "x2": 0, "x3": 0}))
\ No newline at end of file
+    TLogic = Lukasiewicz()
+    ast, _ = TLogic.generate_ast(formula)
+    print(TLogic.evaluate_formula(ast, {"x1":0 , "x2": 0, "x3": 0}))
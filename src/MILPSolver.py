@@ -1,7 +1,10 @@
 from pyscipopt import *
 from src.TLogics import *
 
-def ParseToSCIOPT(m: Model, formula: str, atom_vars={}):
+def ParseToSCIOPT(m: Model, formula: str, atom_vars=None):
+    if atom_vars is None:
+        atom_vars = {}
+
     if TLogic.is_atom(formula):
         if formula not in atom_vars:
             atom_vars[formula] = m.addVar(vtype="C", lb=0, ub=1, name=formula)
@@ -61,12 +64,71 @@ def ParseToSCIOPT(m: Model, formula: str, atom_vars={}):
 
         return None
 
+def EncodeToSCIOPT(m: Model, root: Tree.Node, atom_vars=None):
+    # One variable per unique node of the DAG, so a shared subterm is encoded once.
+    # Variables are named after the connective and the position of the node in the encoding order.
+    if atom_vars is None:
+        atom_vars = {}
+
+    exprs = {}
+    for index, node in enumerate(Tree.postorder_nodes(root)):
+        if node.left is None:
+            if TLogic.is_atom(node.data):
+                if node.data not in atom_vars:
+                    atom_vars[node.data] = m.addVar(vtype="C", lb=0, ub=1, name=node.data)
+                exprs[node] = atom_vars[node.data]
+            else:
+                exprs[node] = float(node.data)
+            continue
+
+        left_expr = exprs[node.left]
+        right_expr = exprs[node.right] if node.right is not None else None
+
+        if node.data == "¬":
+            neg_var = m.addVar(vtype="C", lb=0, ub=1, name=f"neg{index}")
+            m.addCons(neg_var == 1 - left_expr)
+            exprs[node] = neg_var
+
+        elif node.data == "⊙":
+            conj_var = m.addVar(vtype="C", lb=0, ub=1, name=f"conj{index}")
+            m.addCons(conj_var <= left_expr)
+            m.addCons(conj_var <= right_expr)
+            m.addCons(conj_var >= left_expr + right_expr - 1)
+            exprs[node] = conj_var
+
+        elif node.data == "⊕":
+            disj_var = m.addVar(vtype="C", lb=0, ub=1, name=f"disj{index}")
+            m.addCons(disj_var >= left_expr)
+            m.addCons(disj_var >= right_expr)
+            m.addCons(disj_var <= left_expr + right_expr)
+            m.addCons(disj_var <= 1)
+            exprs[node] = disj_var
+
+        elif node.data == "⇒":
+            impl_var = m.addVar(vtype="C", lb=0, ub=1, name=f"impl{index}")
+            m.addCons(impl_var >= right_expr)
+            m.addCons(impl_var >= 1 - left_expr)
+            m.addCons(impl_var <= 1 - left_expr + right_expr)
+            exprs[node] = impl_var
+
+        elif node.data[0] == "δ":
+            n = int(node.data[1:])
+            delta_var = m.addVar(vtype="C", lb=0, ub=1, name=f"delta_{n}_{index}")
+            m.addCons(delta_var == left_expr / n)
+            exprs[node] = delta_var
+
+        else:
+            return None
+
+    return exprs[root]
+
 def SolveFormulaMILP(formula: str):
     model = Model()
     model.hideOutput()
     
     atom_vars = {}
-    final_expr = ParseToSCIOPT(model, formula, atom_vars)
+    root, _ = Lukasiewicz().generate_dag(formula)
+    final_expr = EncodeToSCIOPT(model, root, atom_vars)
     
     if final_expr is not None:
         model.addCons(final_expr == 1)
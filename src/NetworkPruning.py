@@ -0,0 +1,189 @@
+import torch as torch
+import warnings
+from src.ReLUNetwork import ReLUNetwork
+from src.CReLUNetwork import CReLUNetwork
+
+'''
+Pruning of ReLU and CReLU networks before the extraction, for inputs in [0,1]^n.
+Interval bound propagation gives, layer by layer, the range of every hidden neuron. A neuron whose activation is the
+same at both ends of its range is constant: always 0 (dead), always 1 after the clipping of a CReLU (saturated), or
+some other value. It is removed and its value is folded into the biases of the next layer. A neuron with the same
+row and bias as an earlier one of its layer is merged into it (its column of the next layer is added to the other one),
+and a neuron that the next layer does not use is removed. The last layer is never pruned and the inputs are kept.
+The same bounds show where an activation never changes its input: then the layers on both sides of it are one affine
+map, and fuse_network multiplies them into a single layer, which removes the pass-through neurons that carry values.
+'''
+
+def activation(network: ReLUNetwork | CReLUNetwork, x: torch.tensor) -> torch.tensor:
+    return torch.clamp(x, min=0, max=1) if isinstance(network, CReLUNetwork) else torch.clamp(x, min=0)
+
+def layer_bounds(weight: torch.tensor, bias: torch.tensor, lower: torch.tensor, upper: torch.tensor) -> tuple[torch.tensor, torch.tensor]:
+    # (lower, upper) bounds of weight @ x + bias for lower <= x <= upper
+    weight, bias = weight.to(torch.float64), bias.to(torch.float64)
+    if weight.is_sparse:
+        weight = weight.coalesce()
+        positive = torch.sparse_coo_tensor(weight.indices(), weight.values().clamp(min=0), weight.shape, check_invariants=False)
+        negative = torch.sparse_coo_tensor(weight.indices(), weight.values().clamp(max=0), weight.shape, check_invariants=False)
+        return torch.mv(positive, lower) + torch.mv(negative, upper) + bias, torch.mv(positive, upper) + torch.mv(negative, lower) + bias
+    positive, negative = weight.clamp(min=0), weight.clamp(max=0)
+    return positive @ lower + negative @ upper + bias, positive @ upper + negative @ lower + bias
+
+def input_bounds(network: ReLUNetwork | CReLUNetwork) -> tuple[torch.tensor, torch.tensor]:
+    inputs = network.weights[0].shape[1]
+    return torch.zeros(inputs, dtype=torch.float64), torch.ones(inputs, dtype=torch.float64)
+
+def interval_bounds(network: ReLUNetwork | CReLUNetwork) -> list[tuple[torch.tensor, torch.tensor]]:
+    # (lower, upper) bounds of the pre-activation of every neuron of every layer over [0,1]^n
+    lower, upper = input_bounds(network)
+    bounds = []
+    for layer in range(network.num_layers):
+        pre_lower, pre_upper = layer_bounds(network.weights[layer], network.biases[layer], lower, upper)
+        bounds.append((pre_lower, pre_upper))
+        lower, upper = activation(network, pre_lower), activation(network, pre_upper)
+    return bounds
+
+def network_outputs(network: ReLUNetwork | CReLUNetwork, inputs: torch.tensor) -> torch.tensor:
+    # Outputs of the network for a batch of inputs (one per row), without the nn.Linear layers of construct_layers
+    x = inputs.to(torch.float64)
+    for layer in range(network.num_layers):
+        weight = network.weights[layer].to(torch.float64)
+        x = (torch.sparse.mm(weight, x.T).T if weight.is_sparse else x @ weight.T) + network.biases[layer].to(torch.float64)
+        if layer != network.num_layers - 1:
+            x = activation(network, x)
+    return x
+
+def prune_layer(network: ReLUNetwork | CReLUNetwork, weights: list, biases: list, layer: int, lower: torch.tensor, upper: torch.tensor) -> dict:
+    # Prunes the neurons of layer (a hidden layer) in weights and biases, given the bounds of its pre-activations.
+    # Sparse weights are made dense for the two layers involved and stored back sparse.
+    sparse, next_sparse = weights[layer].is_sparse, weights[layer + 1].is_sparse
+    weight = weights[layer].to_dense() if sparse else weights[layer]
+    next_weight = weights[layer + 1].to_dense() if next_sparse else weights[layer + 1]
+    bias, next_bias = biases[layer], biases[layer + 1].clone()
+    if weight.shape[0] == 1 and not weight.any() and bias[0] == 0 and not next_weight.any(): # what is left of a layer pruned before
+        return {"dead": 0, "saturated": 0, "constant": 0, "duplicates": 0, "unused": 0, "neurons_after": 1}
+    low, high = activation(network, lower), activation(network, upper)
+    constant = low == high
+    unused = (next_weight == 0).all(dim=0) & ~constant
+
+    # the value of a constant neuron is added to the biases of the next layer, through its column
+    next_bias += (next_weight[:, constant] * low[constant].to(next_weight.dtype)).sum(dim=1)
+    keep = ~(constant | unused)
+
+    # duplicate rows: the column of a copy is added to the column of the first one
+    next_weight = next_weight.clone()
+    first = {}
+    duplicates = 0
+    for neuron in torch.nonzero(keep).flatten().tolist():
+        key = (tuple(weight[neuron].tolist()), bias[neuron].item())
+        if key in first:
+            next_weight[:, first[key]] += next_weight[:, neuron]
+            keep[neuron] = False
+            duplicates += 1
+        else:
+            first[key] = neuron
+
+    if not keep.any(): # a layer keeps one neuron, with no input and bias 0 it is 0 and the next layer does not use it
+        kept_weight, kept_bias = torch.zeros((1, weight.shape[1]), dtype=weight.dtype), torch.zeros(1, dtype=bias.dtype)
+        kept_next_weight = torch.zeros((next_weight.shape[0], 1), dtype=next_weight.dtype)
+    else:
+        kept_weight, kept_bias, kept_next_weight = weight[keep], bias[keep], next_weight[:, keep]
+
+    weights[layer], biases[layer] = kept_weight.to_sparse() if sparse else kept_weight, kept_bias
+    weights[layer + 1], biases[layer + 1] = kept_next_weight.to_sparse() if next_sparse else kept_next_weight, next_bias
+    saturated = constant & (low == 1) if isinstance(network, CReLUNetwork) else torch.zeros_like(constant)
+    return {"dead": int((constant & (low == 0)).sum()), "saturated": int(saturated.sum()), "constant": int((constant & (low != 0) & ~saturated).sum()),
+            "duplicates": duplicates, "unused": int(unused.sum()), "neurons_after": kept_weight.shape[0]}
+
+def count_parameters(weights: list[torch.tensor], biases: list[torch.tensor]) -> int:
+    # the stored entries of a sparse weight
+    return sum(weight._nnz() if weight.is_sparse else weight.numel() for weight in weights) + sum(bias.numel() for bias in biases)
+
+def check_outputs(network: ReLUNetwork | CReLUNetwork, optimized: ReLUNetwork | CReLUNetwork, samples: int, seed: int, tolerance: float) -> tuple[int, float]:
+    # The outputs of both networks on the corners of [0,1]^n (up to 2^10 of them) and on random inputs,
+    # a difference above tolerance raises a ValueError. Returns the number of inputs and the largest difference.
+    inputs = network.weights[0].shape[1]
+    generator = torch.Generator().manual_seed(seed)
+    corners = torch.tensor([[(corner >> bit) & 1 for bit in range(inputs)] for corner in range(2 ** min(inputs, 10))], dtype=torch.float64)
+    points = torch.cat((corners, torch.rand((samples, inputs), generator=generator, dtype=torch.float64)))
+    difference = (network_outputs(network, points) - network_outputs(optimized, points)).abs().max().item()
+    if difference > tolerance:
+        raise ValueError(f"The optimized network differs from the original by {difference} on a sampled input.")
+    return points.shape[0], difference
+
+def prune_network(network: ReLUNetwork | CReLUNetwork, samples: int = 1000, seed: int = 0, tolerance: float = 1e-9) -> tuple[ReLUNetwork | CReLUNetwork, dict]:
+    # Returns the pruned network (of the same class, the given one is not modified) and a report of what was removed.
+    # The passes are repeated until nothing changes, since removing a neuron can leave the one feeding it unused.
+    # The outputs of both networks are compared on the corners of [0,1]^n (up to 2^10 of them) and on random inputs,
+    # a difference above tolerance raises a ValueError.
+    weights, biases = list(network.weights), list(network.biases)
+    layers = [{"neurons_before": weight.shape[0], "dead": 0, "saturated": 0, "constant": 0, "duplicates": 0, "unused": 0} for weight in weights[:-1]]
+    passes = 0
+    while True:
+        passes += 1
+        before = [weight.shape[0] for weight in weights]
+        lower, upper = input_bounds(network)
+        for layer in range(network.num_layers - 1):
+            # the bounds of a layer only depend on the layers before it, which are already pruned and give the same ranges
+            counts = prune_layer(network, weights, biases, layer, *layer_bounds(weights[layer], biases[layer], lower, upper))
+            pre_lower, pre_upper = layer_bounds(weights[layer], biases[layer], lower, upper) # of the neurons left
+            lower, upper = activation(network, pre_lower), activation(network, pre_upper)
+            for key in ["dead", "saturated", "constant", "duplicates", "unused"]:
+                layers[layer][key] += counts[key]
+            layers[layer]["neurons_after"] = counts["neurons_after"]
+        if [weight.shape[0] for weight in weights] == before:
+            break
+
+    pruned = type(network)(weights, biases)
+    checked, difference = check_outputs(network, pruned, samples, seed, tolerance)
+
+    report = {"layers": layers, "passes": passes,
+              "neurons_before": sum(info["neurons_before"] for info in layers), "neurons_after": sum(info["neurons_after"] for info in layers),
+              "parameters_before": count_parameters(network.weights, network.biases), "parameters_after": count_parameters(weights, biases),
+              "checked_inputs": checked, "max_difference": difference}
+    return pruned, report
+
+def count_pass_through(weight: torch.tensor, bias: torch.tensor) -> int:
+    # Neurons that copy one input: a single weight 1 and bias 0
+    dense = weight.to_dense() if weight.is_sparse else weight
+    return int((((dense != 0).sum(dim=1) == 1) & (dense.sum(dim=1) == 1) & (bias == 0)).sum())
+
+def fuse_layers(weight: torch.tensor, bias: torch.tensor, next_weight: torch.tensor, next_bias: torch.tensor) -> tuple[torch.tensor, torch.tensor]:
+    # next_weight (weight x + bias) + next_bias as one layer, sparse if one of the weights is
+    if weight.is_sparse or next_weight.is_sparse:
+        weight = weight if weight.is_sparse else weight.to_sparse()
+        next_weight = next_weight if next_weight.is_sparse else next_weight.to_sparse()
+        with warnings.catch_warnings(): # the sparse product goes through the beta CSR kernels
+            warnings.simplefilter("ignore", UserWarning)
+            fused = torch.sparse.mm(next_weight, weight).coalesce()
+        return fused, torch.mv(next_weight, bias.to(next_weight.dtype)) + next_bias
+    return next_weight @ weight, next_weight @ bias.to(next_weight.dtype) + next_bias
+
+def fuse_network(network: ReLUNetwork | CReLUNetwork, samples: int = 1000, seed: int = 0, tolerance: float = 1e-9) -> tuple[ReLUNetwork | CReLUNetwork, dict]:
+    # Returns the network (of the same class, the given one is not modified) where every activation that is the identity
+    # on the ranges of its layer is removed, with the layers on both sides of it multiplied into one, and a report.
+    # A ReLU is the identity on a range that starts at 0 or above, a CReLU on a range inside [0,1]. The outputs of
+    # both networks are compared as in prune_network.
+    weights, biases = list(network.weights), list(network.biases)
+    fused_layers, pass_through = 0, 0
+    lower, upper = input_bounds(network)
+    layer = 0
+    while layer < len(weights) - 1:
+        pre_lower, pre_upper = layer_bounds(weights[layer], biases[layer], lower, upper)
+        identity = bool((pre_lower >= 0).all()) and (not isinstance(network, CReLUNetwork) or bool((pre_upper <= 1).all()))
+        if identity:
+            pass_through += count_pass_through(weights[layer], biases[layer])
+            weights[layer + 1], biases[layer + 1] = fuse_layers(weights[layer], biases[layer], weights[layer + 1], biases[layer + 1])
+            del weights[layer], biases[layer]
+            fused_layers += 1
+        else:
+            lower, upper = activation(network, pre_lower), activation(network, pre_upper)
+            layer += 1
+
+    fused = type(network)(weights, biases)
+    checked, difference = check_outputs(network, fused, samples, seed, tolerance)
+    report = {"layers_before": network.num_layers, "layers_after": fused.num_layers, "fused_layers": fused_layers,
+              "pass_through_removed": pass_through,
+              "neurons_before": sum(weight.shape[0] for weight in network.weights[:-1]), "neurons_after": sum(weight.shape[0] for weight in weights[:-1]),
+              "parameters_before": count_parameters(network.weights, network.biases), "parameters_after": count_parameters(weights, biases),
+              "checked_inputs": checked, "max_difference": difference}
+    return fused, report
@@ -1,5 +1,6 @@
 import torch as torch
 import torch.nn as nn
+import numpy as np
 from src.utils.math_utils import get_lcm
 
 #CReLU activation function
@@ -11,6 +12,65 @@ class CReLU(nn.Module):
         clipped_x = torch.clamp(x, min=0, max=1)
         return clipped_x
 
+# nn.Linear for a sparse weight (torch.sparse_coo), the products never densify it
+class SparseLinear(nn.Module):
+    def __init__(self, weight: torch.tensor, bias: torch.tensor) -> None:
+        super().__init__()
+        self.weight = weight
+        self.bias = bias
+
+    def forward(self, x):
+        if x.dim() == 1:
+            return torch.mv(self.weight, x) + self.bias
+        return torch.sparse.mm(self.weight, x.T).T + self.bias
+
+def linear_layer(weight: torch.tensor, bias: torch.tensor) -> nn.Module:
+    if weight.is_sparse:
+        return SparseLinear(weight, bias)
+    layer = nn.Linear(weight.shape[1], weight.shape[0])
+    layer.weight.data = weight
+    layer.bias.data = bias
+    return layer
+
+def block_diagonal(blocks: list[torch.tensor], sparse: bool = False) -> torch.tensor:
+    # The blocks along the diagonal of one matrix, allocated once at its final size. With sparse the result is a
+    # torch.sparse_coo matrix holding only the entries of the blocks, so its memory is linear in theirs.
+    rows, columns = sum(block.shape[0] for block in blocks), sum(block.shape[1] for block in blocks)
+    dtype = blocks[0].dtype
+    if not sparse:
+        weight = torch.zeros((rows, columns), dtype=dtype)
+        row, column = 0, 0
+        for block in blocks:
+            weight[row:row + block.shape[0], column:column + block.shape[1]] = block.to_dense() if block.is_sparse else block
+            row, column = row + block.shape[0], column + block.shape[1]
+        return weight
+
+    # the same block (a connective network used by many nodes) is converted once
+    converted = {}
+    for block in blocks:
+        if id(block) not in converted:
+            converted[id(block)] = block.coalesce() if block.is_sparse else block.to_sparse()
+    sparse_blocks = [converted[id(block)] for block in blocks]
+    entries = torch.tensor([block._nnz() for block in sparse_blocks])
+    row_offsets = torch.cumsum(torch.tensor([0] + [block.shape[0] for block in blocks[:-1]]), dim=0)
+    column_offsets = torch.cumsum(torch.tensor([0] + [block.shape[1] for block in blocks[:-1]]), dim=0)
+    offsets = torch.stack((torch.repeat_interleave(row_offsets, entries), torch.repeat_interleave(column_offsets, entries)))
+    indices = torch.cat([block.indices() for block in sparse_blocks], dim=1) + offsets
+    values = torch.cat([block.values() for block in sparse_blocks]).to(dtype)
+    return torch.sparse_coo_tensor(indices, values, (rows, columns), check_invariants=False).coalesce()
+
+def positive_row_sums(weight: torch.tensor) -> torch.tensor:
+    # Sum of the positive entries of every row, as a dense vector also for a sparse weight
+    if not weight.is_sparse:
+        return weight.clamp(min=0).sum(dim=1)
+    weight = weight.coalesce()
+    sums = torch.zeros(weight.shape[0], dtype=weight.dtype)
+    return sums.index_add(0, weight.indices()[0], weight.values().clamp(min=0))
+
+def weight_values(weight: torch.tensor) -> np.ndarray:
+    # The entries of a weight as a flat array, only the stored ones for a sparse weight
+    return (weight.coalesce().values() if weight.is_sparse else weight.detach().flatten()).numpy()
+
 class ReLUNetwork(nn.Module):
     def __init__(self, weights: list[torch.tensor] = [], biases: list[torch.tensor] = []) -> None:
         super().__init__()
@@ -18,14 +78,9 @@ class ReLUNetwork(nn.Module):
         self.biases = biases
         self.num_layers = len(weights)
 
-    def get_general_lcm(self) -> int:
-        coefficients = []
-        for weight in self.weights:
-            coefficients += weight.flatten().tolist()
-        for bias in self.biases:
-            coefficients += bias.flatten().tolist()
-
-        return get_lcm(coefficients)
+    def get_general_lcm(self, max_denominator: int = 1000000, tolerance: float = 0.0) -> int:
+        coefficients = np.concatenate([weight_values(weight) for weight in self.weights] + [bias.detach().flatten().numpy() for bias in self.biases])
+        return get_lcm(coefficients, max_denominator, tolerance)
     
     def transform_rational_to_int(self, lcm: int) -> None:
         self.weights = [weight * lcm for weight in self.weights]
@@ -39,12 +94,7 @@ class ReLUNetwork(nn.Module):
     def construct_layers(self) -> None:
         self.layers = nn.ModuleList()
         for i in range(0, self.num_layers):
-            input_size, output_size = self.weights[i].shape[1], self.weights[i].shape[0]
-
-            layer = nn.Linear(input_size, output_size)
-            layer.weight.data = self.weights[i]
-            layer.bias.data = self.biases[i]
-            self.layers.append(layer)
+            self.layers.append(linear_layer(self.weights[i], self.biases[i]))
 
             if i != self.num_layers - 1:
                 self.layers.append(nn.ReLU())
@@ -68,13 +118,8 @@ class ReLUNetwork(nn.Module):
     
     @staticmethod
     def vertically_append_weights(weight_tensor1: torch.tensor, weight_tensor2: torch.tensor) -> torch.tensor:
-        num_inputs_mat1, num_outputs_mat1 = weight_tensor1.shape[1], weight_tensor1.shape[0]
-        num_inputs_mat2, num_outputs_mat2 = weight_tensor2.shape[1], weight_tensor2.shape[0]
-
-        B = torch.zeros((num_outputs_mat1, num_inputs_mat2), dtype=weight_tensor1.dtype)
-        C = torch.zeros((num_outputs_mat2, num_inputs_mat1), dtype=weight_tensor1.dtype)
-    
-        return torch.cat((torch.cat((weight_tensor1, B), dim=1), torch.cat((C, weight_tensor2), dim=1)), dim=0)
+        # sparse as soon as one of the two is
+        return block_diagonal([weight_tensor1, weight_tensor2], weight_tensor1.is_sparse or weight_tensor2.is_sparse)
 
     def vertically_append_ReLUs(self, ReLU2: 'ReLUNetwork') -> 'ReLUNetwork':
         if self.num_layers != ReLU2.num_layers:
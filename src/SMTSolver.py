@@ -23,7 +23,10 @@ def DELTA(i: ArithRef, x: ArithRef) -> ArithRef:
     return x / i
 
     
-def ParseToZ3(s: Solver, formula: str, atoms = set()) -> str:
+def ParseToZ3(s: Solver, formula: str, atoms = None) -> str:
+    if atoms is None:
+        atoms = set()
+
     if TLogic.is_atom(formula):
         if formula not in atoms:
             atoms.add(formula)
@@ -63,13 +66,50 @@ def ParseToZ3(s: Solver, formula: str, atoms = set()) -> str:
 
         return ""
 
+def EncodeToZ3(s: Solver, root: Tree.Node, atoms: dict = None) -> ArithRef:
+    # Builds the Z3 term bottom-up over the unique nodes, so a subterm shared in a DAG is encoded once
+    if atoms is None:
+        atoms = {}
+
+    terms = {}
+    for node in Tree.postorder_nodes(root):
+        if node.left is None:
+            if TLogic.is_atom(node.data):
+                if node.data not in atoms:
+                    atoms[node.data] = Real(node.data)
+                    s.add(atoms[node.data] >= 0)
+                    s.add(atoms[node.data] <= 1)
+                terms[node] = atoms[node.data]
+            else:
+                terms[node] = RealVal(node.data)
+
+        elif node.data == "¬":
+            terms[node] = NEG(terms[node.left])
+
+        elif node.data[0] == "δ":
+            terms[node] = DELTA(int(node.data[1:]), terms[node.left])
+
+        elif node.data == "⇒":
+            terms[node] = IMPLIES(terms[node.left], terms[node.right])
+
+        elif node.data == "⊙":
+            terms[node] = CONJ(terms[node.left], terms[node.right])
+
+        elif node.data == "⊕":
+            terms[node] = DISJ(terms[node.left], terms[node.right])
+
+        else:
+            raise ValueError(f"Connective {node.data} is not supported by the SMT encoding.")
+
+    return terms[root]
+
 def SolveFormulaSMT(formula: str, target) -> tuple[bool, ModelRef | None]:
 
     s = SolverFor("LRA")
 
-    parsed_formula = ParseToZ3(s, formula)
+    root, _ = Lukasiewicz().generate_dag(formula)
 
-    s.add(eval(parsed_formula) == target)
+    s.add(EncodeToZ3(s, root) == target)
 
     if s.check() == sat:
         return True, s.model()
@@ -1,6 +1,6 @@
 from src.ReLUNetwork import *
 from src.TLogics import *
-from copy import deepcopy
+from collections import deque
 
 '''
 This class will have two main fields:
@@ -12,65 +12,174 @@ class LogicToRelu():
         self.connectives_to_ReLU = connectives_to_ReLU
         self.TLogic = Logic
 
-    def ast_to_ReLU(self, root: Tree.Node, max_depth: int) -> ReLUNetwork:
-        ReLU = ReLUNetwork()
-        ReLU_v = ReLUNetwork()
+    def connective_network(self, data: str, networks: dict) -> ReLUNetwork:
+        # The network of a node, networks keeps the ones of δ_k already built
+        connective = data[0] if data[0] in self.connectives_to_ReLU else ""
+        if connective != "δ":
+            return self.connectives_to_ReLU[connective]
+        if data not in networks:
+            networks[data] = self.connectives_to_ReLU[connective](data[1:])
+        return networks[data]
 
-
-        #Aqui isto está a criar para uma rede de 2 Layers para um átomo o que é um bocado parvo
-        expand_queue = [root]
-
-        connectives = set(self.connectives_to_ReLU.keys())
+    def plan_levels(self, root: Tree.Node, max_depth: int) -> list[list[ReLUNetwork]]:
+        # The networks of every level of the AST, root level first and in the order of the nodes (left to right).
+        # An atom above the last level is carried down by the identity network until it reaches the inputs.
+        levels, level = [], []
+        networks = {}
+        expand_queue = deque([(root.data, root.depth, root)]) # pass-through copies of atoms have no node
 
         while expand_queue:
+            data, depth, node = expand_queue.popleft()
+            is_connective = data[0] in self.connectives_to_ReLU
 
-            node = expand_queue.pop(0)
-            connective = node.data[0] if node.data[0] in connectives else ""
-            
-            if connective == "" and node.depth < max_depth - 1:
-                children = Tree.Node(node.data, node.depth + 1)
-                expand_queue.append(children)
-            else:
+            if not is_connective and depth < max_depth - 1:
+                expand_queue.append((data, depth + 1, None))
+            elif node is not None:
                 for children in Tree.get_children(node):
-                    if children.data[0] in connectives or (children.depth < max_depth and children.data[0] not in connectives):
-                        expand_queue.append(children)
-            
-            if ReLU_v.weights:
-                if connective == "δ":
-                    ReLU_v.vertically_append_ReLUs(self.connectives_to_ReLU[connective](node.data[1:]))
-                else:
-                    ReLU_v.vertically_append_ReLUs(self.connectives_to_ReLU[connective])
-            else:
-                if connective == "δ":
-                    ReLU_v = deepcopy(self.connectives_to_ReLU[connective](node.data[1:]))
-                else:
-                    ReLU_v = deepcopy(self.connectives_to_ReLU[connective])
-            
-            if not expand_queue or node.depth != expand_queue[0].depth:
-                if ReLU.weights:
-                    ReLU.horizontally_append_ReLUs(ReLU_v)
-                else:
-                    if connective == "δ":
-                        ReLU = deepcopy(self.connectives_to_ReLU[connective](node.data[1:]))
-                    else:
-                        ReLU = deepcopy(self.connectives_to_ReLU[connective])
-                ReLU_v = ReLUNetwork()
+                    if children.data[0] in self.connectives_to_ReLU or children.depth < max_depth:
+                        expand_queue.append((children.data, children.depth, children))
+
+            level.append(self.connective_network(data, networks))
+            if not expand_queue or depth != expand_queue[0][1]:
+                levels.append(level)
+                level = []
+        return levels
+
+    @staticmethod
+    def stack_level(level: list[ReLUNetwork], sparse: bool = False) -> tuple[list[torch.tensor], list[torch.tensor]]:
+        # The networks of a level side by side: the block-diagonal weights of every layer are allocated once, at their final size
+        num_layers = level[0].num_layers
+        if any(network.num_layers != num_layers for network in level):
+            raise ValueError("Number of layers in the two networks must be the same for vertical composition.")
+        weights = [block_diagonal([network.weights[layer] for network in level], sparse) for layer in range(num_layers)]
+        biases = [torch.cat([network.biases[layer] for network in level]) for layer in range(num_layers)]
+        return weights, biases
+
+    def ast_to_ReLU(self, root: Tree.Node, max_depth: int, sparse: bool = False) -> ReLUNetwork:
+        # The levels are planned first, then every level is stacked once and the levels are chained, deepest (the inputs) first.
+        # With sparse the weights are torch.sparse_coo matrices, whose size grows linearly with the formula.
+        weights, biases = [], []
+        for level in reversed(self.plan_levels(root, max_depth)):
+            level_weights, level_biases = self.stack_level(level, sparse)
+            weights += level_weights
+            biases += level_biases
+        return ReLUNetwork(weights, biases)
+
+    @staticmethod
+    def fan_in_layer(units: list[tuple[ReLUNetwork, list[int]]], positions: dict[int, int], columns: int, sparse: bool = False) -> torch.tensor:
+        # First layer of a stage: the input j of a unit reads the column where the previous stage put its value j,
+        # so a value used by several units is stored once and fans out through the columns
+        rows = sum(network.weights[0].shape[0] for network, _ in units)
+        dtype = units[0][0].weights[0].dtype
+        row_indices, column_indices, values = [], [], []
+        row = 0
+        for network, inputs in units:
+            block = network.weights[0].to_dense() if network.weights[0].is_sparse else network.weights[0]
+            for j, value in enumerate(inputs):
+                row_indices.append(torch.arange(row, row + block.shape[0]))
+                column_indices.append(torch.full((block.shape[0],), positions[value]))
+                values.append(block[:, j].to(dtype))
+            row += block.shape[0]
+        indices = torch.stack((torch.cat(row_indices), torch.cat(column_indices)))
+        weight = torch.sparse_coo_tensor(indices, torch.cat(values), (rows, columns), check_invariants=False).coalesce() # repeated inputs add up
+        return weight if sparse else weight.to_dense()
+
+    def dag_to_ReLU(self, root: Tree.Node, sparse: bool = False) -> tuple[ReLUNetwork, list[str]]:
+        # The network of a formula with every distinct subformula computed once (structurally equal subtrees are found
+        # even if root is a tree). Returns the network and its inputs: the distinct atoms, in order of first occurrence.
+        return self.dags_to_ReLU([root], sparse)
+
+    def dags_to_ReLU(self, roots: list[Tree.Node], sparse: bool = False) -> tuple[ReLUNetwork, list[str]]:
+        # One network with an output per formula of roots, in the same order, where every distinct subformula of all of
+        # them is computed once and every atom is one input column. The network is split in stages of the depth of the
+        # connective networks: a subformula is computed at the stage just before its first parent, and its value is carried
+        # by identity networks only up to the stage before its last parent (the last stage for the formulas themselves).
+        # Returns the network and its inputs: the distinct atoms, in order of first occurrence.
+        keys, unique, ids = {}, [], {}
+        for root in roots:
+            for node in Tree.postorder_nodes(root):
+                if node in ids:
+                    continue
+                key = (node.data, tuple(ids[child] for child in Tree.get_children(node)))
+                if key not in keys:
+                    keys[key] = len(unique)
+                    unique.append(key)
+                ids[node] = keys[key]
+        outputs = [ids[root] for root in roots]
+
+        networks = {}
+        unit_networks = [self.connective_network(data, networks) if children else None for data, children in unique]
+        identity = self.connectives_to_ReLU[""]
+        num_layers = identity.num_layers
+        if any(network is not None and network.num_layers != num_layers for network in unit_networks):
+            raise ValueError("All the connective networks must have the same number of layers to share subformulas.")
+
+        heights = []
+        for data, children in unique:
+            heights.append(1 + max(heights[child] for child in children) if children else 0)
+        num_stages = max(max(heights[output] for output in outputs), 1)
+
+        # as late as possible: the stage of a subformula is the one before its first parent, atoms are the inputs (stage 0)
+        stages = [0 if not children else num_stages for _, children in unique]
+        last_use = [0] * len(unique)
+        for output in outputs:
+            last_use[output] = num_stages
+        for value in reversed(range(len(unique))):
+            for child in unique[value][1]:
+                if unique[child][1]:
+                    stages[child] = min(stages[child], stages[value] - 1)
+                last_use[child] = max(last_use[child], stages[value] - 1)
+
+        atoms = [value for value, (_, children) in enumerate(unique) if not children]
+        positions = {value: column for column, value in enumerate(atoms)}
+        weights, biases = [], []
+        for stage in range(1, num_stages + 1):
+            units = [(unit_networks[value], list(unique[value][1]), value) for value in range(len(unique)) if unique[value][1] and stages[value] == stage]
+            units += [(identity, [value], value) for value in positions if last_use[value] >= stage]
+            weights.append(self.fan_in_layer([(network, inputs) for network, inputs, _ in units], positions, len(positions), sparse))
+            for layer in range(1, num_layers):
+                weights.append(block_diagonal([network.weights[layer] for network, _, _ in units], sparse))
+            biases += [torch.cat([network.biases[layer] for network, _, _ in units]) for layer in range(num_layers)]
+            positions = {value: row for row, (_, _, value) in enumerate(units)}
+
+        # the output layer is linear, so its rows are put in the order of roots (a formula given twice gets two rows)
+        rows = torch.tensor([positions[output] for output in outputs])
+        if not torch.equal(rows, torch.arange(len(positions))):
+            weights[-1], biases[-1] = weights[-1].index_select(0, rows), biases[-1][rows]
+        return ReLUNetwork(weights, biases), [unique[value][0] for value in atoms]
+
+    def formulas_to_ReLU(self, formulas: list[str], sparse: bool = False) -> tuple[ReLUNetwork, list[str]]:
+        # dags_to_ReLU on the parsed formulas, so a batch of inputs (see valuations_to_tensor) evaluates all of them at once
+        return self.dags_to_ReLU([self.TLogic.generate_ast(formula)[0] for formula in formulas], sparse)
 
-        return ReLU
-    
     def calculate_maximum_depth(self, formula: str) -> int:
-        if len(formula) == 1:
-            return 0
-        else:
-            lformula, rformula, connective = self.TLogic.subdivide_formula(formula)
-            num_layers = self.connectives_to_ReLU[connective].num_layers
-            if connective == "¬":
-                return num_layers + self.calculate_maximum_depth(lformula)
-            else:
-                return num_layers + np.maximum(self.calculate_maximum_depth(lformula), self.calculate_maximum_depth(rformula))
+        # Number of layers of the longest path from an atom to the root, computed bottom-up while parsing
+        num_layers = {}
+
+        def subformula_depth(connective: str, left: int = None, right: int = None) -> int:
+            if left is None:
+                return 0
+            if connective not in num_layers:
+                if connective[0] == "δ":
+                    num_layers[connective] = self.connectives_to_ReLU["δ"](connective[1:]).num_layers
+                else:
+                    num_layers[connective] = self.connectives_to_ReLU[connective].num_layers
+            return num_layers[connective] + (left if right is None or left > right else right)
+
+        return self.TLogic.parse_formula(formula, subformula_depth)
     
     @staticmethod
     def valuation_to_tensor(val: dict, formula: str) -> torch.Tensor:
         return torch.tensor([val[char] for char in formula if char in val], dtype=torch.float64)
 
+    @staticmethod
+    def atoms_to_tensor(val: dict, atoms: list[str]) -> torch.Tensor:
+        # The input of a network of dag_to_ReLU, given its list of atoms
+        return torch.tensor([val[atom] if atom in val else float(atom) for atom in atoms], dtype=torch.float64)
+
+    @staticmethod
+    def valuations_to_tensor(vals: list[dict], atoms: list[str]) -> torch.Tensor:
+        # A batch of inputs, one row per valuation, of a network of dags_to_ReLU or formulas_to_ReLU
+        return torch.stack([LogicToRelu.atoms_to_tensor(val, atoms) for val in vals])
+
 
@@ -2,7 +2,13 @@ import numpy as np
 import random
 from typing import Any
 from src.utils import Tree
+from src.utils import Program
+from src.utils import ArrayTree
+from src.utils.math_utils import get_lcm
 import re
+import math
+from fractions import Fraction
+from functools import partial
 
 '''
 TLogic is a class that holds some place holder truth functions that are meant to be used as methods os a subclass TLogic if it does not explicitly use them. 
@@ -10,6 +16,10 @@ It also contains the methods to constract the abstract syntax tree and to evalua
 Additionally it defines the set of connectives and how we can map them to their respective truth functions.
 '''
 
+# marks a node whose children are already on the value stack during an explicit stack post-order walk
+APPLY = object()
+APPLY_UNARY = object()
+
 class TLogic:
     connectives = {"¬", "⊙", "⊕", "⇒", "δ", "=", "!", "V" , "∧"}
 
@@ -24,7 +34,20 @@ class TLogic:
         "V": "WEAK_DISJ",
         "∧": "WEAK_CONJ"
     }
+
+    # groups: 1 "(", 2 ")", 3 "¬", 4 "δ_k" (captures k), 5 binary connectives, 6 atoms and constants, 7 anything else
+    token_pattern = re.compile(r'\s+|(\()|(\))|(¬)|δ_(\d+)|(==|!=|[⊙⊕⇒V∧])|([^\s()¬δ⊙⊕⇒=!V∧]+)|(.)')
+
+    # compiled programs are cached by formula, the oldest entry is evicted once the cache is full
+    program_cache_size = 1024
+
+    # Python float versions of the truth functions (by name) for run_program, which uses the methods for the missing ones
+    scalar_truth_functions = {}
     
+    def __init__(self) -> None:
+        self.program_cache = {}
+        self.truth_functions = {} # of the connectives met by evaluate_formula, see truth_function
+
     def random_formula(self, atoms: list, choosable_connectives: list, max_depth) -> str:
         if max_depth == 0:
             return random.choice(atoms)
@@ -94,6 +117,28 @@ class TLogic:
 
         return formula, None, None
     
+    @staticmethod
+    def tokenize_formula(formula: str) -> list[tuple[str, str]]:
+        # Splits the formula into (kind, value) tokens in a single left to right pass
+        tokens = []
+        for match in TLogic.token_pattern.finditer(formula):
+            kind = match.lastindex
+            if kind is None: # whitespace
+                continue
+            elif kind == 1 or kind == 2:
+                tokens.append((match.group(), match.group()))
+            elif kind == 3:
+                tokens.append(("unary", match.group()))
+            elif kind == 4:
+                tokens.append(("unary", f"δ{match.group(kind)}"))
+            elif kind == 5:
+                tokens.append(("binary", match.group()))
+            elif kind == 6:
+                tokens.append(("atom", match.group()))
+            else:
+                raise ValueError(f"Unexpected character {match.group()} at position {match.start()} of formula {formula}")
+        return tokens
+
     @staticmethod
     def is_atom(formula: str) -> bool:
         # atoms are always a character followed by 0 or more digits
@@ -106,199 +151,537 @@ class TLogic:
                 return False
         return True
     
-    def generate_ast(self, formula: str, depth: int = 0) -> tuple[Tree.Node, int]:
-        if self.is_constant(formula):
-            node = Tree.Node(formula, depth)
-            return node, depth
+    def parse_formula(self, formula: str, make_node: Any) -> Any:
+        # Stack based parser over the token list. Operands and connectives are shifted until a closing
+        # parenthesis (or the end of the formula) and the group is then reduced from right to left:
+        # prefix connectives scope over the rest of their group and binary connectives associate to the right,
+        # which is the same reading subdivide_formula gives, but every token is shifted and reduced only once.
+        # Subformulas are built bottom-up by make_node(data, left, right), whatever it returns is the operand.
+        def reduce_group() -> Any:
+            node = None
+            while True:
+                item = stack.pop()
+                if item is None: # start of the group
+                    break
+                elif item.__class__ is not tuple:
+                    if node is not None:
+                        raise ValueError(f"Missing connective between operands in formula {formula}")
+                    node = item
+                elif item[0] == "unary":
+                    if node is None:
+                        if item[1][0] != "δ":
+                            raise ValueError(f"Missing operand for {item[1]} in formula {formula}")
+                        node = make_node("1") # (δ_k) stands for δ_k 1
+                    node = make_node(item[1], node)
+                else:
+                    left_node = stack.pop() if stack else None
+                    if node is None or left_node is None or left_node.__class__ is tuple:
+                        raise ValueError(f"Missing operand for {item[1]} in formula {formula}")
+                    node = make_node(item[1], left_node, node)
 
-        else:
-            l_formula, r_formula, connective = self.subdivide_formula(formula)
-            root = Tree.Node(connective, depth)
+            if node is None:
+                raise ValueError(f"Empty subformula in formula {formula}")
+            return node
 
-            if connective[0] == "¬" or connective[0] == "δ":
-                left_node, max_depth = self.generate_ast(l_formula, depth + 1)
-                root.left = left_node
-                left_node.parent = root
+        stack = [None]
+        for kind, value in self.tokenize_formula(formula):
+            if kind == "(":
+                stack.append(None)
+            elif kind == ")":
+                node = reduce_group()
+                if not stack:
+                    raise ValueError(f"Unbalanced parentheses in formula {formula}")
+                stack.append(node)
+            elif kind == "atom":
+                stack.append(make_node(value))
             else:
-                left_node, left_max_depth = self.generate_ast(l_formula, depth + 1)
-                right_node, right_max_depth = self.generate_ast(r_formula, depth + 1)
-                root.left = left_node
-                root.right = right_node
-
-                left_node.parent = root
-                right_node.parent = root
+                stack.append((kind, value))
 
-                # Determine the maximum depth between the left and right subtrees
-                max_depth = max(left_max_depth, right_max_depth)
+        root = reduce_group()
+        if stack:
+            raise ValueError(f"Unbalanced parentheses in formula {formula}")
 
-            return root, max_depth
-        
-    def generate_formula_from_ast(self, root: Tree.Node)-> str:
-        if root.left == None:
-           return root.data
-            
-        else:
-            if root.data[0] == "¬":
-                formula =  f'(¬{self.generate_formula_from_ast(root.left)})'
-            elif root.data[0] == "δ":
-                formula = f'(δ_{root.data[1:]} {self.generate_formula_from_ast(root.left)})'
-            else:
-                formula =  f'({self.generate_formula_from_ast(root.left)}{root.data[0]}{self.generate_formula_from_ast(root.right)})'
-        
-            return formula
+        return root
 
+    def generate_ast(self, formula: str, depth: int = 0, table: Tree.NodeTable = None) -> tuple[Tree.Node, int]:
+        # When a node table is given the nodes are interned in it and the result is a DAG
+        root = self.parse_formula(formula, table.make if table is not None else Tree.make_node)
+        return root, Tree.assign_depths(root, depth)
 
-    def minimize_formula(self, root: Tree.Node) -> str:
-        def dfs_reduction(node):
-            if node is None:
-                return
-            
-            changes_made = False
+    def generate_array_ast(self, formula: str, depth: int = 0, share_subterms: bool = False) -> tuple[ArrayTree.NodeView, int]:
+        # Same as generate_ast (or generate_dag when share_subterms is set) but the nodes are stored in an ArrayTree
+        tree = ArrayTree.ArrayTree(self.connectives_to_truth_function, share_subterms)
+        root = self.parse_formula(formula, tree.make)
+        max_depth = tree.finish(root, depth)
+        return tree.node(root), max_depth
 
-            if node.data[0] == "⊕":
-                if node.left.data == "0":
-                    if node.parent:
-                        replace_node(node, node.right)
-                    else:
-                        node = node.right
-                    changes_made = True
+    def generate_dag(self, formula: str, table: Tree.NodeTable = None, depth: int = 0) -> tuple[Tree.Node, int]:
+        # Same as generate_ast but repeated subterms are shared. A new node table is used unless one is given.
+        return self.generate_ast(formula, depth, table if table is not None else Tree.NodeTable())
+        
+    def generate_formula_from_ast(self, root: Tree.Node)-> str:
+        # The formula is written as a list of pieces with an explicit stack that holds nodes still to be written
+        # and closing pieces, then joined once. Leaf children are written together with their parent, which
+        # halves the number of stack operations. Shared subterms of a DAG are written at every occurrence.
+        pieces = []
+        stack = [root]
+        pop, write, extend = stack.pop, pieces.append, stack.extend
+
+        while stack:
+            node = pop()
+            if node.__class__ is str:
+                write(node)
+                continue
+
+            left, right, data = node.left, node.right, node.data
+            if left is None:
+                write(data)
+
+            elif right is None:
+                opening = "(¬" if data[0] == "¬" else f"(δ_{data[1:]} "
+                if left.left is None:
+                    write(f"{opening}{left.data})")
+                else:
+                    write(opening)
+                    extend((")", left))
 
-                elif node.right.data == "0":
-                    if node.parent:
-                        replace_node(node, node.left)
-                    else:
-                        node = node.left
-                    changes_made = True
+            elif left.left is None:
+                if right.left is None:
+                    write(f"({left.data}{data}{right.data})")
+                else:
+                    write(f"({left.data}{data}")
+                    extend((")", right))
 
-                elif node.left.data == "1":
-                    if node.parent:
-                        replace_node(node, node.left)
-                    else:
-                        node = node.left
+            elif right.left is None:
+                write("(")
+                extend((f"{data}{right.data})", left))
 
-                elif node.right.data == "1":
-                    if node.parent:
-                        replace_node(node, node.right)
-                    else:
-                        node = node.right
+            else:
+                write("(")
+                extend((")", right, data, left))
+
+        return "".join(pieces)
+
+
+    def formula_size(self, root: Tree.Node, leaf_sizes: dict = None) -> tuple[int, int]:
+        # Number of nodes of the tree and number of characters of the string generate_formula_from_ast would give,
+        # computed once per distinct subterm, so it is cheap even when the written formula would not fit in memory.
+        # leaf_sizes maps a leaf to the (nodes, characters) of a formula to count in its place.
+        leaf_sizes = {} if leaf_sizes is None else leaf_sizes
+        sizes = {}
+        for node in Tree.postorder_nodes(root):
+            if node.left == None:
+                sizes[node] = leaf_sizes.get(node.data, (1, len(node.data)))
+            elif node.right == None:
+                nodes, chars = sizes[node.left]
+                sizes[node] = (nodes + 1, chars + (3 if node.data[0] == "¬" else 4 + len(node.data)))
+            else:
+                left_nodes, left_chars = sizes[node.left]
+                right_nodes, right_chars = sizes[node.right]
+                sizes[node] = (left_nodes + right_nodes + 1, left_chars + right_chars + 2 + len(node.data))
+        return sizes[root]
 
-            elif node.data[0] == "⊙":
-                if node.left.data == "0":
-                    if node.parent:
-                        replace_node(node, node.left)
-                    else:
-                        node = node.left
+    def minimize_formula(self, root: Tree.Node) -> str:
+        # Every unique subterm is simplified once, after its children, into a new node table, so shared
+        # subterms stay shared and the input AST is left untouched
+        table = Tree.NodeTable()
+        simplified = {}
+
+        for node in Tree.postorder_nodes(root):
+            if node.left == None:
+                simplified[node] = table.make(node.data)
+            else:
+                left = simplified[node.left]
+                right = simplified[node.right] if node.right != None else None
+                simplified[node] = self.simplify_node(node.data, left, right, table)
+
+        return self.generate_formula_from_ast(simplified[root])
+
+    def simplify_node(self, connective: str, left: Tree.Node, right: Tree.Node, table: Tree.NodeTable) -> Tree.Node:
+        # left and right are already simplified, so one rewrite per node is enough and minimize_formula stays linear.
+        # Closed subterms are folded into a constant when the value is exact in binary floating point and not written
+        # longer than the subterm (δ_3 1 and δ_5 1 stay as they are), the other rules hold in every t-norm logic
+        left_value = self.constant_value(left)
+        right_value = self.constant_value(right) if right != None else None
+        if left_value is not None and (right == None or right_value is not None):
+            value = self.fold_constants(connective, left_value, right_value)
+            if value is not None:
+                constant = self.constant_to_string(value)
+                if connective[0] == "δ":
+                    subterm = f"(δ_{connective[1:]} {left.data})"
+                else:
+                    subterm = f"({connective}{left.data})" if right == None else f"({left.data}{connective}{right.data})"
+                if value == 0 or value == 1 or (Fraction(float(value)).denominator <= 1024 and len(constant) <= len(subterm)):
+                    return table.make(constant)
+
+        if connective[0] == "⊕":
+            if left_value == 0:
+                return right
+            elif right_value == 0:
+                return left
+            elif left_value == 1:
+                return left
+            elif right_value == 1:
+                return right
+
+        elif connective[0] == "⊙":
+            if left_value == 0:
+                return left
+            elif right_value == 0:
+                return right
+            elif left_value == 1:
+                return right
+            elif right_value == 1:
+                return left
+
+        elif connective[0] == "V":
+            if left is right or right_value == 0 or left_value == 1:
+                return left
+            elif left_value == 0 or right_value == 1:
+                return right
+
+        elif connective[0] == "∧":
+            if left is right or right_value == 1 or left_value == 0:
+                return left
+            elif left_value == 1 or right_value == 0:
+                return right
+
+        elif connective[0] == "⇒":
+            if left is right or left_value == 0 or right_value == 1:
+                return table.make("1")
+            elif left_value == 1:
+                return right
+
+        elif connective[0] == "δ":
+            if connective[1:] == "1" or left_value == 0:
+                return left
+
+        return table.make(connective, left, right)
 
-                elif node.right.data == "0":
-                    if node.parent:
-                        replace_node(node, node.right)
-                    else:
-                        node = node.right
+    @staticmethod
+    def constant_value(node: Tree.Node) -> float:
+        # the value of a constant leaf, None for atoms and connectives
+        if node.left != None:
+            return None
+        try:
+            return float(node.data)
+        except ValueError:
+            return None
 
-                elif node.left.data == "1":
-                    if node.parent:
-                        replace_node(node, node.right)
+    @staticmethod
+    def constant_to_string(value: float) -> str:
+        value = float(value)
+        return str(int(value)) if value.is_integer() else repr(value)
+
+    def fold_constants(self, connective: str, left: float, right: float = None) -> float:
+        # None when the logic does not define the truth function of the connective
+        function = getattr(self, self.connectives_to_truth_function[connective[0]], None)
+        if function is None:
+            return None
+        if connective[0] == "δ":
+            return function(connective[1:], left)
+        elif right is None:
+            return function(left)
+        return function(left, right)
+
+    def generate_ast_with_degs(self, formula: str, subformula_to_node: Tree.NodeTable = None, depth: int = 0) -> tuple[Tree.Node, int]:
+        # Kept for the callers that use the old name, see generate_dag
+        return self.generate_dag(formula, subformula_to_node, depth)
+    
+    def get_function_name(self, connective: str) -> Any:
+        return getattr(self, self.connectives_to_truth_function[connective[0]])
+    
+    def evaluate_formula(self, root: Tree.Node, val: dict, memo: dict = None) -> np.float64:
+        # Post-order walk with an explicit stack: the truth function of a node is pushed under an APPLY marker
+        # (APPLY_UNARY for ¬ and δ) above its children and applied to the top of the value stack once they are evaluated.
+        # A shared subterm (of a DAG built by generate_dag) is evaluated once through memo, by evaluate_shared.
+        if memo is not None or root.shared:
+            return self.evaluate_shared(root, val, {} if memo is None else memo)
+        memo = {} # for the shared subterms below root
+        functions = self.truth_functions
+        values = []
+        stack = [root]
+        pop, push, extend = stack.pop, values.append, stack.extend
+
+        while stack:
+            node = pop()
+            if node is APPLY:
+                right_value = values.pop()
+                values[-1] = pop()(values[-1], right_value)
+            elif node is APPLY_UNARY:
+                values[-1] = pop()(values[-1])
+            elif node.left is None:
+                push(val[node.data] if node.data in val else float(node.data))
+            elif node.shared:
+                push(self.evaluate_shared(node, val, memo))
+            else:
+                data, left, right = node.data, node.left, node.right
+                if data not in functions:
+                    functions[data] = self.truth_function(data)
+                # children that are leaves are evaluated right away instead of going through the stack
+                if right is None:
+                    if left.left is None:
+                        push(functions[data](val[left.data] if left.data in val else float(left.data)))
                     else:
-                        node = node.right
+                        extend((functions[data], APPLY_UNARY, left))
+                elif left.left is None and right.left is None:
+                    push(functions[data](val[left.data] if left.data in val else float(left.data), val[right.data] if right.data in val else float(right.data)))
+                else:
+                    extend((functions[data], APPLY, right, left))
+
+        return values[0]
+
+    def truth_function(self, connective: str) -> Any:
+        # The truth function of the connective, with the parameter of δ already given
+        function = self.get_function_name(connective)
+        if connective[0] == "δ":
+            parameter = connective[1:]
+            return lambda value: function(parameter, value)
+        return function
+
+    def evaluate_shared(self, root: Tree.Node, val: dict, memo: dict) -> np.float64:
+        # evaluate_formula for DAGs: a node is pushed back under an APPLY marker above its children, and the value of
+        # every shared node is kept in memo, so each one is evaluated once.
+        functions = self.truth_functions
+        values = []
+        stack = [root]
+        pop, push, extend = stack.pop, values.append, stack.extend
+
+        while stack:
+            node = pop()
+            if node is APPLY:
+                node = pop()
+                if node.data not in functions:
+                    functions[node.data] = self.truth_function(node.data)
+                function = functions[node.data]
+
+                if node.right is None:
+                    eval = function(values[-1])
+                else:
+                    right_value = values.pop()
+                    eval = function(values[-1], right_value)
 
-                elif node.right.data == "1":
-                    if node.parent:
-                        replace_node(node, node.left)
-                    else:
-                        node = node.left
+                values[-1] = eval
+                if node.shared:
+                    memo[node] = eval
 
-            elif node.data[0] == "δ":
-                if node.left.data == "0":
-                    if node.parent:
-                        replace_node(node, node.left)
-                    else:
-                        node = node.left
+            elif node.left is None:
+                push(val[node.data] if node.data in val else float(node.data))
 
-            if not changes_made:
-                if node.left:
-                    dfs_reduction(node.left)
-                if node.right:
-                    dfs_reduction(node.right)
+            elif node.shared and node in memo:
+                push(memo[node])
 
-            return node
+            elif node.right is None:
+                extend((node, APPLY, node.left))
 
-        def replace_node(node, replacement):
-            parent = node.parent
-            if parent.left == node:
-                parent.left = replacement
-            elif parent.right == node:
-                parent.right = replacement
-            replacement.parent = parent
+            else:
+                extend((node, APPLY, node.right, node.left))
 
+        return values[0]
 
-        old_formula = ""
-        while True:
-            new_formula = self.generate_formula_from_ast(root)
-            if new_formula == old_formula:
-                break
-            old_formula = new_formula
-            root = dfs_reduction(root)
+    def compile_formula(self, formula: str | Tree.Node) -> Program.Program:
+        # Turns the formula into a flat postfix program. Programs compiled from strings are cached.
+        if isinstance(formula, str):
+            if formula in self.program_cache:
+                program = self.program_cache.pop(formula)
+            else:
+                program = self.compile_ast(self.generate_ast(formula)[0])
+                if len(self.program_cache) >= self.program_cache_size:
+                    del self.program_cache[next(iter(self.program_cache))]
+            self.program_cache[formula] = program # most recently used entries go last
+            return program
+
+        return self.compile_ast(formula)
+
+    def compile_ast(self, root: Tree.Node) -> Program.Program:
+        if isinstance(root, ArrayTree.NodeView) and not root.tree.share_subterms and root.index == len(root.tree) - 1:
+            return self.compile_array_tree(root.tree)
+
+        # Subterms with more than one parent (the root of a DAG built by generate_dag) are computed once and kept in a register
+        num_parents = {}
+        for node in Tree.postorder_nodes(root):
+            for child in Tree.get_children(node):
+                num_parents[child] = num_parents.get(child, 0) + 1
+
+        opcodes, arguments = [], []
+        atoms, atom_slots = [], {}
+        constants, constant_slots = [], {}
+        registers = {}
+        stack = [(root, False)]
+
+        while stack:
+            node, expanded = stack.pop()
+            if node in registers:
+                opcodes.append(Program.LOAD)
+                arguments.append(registers[node])
+                continue
+
+            if node.left == None:
+                try:
+                    value = float(node.data)
+                    if node.data not in constant_slots:
+                        constant_slots[node.data] = len(constants)
+                        constants.append(value)
+                    opcodes.append(Program.CONSTANT)
+                    arguments.append(constant_slots[node.data])
+                except ValueError:
+                    if node.data not in atom_slots:
+                        atom_slots[node.data] = len(atoms)
+                        atoms.append(node.data)
+                    opcodes.append(Program.ATOM)
+                    arguments.append(atom_slots[node.data])
+
+            elif not expanded:
+                stack.append((node, True))
+                if node.right != None:
+                    stack.append((node.right, False))
+                stack.append((node.left, False))
 
-        return self.generate_formula_from_ast(root)
+            else:
+                opcodes.append(Program.opcodes[self.connectives_to_truth_function[node.data[0]]])
+                arguments.append(int(node.data[1:]) if node.data[0] == "δ" else 0)
+                if num_parents.get(node, 0) > 1:
+                    registers[node] = len(registers)
+                    opcodes.append(Program.STORE)
+                    arguments.append(registers[node])
+
+        return Program.Program(np.array(opcodes, dtype=np.uint8), np.array(arguments, dtype=np.int64), atoms, np.array(constants, dtype=np.float64), len(registers))
+
+    def compile_array_tree(self, tree: ArrayTree.ArrayTree) -> Program.Program:
+        # The nodes of an ArrayTree are already in postfix order, only the leaf parameters have to be
+        # turned from symbol slots into atom and constant slots
+        opcodes = np.array(tree.opcodes, dtype=np.uint8)
+        parameters = np.array(tree.parameters, dtype=np.int64)
+
+        is_constant = np.zeros(len(tree.symbols), dtype=bool)
+        is_constant[parameters[opcodes == Program.CONSTANT]] = True
+        symbol_to_slot = np.zeros(len(tree.symbols), dtype=np.int64)
+        symbol_to_slot[~is_constant] = np.arange(np.count_nonzero(~is_constant))
+        symbol_to_slot[is_constant] = np.arange(np.count_nonzero(is_constant))
+
+        leaves = (opcodes == Program.ATOM) | (opcodes == Program.CONSTANT)
+        arguments = np.where(leaves, symbol_to_slot[np.where(leaves, parameters, 0)], np.where(opcodes == Program.DELTA, parameters, 0))
+
+        atoms = [symbol for symbol, constant in zip(tree.symbols, is_constant) if not constant]
+        constants = np.array([float(symbol) for symbol, constant in zip(tree.symbols, is_constant) if constant], dtype=np.float64)
+        return Program.Program(opcodes, arguments, atoms, constants)
+
+    def get_program_functions(self, program: Program.Program) -> list:
+        # Truth functions indexed by opcode
+        functions = [getattr(self, name, None) for name in Program.instruction_names]
+        for opcode in program.used_opcodes:
+            if opcode >= Program.FIRST_TRUTH_FUNCTION and functions[opcode] is None:
+                raise ValueError(f"{type(self).__name__} does not define the truth function {Program.instruction_names[opcode]}.")
+        return functions
+
+    def scalar_steps(self, program: Program.Program) -> list[tuple[int, Any]]:
+        # The instructions of program for run_program, resolved once per program and logic class: atoms and constants
+        # are read, and truth functions become UNARY or BINARY steps holding the function (δ_k with its k bound), the Python float
+        # version of scalar_truth_functions when the logic has one
+        steps = program.scalar_steps.get(type(self))
+        if steps is not None:
+            return steps
+        functions = self.get_program_functions(program)
+        constants = program.constants.tolist()
+        steps = []
+        for opcode, argument in program.instructions:
+            if opcode == Program.CONSTANT:
+                steps.append((opcode, constants[argument]))
+            elif opcode == Program.ATOM:
+                steps.append((opcode, program.atoms[argument]))
+            elif opcode < Program.FIRST_TRUTH_FUNCTION:
+                steps.append((opcode, argument))
+            else:
+                function = self.scalar_truth_functions.get(Program.instruction_names[opcode], functions[opcode])
+                if opcode == Program.DELTA:
+                    steps.append((Program.UNARY, partial(function, argument)))
+                else:
+                    steps.append((Program.UNARY if opcode == Program.NEG else Program.BINARY, function))
+        program.scalar_steps[type(self)] = steps
+        return steps
+
+    def run_program(self, program: Program.Program, val: dict) -> np.float64:
+        # One valuation (val maps atoms to numbers), run on the resolved steps of the program
+        stack = []
+        push, pop = stack.append, stack.pop
+        registers = [None] * program.num_registers
+
+        for kind, payload in self.scalar_steps(program):
+            if kind == Program.BINARY:
+                right_value = pop()
+                stack[-1] = payload(stack[-1], right_value)
+            elif kind == Program.UNARY:
+                stack[-1] = payload(stack[-1])
+            elif kind == Program.ATOM:
+                push(val[payload])
+            elif kind == Program.CONSTANT:
+                push(payload)
+            elif kind == Program.LOAD:
+                push(registers[payload])
+            else:
+                registers[payload] = stack[-1]
+
+        return np.float64(stack[0])
+
+    def run_program_batch(self, program: Program.Program, val: dict) -> np.ndarray:
+        # A batch of valuations (val maps atoms to arrays), every instruction is one array operation
+        functions = self.get_program_functions(program)
+        atom_values = [val[atom] for atom in program.atoms]
+        constants = program.constants.tolist()
+        registers = [None] * program.num_registers
+        stack = []
+
+        for opcode, argument in program.instructions:
+            if opcode == Program.ATOM:
+                stack.append(atom_values[argument])
+            elif opcode == Program.CONSTANT:
+                stack.append(constants[argument])
+            elif opcode == Program.LOAD:
+                stack.append(registers[argument])
+            elif opcode == Program.STORE:
+                registers[argument] = stack[-1]
+            elif opcode == Program.NEG:
+                stack[-1] = functions[opcode](stack[-1])
+            elif opcode == Program.DELTA:
+                stack[-1] = functions[opcode](argument, stack[-1])
+            else:
+                right_value = stack.pop()
+                stack[-1] = functions[opcode](stack[-1], right_value)
 
-    
-    def generate_ast_with_degs(self, formula:str, subformula_to_node={}, depth=0) -> tuple[Tree.Node, int]:
-        if formula in subformula_to_node:
-            return subformula_to_node[formula]
-        
-        elif self.is_atom(formula):
-            return Tree.Node(formula, depth), depth
-        
-        elif self.is_constant(formula):
-            return Tree.Node(formula, depth), depth
-        
-        else:
-            l_formula, r_formula, connective = self.subdivide_formula(formula)
-            root = Tree.Node(connective, depth)
-            if connective[0] == "¬":
-                left_node, max_depth = self.generate_ast_with_degs(l_formula, subformula_to_node, depth + 1)
-                root.left = left_node
+        return stack[0]
 
-            elif connective[0] == "δ":
-                left_node, max_depth = self.generate_ast_with_degs(l_formula, subformula_to_node, depth + 1)
-                root.left = left_node
+    def evaluate_formula_batch(self, root: Tree.Node | Program.Program, valuations: np.ndarray | dict, variables: list[str] = None, chunk_size: int = 65536) -> np.ndarray:
+        # valuations is either an (N, n_vars) array whose columns follow variables (x1, x2, ... by default) or a dict of column arrays.
+        # The rows are processed in chunks and every instruction is run once per chunk as an array operation.
+        program = root if isinstance(root, Program.Program) else self.compile_ast(root)
 
-            else:
-                left_node, left_max_depth = self.generate_ast_with_degs(l_formula, subformula_to_node, depth + 1)
-                right_node, right_max_depth = self.generate_ast_with_degs(r_formula, subformula_to_node, depth + 1)
-                root.left = left_node
-                root.right = right_node
-                max_depth = max(left_max_depth, right_max_depth)
-
-            subformula_to_node[formula] = (root, max_depth)
-            return subformula_to_node[formula]
-    
-    def get_function_name(self, connective: str) -> Any:
-        return getattr(self, self.connectives_to_truth_function[connective[0]])
-    
-    def evaluate_formula(self, root: Tree.Node, val: dict) -> np.float64:
-        if root.left == None:
-            if root.data in val:
-                return val[root.data]
-            else:
-                return float(root.data)
-            
+        if isinstance(valuations, dict):
+            variables = list(valuations.keys())
+            columns = [np.asarray(valuations[variable], dtype=np.float64) for variable in variables]
+            num_rows = len(columns[0]) if columns else 0
         else:
-            function = self.get_function_name(root.data)
-
-            if root.data[0] == "¬":
-                eval = function(self.evaluate_formula(root.left, val))
-            elif root.data[0] == "δ":
-                eval = function(root.data[1:], self.evaluate_formula(root.left, val))
-            else:
-                eval = function(self.evaluate_formula(root.left, val), self.evaluate_formula(root.right, val))
-        
-            return eval
+            valuations = np.asarray(valuations, dtype=np.float64)
+            if valuations.ndim != 2:
+                raise ValueError("Valuations must be an (N, n_vars) array.")
+            if variables is None:
+                variables = [f'x{i + 1}' for i in range(valuations.shape[1])]
+            if len(variables) != valuations.shape[1]:
+                raise ValueError("Number of variables must match the number of columns of the valuations.")
+            columns = [valuations[:, i] for i in range(valuations.shape[1])]
+            num_rows = valuations.shape[0]
+
+        result = np.empty(num_rows, dtype=np.float64)
+        for start in range(0, num_rows, chunk_size):
+            end = min(start + chunk_size, num_rows)
+            chunk = {variable: column[start:end] for variable, column in zip(variables, columns)}
+            result[start:end] = self.run_program_batch(program, chunk)
+
+        return result
 
 # Here the multiplicative connectives collapse! meaning ∧ is ⊙ and ∨ is ⊕
 class Godel(TLogic):
     def IMPLIES(self, x: np.float64, y: np.float64) -> np.float64:
-        return y if x > y else np.float64(1)
+        return np.float64(np.where(x > y, y, 1))
     
     #v(A∧B) = min(v(A),v(B))
     def CONJ(self, x: np.float64, y: np.float64) -> np.float64:
@@ -323,6 +706,19 @@ class Product(TLogic):
 
 
 class Lukasiewicz(TLogic):
+    # the truth functions below on Python floats, for run_program
+    scalar_truth_functions = {
+        "IMPLIES": lambda x, y: min(1.0, 1 - x + y),
+        "CONJ": lambda x, y: max(0.0, x + y - 1),
+        "DISJ": lambda x, y: min(1.0, x + y),
+        "NEG": lambda x: 1 - x,
+        "DELTA": lambda i, x: x / int(i),
+        "EQUALS": lambda x, y: float(x == y),
+        "UNEQUALS": lambda x, y: float(x != y),
+        "WEAK_CONJ": min,
+        "WEAK_DISJ": max
+    }
+
     #v(A → B) = min(1,1−v(A) +v(B))
     def IMPLIES(self, x: np.float64, y: np.float64) -> np.float64:
         return np.float64(np.minimum(1, 1 - x + y))
@@ -352,4 +748,225 @@ class Lukasiewicz(TLogic):
         return np.float64(np.minimum(x, y))
     
     def WEAK_DISJ(self, x: np.float64, y: np.float64) -> np.float64:
-        return np.float64(np.maximum(x, y))
\ No newline at end of file
+        return np.float64(np.maximum(x, y))
+
+    def simplify_node(self, connective: str, left: Tree.Node, right: Tree.Node, table: Tree.NodeTable) -> Tree.Node:
+        # Rules of MV-algebras that do not hold in every t-norm logic: ¬ is involutive, x⊕¬x = 1, x⊙¬x = 0 and x⇒0 = ¬x
+        if connective[0] == "¬":
+            if left.data[0] == "¬":
+                return left.left
+
+        elif connective[0] == "⊕":
+            if (left.data[0] == "¬" and left.left is right) or (right.data[0] == "¬" and right.left is left):
+                return table.make("1")
+
+        elif connective[0] == "⊙":
+            if (left.data[0] == "¬" and left.left is right) or (right.data[0] == "¬" and right.left is left):
+                return table.make("0")
+
+        elif connective[0] == "⇒":
+            if self.constant_value(right) == 0 and self.constant_value(left) is None:
+                return self.simplify_node("¬", left, None, table)
+
+        return super().simplify_node(connective, left, right, table)
+
+    # Exact evaluation: every value is kept as an integer numerator over one common denominator D, chosen so that
+    # every δ_k divides exactly. The denominator a subterm needs is k times the one of its argument for δ_k and the
+    # lcm of the ones of its arguments otherwise, D is the lcm over all subterms (atoms need the valuation denominator).
+    def exact_denominator(self, program: Program.Program, valuation_denominator: int = 1) -> int:
+        constant_denominators = [Fraction(constant).limit_denominator().denominator for constant in program.constants.tolist()]
+        registers = [1] * program.num_registers
+        denominator = valuation_denominator
+        stack = []
+
+        for opcode, argument in program.instructions:
+            if opcode == Program.ATOM:
+                stack.append(valuation_denominator)
+            elif opcode == Program.CONSTANT:
+                stack.append(constant_denominators[argument])
+            elif opcode == Program.LOAD:
+                stack.append(registers[argument])
+            elif opcode == Program.STORE:
+                registers[argument] = stack[-1]
+                continue
+            elif opcode == Program.NEG:
+                continue
+            elif opcode == Program.DELTA:
+                stack[-1] = stack[-1] * argument
+            else:
+                right_denominator = stack.pop()
+                stack[-1] = math.lcm(stack[-1], right_denominator)
+            denominator = math.lcm(denominator, stack[-1])
+
+        return denominator
+
+    def run_program_exact(self, program: Program.Program, numerators: dict, denominator: int) -> np.ndarray:
+        # numerators maps atoms to integer arrays over denominator, which must be a multiple of exact_denominator
+        D = denominator
+        # int64 holds every intermediate value (at most 2D) unless D is huge, then Python integers are used
+        dtype = np.int64 if 2 * D < 2 ** 62 else object
+        atom_values = [np.asarray(numerators[atom]).astype(dtype) for atom in program.atoms]
+        constants = [int(Fraction(constant).limit_denominator() * D) for constant in program.constants.tolist()]
+        registers = [None] * program.num_registers
+        stack = []
+
+        for opcode, argument in program.instructions:
+            if opcode == Program.ATOM:
+                stack.append(atom_values[argument])
+            elif opcode == Program.CONSTANT:
+                stack.append(constants[argument])
+            elif opcode == Program.LOAD:
+                stack.append(registers[argument])
+            elif opcode == Program.STORE:
+                registers[argument] = stack[-1]
+            elif opcode == Program.NEG:
+                stack[-1] = D - stack[-1]
+            elif opcode == Program.DELTA:
+                stack[-1] = stack[-1] // argument
+            else:
+                y = stack.pop()
+                x = stack[-1]
+                name = Program.instruction_names[opcode]
+                if name == "CONJ":
+                    stack[-1] = np.maximum(0, x + y - D)
+                elif name == "DISJ":
+                    stack[-1] = np.minimum(D, x + y)
+                elif name == "IMPLIES":
+                    stack[-1] = np.minimum(D, D - x + y)
+                elif name == "EQUALS":
+                    stack[-1] = np.where(x == y, D, 0)
+                elif name == "UNEQUALS":
+                    stack[-1] = np.where(x != y, D, 0)
+                elif name == "WEAK_DISJ":
+                    stack[-1] = np.maximum(x, y)
+                else:
+                    stack[-1] = np.minimum(x, y)
+
+        return np.asarray(stack[0]).astype(dtype)
+
+    def evaluate_formula_batch_exact(self, root: Tree.Node | Program.Program, numerators: np.ndarray, valuation_denominator: int, variables: list[str] = None) -> tuple[np.ndarray, int]:
+        # numerators is an (N, n_vars) integer array, row i gives the valuation numerators[i] / valuation_denominator.
+        # Returns the numerators of the N values of the formula and their common denominator.
+        program = root if isinstance(root, Program.Program) else self.compile_ast(root)
+        numerators = np.asarray(numerators)
+        if numerators.ndim != 2:
+            raise ValueError("Valuations must be an (N, n_vars) array.")
+        if variables is None:
+            variables = [f'x{i + 1}' for i in range(numerators.shape[1])]
+        if len(variables) != numerators.shape[1]:
+            raise ValueError("Number of variables must match the number of columns of the valuations.")
+        if numerators.size and (numerators.min() < 0 or numerators.max() > valuation_denominator):
+            raise ValueError("Valuations must lie in [0, 1].")
+
+        D = self.exact_denominator(program, valuation_denominator)
+        scale = D // valuation_denominator
+        dtype = np.int64 if 2 * D < 2 ** 62 else object
+        columns = {variable: numerators[:, i].astype(dtype) * scale for i, variable in enumerate(variables)}
+        result = self.run_program_exact(program, columns, D)
+        return np.broadcast_to(result, (numerators.shape[0],)).copy(), D
+
+    def evaluate_formula_exact(self, root: Tree.Node | Program.Program, val: dict) -> Fraction:
+        # val maps atoms to rationals (ints, Fractions or floats, which are read as the closest simple fraction)
+        variables = list(val.keys())
+        values = [Fraction(value).limit_denominator() for value in val.values()]
+        valuation_denominator = get_lcm(values) if values else 1
+        numerators = np.array([[int(value * valuation_denominator) for value in values]], dtype=object)
+        result, D = self.evaluate_formula_batch_exact(root, numerators, valuation_denominator, variables)
+        return Fraction(int(result[0]), D)
+
+'''
+FiniteLukasiewicz is the Łukasiewicz logic restricted to the chain L_k = {0, 1/k, ..., 1}. Value i/k is represented by its index i
+and every connective is a precomputed table over the indices, so a compiled formula is evaluated with table lookups only.
+δ_j i/k is in the chain only when j divides i, otherwise (and for every connective applied to it) the result is the index k + 1, undefined.
+'''
+class FiniteLukasiewicz(Lukasiewicz):
+    def __init__(self, k: int) -> None:
+        super().__init__()
+        if k < 1 or k + 1 >= 2 ** 16:
+            raise ValueError("The chain L_k needs 1 <= k < 65535.")
+        self.k = k
+        self.undefined = k + 1
+        self.dtype = np.uint8 if self.undefined < 2 ** 8 else np.uint16
+
+        i = np.arange(k + 1)[:, None]
+        j = np.arange(k + 1)[None, :]
+        binary_tables = {
+            "CONJ": np.maximum(0, i + j - k),
+            "DISJ": np.minimum(k, i + j),
+            "IMPLIES": np.minimum(k, k - i + j),
+            "EQUALS": np.where(i == j, k, 0),
+            "UNEQUALS": np.where(i != j, k, 0),
+            "WEAK_DISJ": np.maximum(i, j),
+            "WEAK_CONJ": np.minimum(i, j)
+        }
+        self.tables = {}
+        for name, table in binary_tables.items():
+            self.tables[Program.opcodes[name]] = self.add_undefined(table)
+        self.tables[Program.NEG] = self.add_undefined(k - np.arange(k + 1))
+        self.delta_tables = {}
+
+    def add_undefined(self, table: np.ndarray) -> np.ndarray:
+        # an extra row and column for the undefined index
+        padded = np.full(tuple(size + 1 for size in table.shape), self.undefined, dtype=self.dtype)
+        padded[tuple(slice(0, size) for size in table.shape)] = table
+        return padded
+
+    def get_delta_table(self, j: int) -> np.ndarray:
+        if j not in self.delta_tables:
+            i = np.arange(self.k + 1)
+            self.delta_tables[j] = self.add_undefined(np.where(i % j == 0, i // j, self.undefined))
+        return self.delta_tables[j]
+
+    def values_to_indices(self, values: np.ndarray) -> np.ndarray:
+        values = np.asarray(values, dtype=np.float64)
+        indices = np.rint(values * self.k)
+        if not np.all((indices >= 0) & (indices <= self.k) & np.isclose(indices / self.k, values, rtol=0, atol=1e-9)):
+            raise ValueError(f"Values must be in the chain L_{self.k}.")
+        return indices.astype(self.dtype)
+
+    def indices_to_values(self, indices: np.ndarray) -> np.ndarray:
+        # undefined results become nan
+        indices = np.asarray(indices)
+        return np.where(indices == self.undefined, np.nan, indices / self.k)
+
+    def run_program_indices(self, program: Program.Program, val: dict) -> np.ndarray:
+        # val maps atoms to indices (or arrays of them), the result is the index of the value of the formula
+        atom_values = [val[atom] for atom in program.atoms]
+        constants = self.values_to_indices(program.constants).tolist()
+        registers = [None] * program.num_registers
+        stack = []
+
+        for opcode, argument in program.instructions:
+            if opcode == Program.ATOM:
+                stack.append(atom_values[argument])
+            elif opcode == Program.CONSTANT:
+                stack.append(constants[argument])
+            elif opcode == Program.LOAD:
+                stack.append(registers[argument])
+            elif opcode == Program.STORE:
+                registers[argument] = stack[-1]
+            elif opcode == Program.NEG:
+                stack[-1] = self.tables[opcode][stack[-1]]
+            elif opcode == Program.DELTA:
+                stack[-1] = self.get_delta_table(argument)[stack[-1]]
+            else:
+                right_value = stack.pop()
+                stack[-1] = self.tables[opcode][stack[-1], right_value]
+
+        return stack[0]
+
+    def evaluate_formula_indices(self, root: Tree.Node | Program.Program, indices: np.ndarray, variables: list[str] = None) -> np.ndarray:
+        # indices is an (N, n_vars) array of indices whose columns follow variables (x1, x2, ... by default)
+        program = root if isinstance(root, Program.Program) else self.compile_ast(root)
+        indices = np.asarray(indices)
+        if indices.ndim != 2:
+            raise ValueError("Valuations must be an (N, n_vars) array.")
+        if variables is None:
+            variables = [f'x{i + 1}' for i in range(indices.shape[1])]
+        if len(variables) != indices.shape[1]:
+            raise ValueError("Number of variables must match the number of columns of the valuations.")
+        if indices.size and indices.max() > self.undefined:
+            raise ValueError(f"Indices of L_{self.k} go from 0 to {self.k}.")
+
+        val = {variable: indices[:, i].astype(self.dtype) for i, variable in enumerate(variables)}
+        return np.broadcast_to(self.run_program_indices(program, val), (indices.shape[0],)).astype(self.dtype)
@@ -0,0 +1,162 @@
+from array import array
+from src.utils import Program
+
+'''
+This is a utility class that stores an abstract syntax tree as a struct of arrays instead of one Node object per subformula.
+Node i has an opcode (the opcodes of Program), the indices of its left child, right child and parent (-1 when missing),
+a parameter and a depth. The parameter of a leaf is its slot in the symbol table, where every atom and constant is stored once,
+and the parameter of δ_k is k. Children are always stored before their parents, so the opcodes of a tree read in order are
+already a postfix program.
+NodeView gives the usual left / right / parent / data / depth interface on top of an index, so the functions of Tree and the
+methods of TLogic work on both representations.
+'''
+
+class ArrayTree:
+    def __init__(self, connectives_to_truth_function: dict[str, str], share_subterms: bool = False) -> None:
+        self.opcodes = array('B')
+        self.lefts = array('i')
+        self.rights = array('i')
+        self.parents = array('i')
+        self.parameters = array('i')
+        self.depths = array('i')
+        self.num_parents = array('i')
+        self.symbols = []
+        self.symbol_slots = {}
+        self.share_subterms = share_subterms
+        self.interned = {}
+
+        self.connective_opcodes = {connective: Program.opcodes[name] for connective, name in connectives_to_truth_function.items()}
+        self.opcode_connectives = {opcode: connective for connective, opcode in self.connective_opcodes.items()}
+        self.opcode_connectives[Program.opcodes["EQUALS"]] = "=="
+        self.opcode_connectives[Program.opcodes["UNEQUALS"]] = "!="
+
+    def make(self, data: str, left: int = None, right: int = None) -> int:
+        # Appends the node (or finds an equal one when subterms are shared) and returns its index
+        if left is None:
+            if data not in self.symbol_slots:
+                try:
+                    float(data)
+                    opcode = Program.CONSTANT
+                except ValueError:
+                    opcode = Program.ATOM
+                self.symbol_slots[data] = (len(self.symbols), opcode)
+                self.symbols.append(data)
+            parameter, opcode = self.symbol_slots[data]
+        else:
+            opcode = self.connective_opcodes[data[0]]
+            parameter = int(data[1:]) if data[0] == "δ" else 0
+
+        left = -1 if left is None else left
+        right = -1 if right is None else right
+
+        if self.share_subterms:
+            key = (opcode, parameter, left, right)
+            if key in self.interned:
+                return self.interned[key]
+
+        index = len(self.opcodes)
+        self.opcodes.append(opcode)
+        self.lefts.append(left)
+        self.rights.append(right)
+        self.parents.append(-1)
+        self.parameters.append(parameter)
+        self.depths.append(0)
+        self.num_parents.append(0)
+
+        for child in (left, right):
+            if child != -1:
+                if self.parents[child] == -1:
+                    self.parents[child] = index
+                self.num_parents[child] += 1
+
+        if self.share_subterms:
+            self.interned[key] = index
+        return index
+
+    def finish(self, root: int, depth: int = 0) -> int:
+        # Drops the building state, sets the depths below root (the shallowest occurrence of shared subterms)
+        # and returns the maximum depth, the length of the longest path
+        self.interned = {}
+        self.symbol_slots = {}
+        lefts, rights, depths = self.lefts, self.rights, self.depths
+        unreached = 2 ** 31 - 1
+
+        # parents are stored after their children, so going down the indices every parent is final before its children
+        for index in range(root + 1):
+            depths[index] = unreached
+        depths[root] = depth
+        for index in range(root, -1, -1):
+            if depths[index] == unreached:
+                depths[index] = 0
+                continue
+            for child in (lefts[index], rights[index]):
+                if child != -1 and depths[index] + 1 < depths[child]:
+                    depths[child] = depths[index] + 1
+
+        heights = array('i', bytes(4 * (root + 1)))
+        for index in range(root + 1):
+            left, right = lefts[index], rights[index]
+            if left != -1:
+                heights[index] = 1 + (heights[left] if right == -1 or heights[left] > heights[right] else heights[right])
+
+        return depth + heights[root]
+
+    def node(self, index: int) -> 'NodeView':
+        return NodeView(self, index)
+
+    def data(self, index: int) -> str:
+        opcode = self.opcodes[index]
+        if opcode == Program.ATOM or opcode == Program.CONSTANT:
+            return self.symbols[self.parameters[index]]
+        elif opcode == Program.DELTA:
+            return f"δ{self.parameters[index]}"
+        return self.opcode_connectives[opcode]
+
+    def nbytes(self) -> int:
+        # Memory held by the node arrays, the symbol table is not included
+        return sum(values.itemsize * len(values) for values in (self.opcodes, self.lefts, self.rights, self.parents, self.parameters, self.depths, self.num_parents))
+
+    def __len__(self) -> int:
+        return len(self.opcodes)
+
+
+class NodeView:
+    __slots__ = ("tree", "index")
+
+    def __init__(self, tree: ArrayTree, index: int) -> None:
+        self.tree = tree
+        self.index = index
+
+    @property
+    def left(self) -> 'NodeView':
+        child = self.tree.lefts[self.index]
+        return None if child == -1 else NodeView(self.tree, child)
+
+    @property
+    def right(self) -> 'NodeView':
+        child = self.tree.rights[self.index]
+        return None if child == -1 else NodeView(self.tree, child)
+
+    @property
+    def parent(self) -> 'NodeView':
+        parent = self.tree.parents[self.index]
+        return None if parent == -1 else NodeView(self.tree, parent)
+
+    @property
+    def data(self) -> str:
+        return self.tree.data(self.index)
+
+    @property
+    def depth(self) -> int:
+        return self.tree.depths[self.index]
+
+    @property
+    def shared(self) -> bool:
+        return self.tree.num_parents[self.index] > 1
+
+    # views of the same node are interchangeable, so they compare and hash by index
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, NodeView) and self.tree is other.tree and self.index == other.index
+
+    def __hash__(self) -> int:
+        return hash((id(self.tree), self.index))
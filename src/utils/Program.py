@@ -0,0 +1,43 @@
+import numpy as np
+
+'''
+This is a utility class that holds a formula compiled to postfix form.
+The instructions are two flat arrays: the opcodes and their arguments. The argument of ATOM is a slot in atoms,
+the argument of CONSTANT is a slot in constants and the argument of DELTA is the divisor k of δ_k.
+Subterms shared in a DAG are computed once: STORE copies the top of the stack to a register and LOAD pushes it back.
+'''
+
+# the remaining opcodes are named after the truth functions of TLogic
+truth_functions = ["NEG", "CONJ", "DISJ", "IMPLIES", "DELTA", "EQUALS", "UNEQUALS", "WEAK_DISJ", "WEAK_CONJ"]
+instruction_names = ["ATOM", "CONSTANT", "LOAD", "STORE"] + truth_functions
+opcodes = {name: opcode for opcode, name in enumerate(instruction_names)}
+
+ATOM = opcodes["ATOM"]
+CONSTANT = opcodes["CONSTANT"]
+LOAD = opcodes["LOAD"]
+STORE = opcodes["STORE"]
+NEG = opcodes["NEG"]
+DELTA = opcodes["DELTA"]
+FIRST_TRUTH_FUNCTION = NEG
+# kinds of the steps of TLogic.scalar_steps, where a truth function (δ_k with its k) is already resolved
+UNARY = len(instruction_names)
+BINARY = UNARY + 1
+
+class Program:
+    def __init__(self, opcodes: np.ndarray, arguments: np.ndarray, atoms: list[str], constants: np.ndarray, num_registers: int = 0) -> None:
+        self.opcodes = opcodes
+        self.arguments = arguments
+        self.atoms = atoms
+        self.constants = constants
+        self.num_registers = num_registers
+        self.used_opcodes = set(np.unique(opcodes).tolist())
+        # python level copy of the instructions, iterating over it is faster than indexing numpy arrays
+        self.instructions = list(zip(opcodes.tolist(), arguments.tolist()))
+        self.scalar_steps = {} # by logic class, see TLogic.scalar_steps
+
+    def __getstate__(self) -> dict:
+        # the steps hold functions of a logic, they are resolved again after unpickling
+        return {**self.__dict__, "scalar_steps": {}}
+
+    def __len__(self) -> int:
+        return len(self.opcodes)
@@ -0,0 +1,96 @@
+from array import array
+import sqlite3
+import time
+import zlib
+
+'''
+This is a utility class that keeps formula DAGs on disk, in a sqlite database, under a key chosen by the caller
+(a hash of what the formula was built from). A DAG is stored in the export_dag form of Tree: the distinct labels once,
+then the label, left child and right child of every node as int32 arrays, the whole compressed with zlib.
+The total size of the stored formulas is kept under max_bytes by dropping the least recently used ones.
+Several processes can open the same file: sqlite serializes the writes, and a TermStore pickles as its path and cap
+so every worker process opens its own connection.
+'''
+
+def encode_dag(entries: list[tuple[str, int, int]], root_indices: list[int]) -> bytes:
+    labels, label_indices = [], {}
+    columns = array('i'), array('i'), array('i')
+    for data, left, right in entries:
+        if data not in label_indices:
+            label_indices[data] = len(labels)
+            labels.append(data)
+        columns[0].append(label_indices[data])
+        columns[1].append(left)
+        columns[2].append(right)
+    header = array('i', [len(labels), len(entries), len(root_indices)])
+    text = "\0".join(labels).encode("utf-8")
+    return zlib.compress(header.tobytes() + array('i', root_indices).tobytes() + b"".join(column.tobytes() for column in columns) + text)
+
+def decode_dag(blob: bytes) -> tuple[list[tuple[str, int, int]], list[int]]:
+    raw = zlib.decompress(blob)
+    header = array('i')
+    header.frombytes(raw[:12])
+    num_labels, num_entries, num_roots = header
+    numbers = array('i')
+    numbers.frombytes(raw[12:12 + 4 * (num_roots + 3 * num_entries)])
+    labels = raw[12 + 4 * (num_roots + 3 * num_entries):].decode("utf-8").split("\0") if num_labels else []
+    root_indices = numbers[:num_roots].tolist()
+    data, lefts, rights = (numbers[num_roots + column * num_entries:num_roots + (column + 1) * num_entries] for column in range(3))
+    return [(labels[label], left, right) for label, left, right in zip(data, lefts, rights)], root_indices
+
+
+class TermStore:
+    def __init__(self, path: str, max_bytes: int = 256 * 2 ** 20) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS terms (key BLOB PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_used INTEGER NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS terms_last_used ON terms (last_used)")
+
+    def __reduce__(self):
+        return (self.__class__, (self.path, self.max_bytes))
+
+    def get(self, key: bytes) -> tuple[list[tuple[str, int, int]], list[int]]:
+        # The export_dag form stored under key, None when it is not there
+        row = self.connection.execute("SELECT value FROM terms WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.connection.execute("UPDATE terms SET last_used = ? WHERE key = ?", (time.time_ns(), key))
+        return decode_dag(row[0])
+
+    def put(self, key: bytes, entries: list[tuple[str, int, int]], root_indices: list[int]) -> None:
+        blob = encode_dag(entries, root_indices)
+        if len(blob) > self.max_bytes:
+            return
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute("INSERT OR REPLACE INTO terms VALUES (?, ?, ?, ?)", (key, blob, len(blob), time.time_ns()))
+            self.evict()
+
+    def evict(self) -> None:
+        # Drops the least recently used formulas until the rest fit in max_bytes
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM terms").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        dropped = []
+        for key, size in self.connection.execute("SELECT key, size FROM terms ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            dropped.append((key,))
+            total -= size
+        self.connection.executemany("DELETE FROM terms WHERE key = ?", dropped)
+
+    def stats(self) -> dict:
+        count, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM terms").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "terms": count, "bytes": size, "max_bytes": self.max_bytes}
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM terms").fetchone()[0]
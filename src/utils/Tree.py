@@ -4,6 +4,9 @@ from collections import deque
 This is a utility class that is used to build an abstract syntax tree
 '''
 class Node:
+    # set on nodes that have more than one parent (see make_node), so traversals know which values to keep
+    shared = False
+
     def __init__(self, data: str, depth: int) -> None:
         self.left = None
         self.right = None
@@ -19,6 +22,53 @@ class Node:
         if new_child:
             new_child.parent = self
 
+class NodeTable:
+    '''
+    Hash-consing table: nodes are interned by (data, left, right), so structurally equal subterms built through
+    the same table are the same Node object and the abstract syntax tree becomes a DAG.
+    Shared nodes keep the parent of their first occurrence.
+    '''
+    def __init__(self) -> None:
+        self.nodes = {}
+
+    def make(self, data: str, left: Node = None, right: Node = None) -> Node:
+        key = (data, left, right)
+        node = self.nodes.get(key)
+        if node is None:
+            node = make_node(data, left, right)
+            self.nodes[key] = node
+        return node
+
+    def retain(self, roots: list[Node]) -> None:
+        # Drops the nodes no root reaches, the parent and shared fields of the kept ones are set again from kept parents
+        kept = {}
+        for root in roots:
+            for node in postorder_nodes(root):
+                kept[node] = None
+        for node in kept:
+            node.parent, node.shared = None, False
+        for node in kept:
+            for child in get_children(node):
+                if child.parent is None:
+                    child.parent = node
+                else:
+                    child.shared = True
+        self.nodes = {(node.data, node.left, node.right): node for node in kept}
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+def make_node(data: str, left: Node = None, right: Node = None) -> Node:
+    node = Node(data, 0)
+    node.left = left
+    node.right = right
+    for child in get_children(node):
+        if child.parent is None:
+            child.parent = node
+        else:
+            child.shared = True
+    return node
+
 def level_order_traversal(root: Node) -> list[(str, int)]:
     if root is None:
         return []
@@ -64,3 +114,68 @@ def get_children(node: Node) -> list[Node]:
         if node.right is not None:
             children.append(node.right)
         return children
+
+
+def postorder_nodes(root: Node) -> list[Node]:
+    # Every distinct node object reachable from root, children before their parents
+    order = []
+    visited = set()
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            order.append(node)
+        elif node not in visited:
+            visited.add(node)
+            stack.append((node, True))
+            for child in reversed(get_children(node)):
+                if child not in visited:
+                    stack.append((child, False))
+    return order
+
+def assign_depths(root: Node, depth: int = 0) -> int:
+    # Sets the depth of every node below root and returns the maximum depth.
+    # Shared subterms get the depth of their shallowest occurrence, the maximum depth is the length of the longest path.
+    root.depth = depth
+    visited = {root}
+    order = [root]
+    for node in order: # breadth first, so the first time a node is reached is through its shallowest occurrence
+        for child in get_children(node):
+            if child not in visited:
+                visited.add(child)
+                child.depth = node.depth + 1
+                order.append(child)
+
+    heights = {}
+    for node in postorder_nodes(root):
+        heights[node] = max([heights[child] + 1 for child in get_children(node)], default=0)
+
+    return depth + heights[root]
+
+def count_nodes(root: Node) -> tuple[int, int]:
+    # Returns the size of the tree (shared subterms counted once per occurrence) and the number of unique nodes
+    order = postorder_nodes(root)
+    sizes = {}
+    for node in order:
+        sizes[node] = 1 + sum(sizes[child] for child in get_children(node))
+
+    return sizes[root], len(order)
+
+def export_dag(roots: list[Node]) -> tuple[list[tuple[str, int, int]], list[int]]:
+    # Flat picklable form of the DAG below roots: one (data, left, right) entry per distinct node, children before parents,
+    # with the children given by their entry index (-1 when missing), and the entry index of every root
+    index = {}
+    entries = []
+    for root in roots:
+        for node in postorder_nodes(root):
+            if node not in index:
+                index[node] = len(entries)
+                entries.append((node.data, index[node.left] if node.left != None else -1, index[node.right] if node.right != None else -1))
+    return entries, [index[root] for root in roots]
+
+def import_dag(entries: list[tuple[str, int, int]], root_indices: list[int], table: NodeTable) -> list[Node]:
+    # Inverse of export_dag, the nodes are made in table so they are shared with the ones already in it
+    nodes = []
+    for data, left, right in entries:
+        nodes.append(table.make(data, nodes[left] if left != -1 else None, nodes[right] if right != -1 else None))
+    return [nodes[index] for index in root_indices]
@@ -1,5 +1,119 @@
 from fractions import Fraction
 import math
+import numpy as np
 
-def get_lcm(coefficients: list[float]) -> int:
-    return math.lcm(*[Fraction(coefficient).limit_denominator().denominator for coefficient in coefficients])
\ No newline at end of file
+def rationalize(values: np.ndarray, max_denominator: int = 1000000, tolerance: float = 0.0) -> tuple[np.ndarray, np.ndarray]:
+    # Continued fraction expansion of every value at once, the vectorized Fraction(value).limit_denominator(max_denominator):
+    # returns int64 numerators and denominators (same shape as values) of the closest fractions with denominator at most
+    # max_denominator. With tolerance > 0 the expansion of a value stops at the first convergent within tolerance of it,
+    # so 0.66666667 gives 2/3 for any tolerance above 4e-9.
+    values = np.asarray(values, dtype=np.float64)
+    shape = values.shape
+    x = np.abs(values.ravel())
+    if not np.all(np.isfinite(x)):
+        raise ValueError("Only finite values have a rational approximation.")
+
+    p0, q0 = np.zeros(x.shape, dtype=np.int64), np.ones(x.shape, dtype=np.int64)
+    p1, q1 = np.ones(x.shape, dtype=np.int64), np.zeros(x.shape, dtype=np.int64)
+    remainder = x.copy()
+    active = np.ones(x.shape, dtype=bool)
+    bounded = np.zeros(x.shape, dtype=bool) # the next convergent would exceed max_denominator
+
+    while active.any():
+        index = np.flatnonzero(active)
+        r = remainder[index]
+        a = np.floor(r)
+        # past the integer part (q1 > 0) a larger than max_denominator always ends the expansion, clipping keeps q2 in int64
+        a_int = np.where(q1[index] == 0, a, np.minimum(a, max_denominator + 1)).astype(np.int64)
+        q2 = q0[index] + a_int * q1[index]
+
+        too_large = q2 > max_denominator
+        bounded[index[too_large]] = True
+        grow = index[~too_large]
+        a_grow = a_int[~too_large]
+        p0[grow], q0[grow], p1[grow], q1[grow] = p1[grow], q1[grow], p0[grow] + a_grow * p1[grow], q2[~too_large]
+
+        fraction = r[~too_large] - a[~too_large]
+        # a convergent can round to the value without being it, so without a tolerance only the expansion decides
+        done = (fraction <= 0) | ((tolerance > 0) & (np.abs(x[grow] - p1[grow] / q1[grow]) <= tolerance))
+        active[index[too_large]] = False
+        active[grow[done]] = False
+        grow = grow[~done]
+        remainder[grow] = 1 / fraction[~done]
+
+    # like limit_denominator, a value whose expansion was cut by max_denominator gets the closer of the last convergent
+    # and the best semiconvergent p0 + k p1 / q0 + k q1
+    index = np.flatnonzero(bounded)
+    if index.size:
+        k = (max_denominator - q0[index]) // q1[index]
+        p_semi, q_semi = p0[index] + k * p1[index], q0[index] + k * q1[index]
+        semi_error, convergent_error = np.abs(p_semi / q_semi - x[index]), np.abs(p1[index] / q1[index] - x[index])
+        use_semi = semi_error < convergent_error
+        # float64 decides only clear cases, near-ties are compared exactly in integers as Fraction does (a tie keeps the
+        # convergent), e.g. 1.95 with max_denominator 10 lies just below 19/10 and 2/1 and is 19/10
+        near_tie = np.flatnonzero(np.abs(semi_error - convergent_error) <= 8 * np.finfo(np.float64).eps * (x[index] + 1))
+        for i in near_tie.tolist():
+            n, d = float(x[index[i]]).as_integer_ratio()
+            ps, qs, pc, qc = int(p_semi[i]), int(q_semi[i]), int(p1[index[i]]), int(q1[index[i]])
+            use_semi[i] = abs(ps * d - n * qs) * qc < abs(pc * d - n * qc) * qs
+        p1[index] = np.where(use_semi, p_semi, p1[index])
+        q1[index] = np.where(use_semi, q_semi, q1[index])
+
+    numerators = np.where(values.ravel() < 0, -p1, p1)
+    return numerators.reshape(shape), q1.reshape(shape)
+
+def lcm_of(denominators: np.ndarray) -> int:
+    # exact, the distinct denominators are few even when there are millions of them
+    return math.lcm(*np.unique(np.asarray(denominators)).tolist())
+
+def get_lcm(coefficients, max_denominator: int = 1000000, tolerance: float = 0.0) -> int:
+    # coefficients is a list, an array or a tensor of any shape
+    coefficients = np.asarray(coefficients, dtype=np.float64).ravel()
+    if coefficients.size == 0:
+        return 1
+    _, denominators = rationalize(coefficients, max_denominator, tolerance)
+    return lcm_of(denominators)
+
+def rational_to_integer(weights: np.ndarray, biases: np.ndarray, max_denominator: int = 1000000, tolerance: float = 0.0) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # For a layer (weights has one row per neuron): the lcm of the denominators of each row and its bias, and the rows
+    # and biases multiplied by their lcm, as int64. A row whose lcm does not fit in int64 raises ValueError.
+    weights = np.asarray(weights, dtype=np.float64)
+    biases = np.asarray(biases, dtype=np.float64)
+    coefficients = np.concatenate((weights, biases[:, None]), axis=1)
+    numerators, denominators = rationalize(coefficients, max_denominator, tolerance)
+
+    row_lcms = np.ones(coefficients.shape[0], dtype=np.int64)
+    with np.errstate(over='ignore'):
+        for column in range(coefficients.shape[1]):
+            row_lcms = np.lcm(row_lcms, denominators[:, column])
+    # np.lcm wraps around on overflow, the rows where it did are computed exactly
+    for row in np.flatnonzero((row_lcms <= 0) | np.any(row_lcms[:, None] % denominators != 0, axis=1)):
+        row_lcm = lcm_of(denominators[row])
+        if row_lcm >= 2 ** 63:
+            raise ValueError(f"The lcm of the denominators of row {row} does not fit in 64 bits.")
+        row_lcms[row] = row_lcm
+
+    integers = numerators * (row_lcms[:, None] // denominators)
+    return row_lcms, integers[:, :-1], integers[:, -1]
+
+def sparse_rational_to_integer(rows: np.ndarray, values: np.ndarray, biases: np.ndarray, max_denominator: int = 1000000, tolerance: float = 0.0) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # rational_to_integer for a layer given by its stored entries: values[i] is in row rows[i], the other entries are 0
+    values = np.asarray(values, dtype=np.float64)
+    biases = np.asarray(biases, dtype=np.float64)
+    numerators, denominators = rationalize(values, max_denominator, tolerance)
+    bias_numerators, bias_denominators = rationalize(biases, max_denominator, tolerance)
+
+    row_lcms = bias_denominators.copy()
+    with np.errstate(over='ignore'):
+        np.lcm.at(row_lcms, rows, denominators)
+    # np.lcm wraps around on overflow, the rows where it did are computed exactly
+    overflowed = np.zeros(row_lcms.shape[0], dtype=bool)
+    overflowed[rows[(row_lcms[rows] <= 0) | (row_lcms[rows] % denominators != 0)]] = True
+    overflowed |= row_lcms <= 0
+    for row in np.flatnonzero(overflowed):
+        row_lcm = lcm_of(np.append(denominators[rows == row], bias_denominators[row]))
+        if row_lcm >= 2 ** 63:
+            raise ValueError(f"The lcm of the denominators of row {row} does not fit in 64 bits.")
+        row_lcms[row] = row_lcm
+
+    return row_lcms, numerators * (row_lcms[rows] // denominators), bias_numerators * (row_lcms // bias_denominators)
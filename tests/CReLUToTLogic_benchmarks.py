@@ -0,0 +1,185 @@
+import sys
+import os
+import time
+import tempfile
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from src.CReluToTLogic import *
+from src.TLogics import *
+from src.NetworkPruning import *
+
+Lukasiewicz = Lukasiewicz()
+
+def random_CReLU(widths: list[int], nonzeros: int = 6, seed: int = 0) -> CReLUNetwork:
+    # integer weights in {-1, 1}, nonzeros of them per neuron, and a single output neuron
+    generator = torch.Generator().manual_seed(seed)
+    weights, biases = [], []
+    for inputs, outputs in zip(widths, widths[1:] + [1]):
+        weight = torch.zeros((outputs, inputs), dtype=torch.float64)
+        for neuron in range(outputs):
+            columns = torch.randperm(inputs, generator=generator)[:nonzeros]
+            weight[neuron, columns] = torch.randint(0, 2, (len(columns),), generator=generator).to(torch.float64) * 2 - 1
+        weights.append(weight)
+        biases.append(torch.randint(0, 2, (outputs,), generator=generator).to(torch.float64))
+    return CReLUNetwork(weights, biases)
+
+# The composition used before compose_MV_terms_dag, kept here as a reference for the timings
+def compose_MV_terms_replace(CReLU: CReLUNetwork, MV_terms: dict) -> str:
+    for layer in range(1, CReLU.num_layers):
+        for neuron in range(CReLU.weights[layer].shape[0]):
+            for variable in range(CReLU.weights[layer].shape[1]):
+                MV_terms[layer][neuron + 1] = MV_terms[layer][neuron + 1].replace(f'x{variable + 1}', f's{variable + 1}')
+
+        for neuron in range(CReLU.weights[layer].shape[0]):
+            for variable in range(CReLU.weights[layer].shape[1]):
+                MV_terms[layer][neuron + 1] = MV_terms[layer][neuron + 1].replace(f's{variable + 1}', MV_terms[layer - 1][variable + 1])
+
+    return MV_terms[CReLU.num_layers - 1][1]
+
+print("Composition of the neuron terms: shared subterms against str.replace")
+print(f"{'widths':>18} {'construct (s)':>14} {'dag (s)':>9} {'unique nodes':>13} {'tree nodes':>12} {'replace (s)':>12} {'chars':>12}")
+for widths in [[4, 4, 4], [8, 8, 8], [8, 8, 8, 8], [32, 32, 32, 32]]:
+    CReLU = random_CReLU(widths)
+    start = time.perf_counter()
+    MV_terms = construct_MV_terms(CReLU)
+    construct_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    root, depth = compose_MV_terms_dag(CReLU, MV_terms)
+    dag_time = time.perf_counter() - start
+    tree_size, unique_size = Tree.count_nodes(root)
+
+    replace_time, chars = float('nan'), float('nan')
+    if tree_size < 10 ** 6: # the string is as long as the tree
+        start = time.perf_counter()
+        formula = compose_MV_terms_replace(CReLU, {layer: dict(terms) for layer, terms in MV_terms.items()})
+        replace_time, chars = time.perf_counter() - start, len(formula)
+    print(f"{str(widths):>18} {construct_time:>14.4f} {dag_time:>9.4f} {unique_size:>13} {tree_size:>12} {replace_time:>12.4f} {chars:>12}")
+
+# The recursion used before the memoized sigma_construct_node, kept here as a reference for the timings
+def sigma_construct_strings(w, b):
+    if np.all(w == 0):
+       return str(int(sigma_activation(b)))
+    elif np.all(w <= 0):
+        return f"(¬{sigma_construct_strings(-1*w, -1*b + 1)})"
+    idx = np.where(w > 0)[0][0]
+    wl, wr = w.copy(), w.copy()
+    wl[idx] -= 1
+    wr[idx] -= 1
+    left, right = sigma_construct_strings(wl, b), sigma_construct_strings(wr, b + 1)
+    if is_false(right):
+        return "0"
+    if is_true(left):
+        return right
+    if is_true(right):
+        return f"x{idx+1}" if is_false(left) else f"({left}⊕x{idx+1})"
+    if is_false(left):
+        return f"(x{idx+1}⊙{right})"
+    return f"(({left}⊕x{idx+1})⊙{right})"
+
+print()
+print("sigma_construct on the rows of a neuron split by transform_ReLU_to_CReLU (same weights, biases 0, -1, ...)")
+print(f"{'weights':>22} {'rows':>5} {'recursive (s)':>14} {'memoized (s)':>13} {'hit rate':>9} {'nodes':>6}")
+for w, rows in [([2., 1., 1.], 4), ([3., 2., 2.], 7), ([4., 3., 3., -2.], 10), ([6., 5., 4., 3.], 18)]:
+    w = np.array(w)
+    start = time.perf_counter()
+    if sum(w[w > 0]) <= 14:
+        for row in range(rows):
+            sigma_construct_strings(w, -row)
+        recursive_time = time.perf_counter() - start
+    else:
+        recursive_time = float('nan')
+
+    cache = SigmaCache()
+    start = time.perf_counter()
+    for row in range(rows):
+        sigma_construct_node(w, -row, cache)
+    memoized_time = time.perf_counter() - start
+    print(f"{str(w.tolist()):>22} {rows:>5} {recursive_time:>14.4f} {memoized_time:>13.4f} {cache.hit_rate():>9.2f} {len(cache.table):>6}")
+
+print()
+print("Extraction of the formula: strings parsed back by generate_ast against nodes built from the weights")
+print(f"{'widths':>18} {'strings + parse (s)':>20} {'nodes (s)':>10} {'unique nodes':>13}")
+for widths in [[4, 4, 4], [8, 8, 8], [16, 16, 16]]:
+    CReLU = random_CReLU(widths)
+    start = time.perf_counter()
+    Lukasiewicz.generate_ast(compose_MV_terms(CReLU, construct_MV_terms(CReLU)))
+    string_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    root, depth = extract_MV_term(CReLU)
+    node_time = time.perf_counter() - start
+    print(f"{str(widths):>18} {string_time:>20.4f} {node_time:>10.4f} {Tree.count_nodes(root)[1]:>13}")
+
+print()
+print("Extraction with the terms kept on disk: first run, same network again, network with a new last layer")
+print(f"{'widths':>18} {'no store (s)':>13} {'cold (s)':>9} {'warm (s)':>9} {'tuned (s)':>10} {'tuned hits':>11} {'bytes':>8}")
+with tempfile.TemporaryDirectory() as directory:
+    for widths in [[8, 8, 8], [16, 16, 16], [32, 32, 32]]:
+        CReLU = random_CReLU(widths)
+        tuned = random_CReLU(widths)
+        tuned.weights[-1] = tuned.weights[-1].flip(1) # as if only the last layer was fine-tuned
+        store = TermStore(os.path.join(directory, f"{widths[0]}.db"))
+        times = []
+        for network, run_store in [(CReLU, None), (CReLU, store), (CReLU, store), (tuned, store)]:
+            hits = store.hits
+            start = time.perf_counter()
+            extract_MV_term(network, store=run_store)
+            times.append(time.perf_counter() - start)
+        print(f"{str(widths):>18} {times[0]:>13.4f} {times[1]:>9.4f} {times[2]:>9.4f} {times[3]:>10.4f} {store.hits - hits:>11} {store.stats()['bytes']:>8}")
+        store.close()
+
+print()
+print("Extraction after changing one row of a hidden layer: from scratch against an ExtractionSession")
+print(f"{'widths':>18} {'scratch (s)':>12} {'session (s)':>12} {'terms rebuilt':>14} {'composed rebuilt':>17}")
+for widths in [[8, 8, 8], [16, 16, 16], [32, 32, 32, 32]]:
+    CReLU = random_CReLU(widths)
+    session = ExtractionSession()
+    session.update(CReLU)
+    CReLU.weights[1][0] = CReLU.weights[1][0].flip(0) # a fine-tuning step that moved one neuron
+    start = time.perf_counter()
+    extract_MV_term(CReLU)
+    scratch_time = time.perf_counter() - start
+    start = time.perf_counter()
+    report = session.update(CReLU)
+    session_time = time.perf_counter() - start
+    print(f"{str(widths):>18} {scratch_time:>12.4f} {session_time:>12.4f} {report['neurons_rebuilt']:>14} {report['composed_rebuilt']:>17}")
+
+print()
+print("Pruning with interval bounds before the extraction (one hidden neuron in three made dead and one in three saturated)")
+print(f"{'widths':>18} {'neurons':>8} {'dead':>5} {'saturated':>10} {'unused':>7} {'pruned':>7} {'prune (s)':>10} {'nodes before':>13} {'nodes after':>12}")
+for widths in [[8, 8, 8], [16, 16, 16], [32, 32, 32]]:
+    CReLU = random_CReLU(widths)
+    for layer in range(CReLU.num_layers - 1):
+        # the 6 weights in {-1, 1} of a neuron move its pre-activation by at most 6, a bias shifted by 7 keeps it at 0 or 1
+        shifts = torch.tensor([-7.0, 0.0, 7.0], dtype=torch.float64).repeat(CReLU.biases[layer].shape[0])[:CReLU.biases[layer].shape[0]]
+        CReLU.biases[layer] = CReLU.biases[layer] + shifts
+    start = time.perf_counter()
+    pruned, report = prune_network(CReLU)
+    prune_time = time.perf_counter() - start
+    before, after = Tree.count_nodes(extract_MV_term(CReLU)[0])[1], Tree.count_nodes(extract_MV_term(pruned)[0])[1]
+    counts = {key: sum(info[key] for info in report["layers"]) for key in ["dead", "saturated", "unused"]}
+    print(f"{str(widths):>18} {report['neurons_before']:>8} {counts['dead']:>5} {counts['saturated']:>10} {counts['unused']:>7} "
+          f"{report['neurons_before'] - report['neurons_after']:>7} {prune_time:>10.4f} {before:>13} {after:>12}")
+
+# guarded, with the spawn and forkserver start methods the workers import this script
+if __name__ == "__main__":
+    print()
+    print("construct_MV_terms on a process pool")
+    CReLU = random_CReLU([64, 64, 64], nonzeros=12)
+    max_workers = max(os.cpu_count() or 1, 2) # the pool is timed even on one core
+    print(f"{'workers':>8} {'chunksize':>10} {'time (s)':>9} {'speedup':>8}")
+    workers = 1
+    while True:
+        start = time.perf_counter()
+        construct_MV_terms(CReLU, workers=workers, chunksize=8)
+        elapsed = time.perf_counter() - start
+        if workers == 1:
+            serial_time = elapsed
+        print(f"{workers:>8} {8:>10} {elapsed:>9.4f} {serial_time / elapsed:>8.2f}")
+        if workers >= max_workers:
+            break
+        workers = min(2 * workers, max_workers)
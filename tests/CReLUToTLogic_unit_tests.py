@@ -1,5 +1,7 @@
 import sys
 import os
+import tempfile
+from copy import deepcopy
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
@@ -10,6 +12,7 @@ from src.ReLUNetwork import *
 from src.CReLUNetwork import *
 from src.TLogics import *
 from src.TLogicToReLU import * 
+from src.utils.TermStore import *
 
 Lukasiewicz = Lukasiewicz()
 
@@ -277,4 +280,121 @@ original_output = ReLU6(test_input)
 transformed_output = ReLU5(test_input)
 
 print("Original Output:", original_output)
-print("Transformed Output (scaled):", transformed_output)
\ No newline at end of file
+print("Transformed Output (scaled):", transformed_output)
+# -------------------- #
+#  SHARED COMPOSITION  #
+# -------------------- #
+
+# 12 inputs, x1 must not be replaced inside x10, x11 and x12
+weights = torch.zeros((2, 12), dtype=torch.float64)
+weights[0, 0], weights[0, 9], weights[1, 11] = 1, 1, -1
+CReLU = CReLUNetwork([weights, torch.tensor([[1, 1]], dtype=torch.float64)], [torch.tensor([0, 1], dtype=torch.float64), torch.tensor([-1], dtype=torch.float64)])
+CReLU.construct_layers()
+
+root, depth = compose_MV_terms_dag(CReLU, construct_MV_terms(CReLU))
+formula = compose_MV_terms(CReLU, construct_MV_terms(CReLU))
+print(formula)
+print("Expected Result: ((x10⊕x1)⊙(¬x12))")
+
+input_tensor = torch.tensor([0.3, 0, 0, 0, 0, 0, 0, 0, 0, 0.4, 0, 0.2], dtype=torch.float64)
+print(CReLU(input_tensor).item(), Lukasiewicz.evaluate_formula(root, tensor_to_valuation(input_tensor)))
+print("Expected Result: 0.5 0.5")
+
+# the sigma constructions are memoized by (w, b), the second neuron repeats the subproblems of the first
+cache = SigmaCache()
+first = sigma_construct_node(np.array([2., 1.]), 0., cache)
+misses = cache.misses
+second = sigma_construct_node(np.array([2., 1.]), -1., cache)
+print(Lukasiewicz.generate_formula_from_ast(first), Lukasiewicz.generate_formula_from_ast(second))
+print("Expected Result: ((x2⊕x1)⊕x1) (((x1⊙x2)⊕x1)⊙(x2⊕x1))")
+print(cache.misses - misses, cache.hits)
+print("Expected Result: 4 6")
+
+# the formula built from the weights, without strings, is the one compose_MV_terms writes
+root, depth = extract_MV_term(CReLU)
+print(Lukasiewicz.generate_formula_from_ast(root) == compose_MV_terms(CReLU, construct_MV_terms(CReLU)), Lukasiewicz.evaluate_formula(root, tensor_to_valuation(input_tensor)))
+print("Expected Result: True 0.5")
+
+# the size of the extraction is known before the formula is written, a ReLU network is transformed first
+prediction = predict_extraction_size(ReLU2, build_terms=True)
+formula = compose_MV_terms(transform_ReLU_to_CReLU(ReLU2), construct_MV_terms(transform_ReLU_to_CReLU(ReLU2)))
+print(prediction["formula_chars"] == len(formula), prediction["exact"], prediction["layers"][0]["split_counts"])
+print("Expected Result: True True [1, 1]")
+print(predict_extraction_size(ReLU2, max_states=1, build_terms=True)["formula_chars"], len(predict_extraction_size(ReLU2, max_states=1, build_terms=True)["skipped_neurons"]))
+print("Expected Result: None 3")
+# without building the terms only the bounds are given, they hold for the exact sizes
+bounds = predict_extraction_size(ReLU2)
+print(bounds["formula_chars"], bounds["exact"], prediction["formula_chars"] <= bounds["formula_chars_bound"], prediction["term_nodes"] <= bounds["term_nodes_bound"])
+print("Expected Result: None False True True")
+
+# over a budget the extraction stops with a report of where it was
+try:
+    compose_MV_terms(CReLU, construct_MV_terms(CReLU), max_chars=10)
+except ExtractionBudgetExceeded as error:
+    print(error.report["stage"], error.report["chars"])
+print("Expected Result: compose 17")
+try:
+    extract_MV_term(CReLU, max_nodes=2)
+except ExtractionBudgetExceeded as error:
+    print(error.report["stage"], error.report["layer"], error.report["neuron"], error.report["completed_neurons"])
+print("Expected Result: construct 0 1 0")
+budget_cache = SigmaCache()
+try:
+    extract_MV_term(CReLU, budget_cache, max_nodes=2)
+except ExtractionBudgetExceeded:
+    pass
+print(budget_cache.max_nodes, Lukasiewicz.generate_formula_from_ast(extract_MV_term(CReLU, budget_cache)[0]) == Lukasiewicz.generate_formula_from_ast(extract_MV_term(CReLU)[0]))
+print("Expected Result: None True")
+
+# the neuron terms kept on disk are read back by a later extraction, with the same formula
+with tempfile.TemporaryDirectory() as directory:
+    store = TermStore(os.path.join(directory, "terms.db"))
+    formula = Lukasiewicz.generate_formula_from_ast(extract_MV_term(CReLU, store=store)[0])
+    reopened = TermStore(os.path.join(directory, "terms.db"))
+    print(Lukasiewicz.generate_formula_from_ast(extract_MV_term(CReLU, store=reopened)[0]) == formula, store.misses, reopened.hits, reopened.misses)
+    print("Expected Result: True 3 3 0")
+    # the keys hash the exact integer rows, rows that round to the same float64 get different keys
+    print(term_store_key("rational", [2 ** 53, 3], 1, 2 ** 60) == term_store_key("rational", [2 ** 53 + 1, 3], 1, 2 ** 60))
+    print("Expected Result: False")
+    print(decode_dag(encode_dag(*Tree.export_dag([root]))) == Tree.export_dag([root]))
+    print("Expected Result: True")
+    small = TermStore(os.path.join(directory, "small.db"), max_bytes=len(encode_dag(*Tree.export_dag([root]))))
+    for key in [b"first", b"second", b"third"]:
+        small.put(key, *Tree.export_dag([root]))
+    small.get(b"third")
+    print(len(small), small.get(b"first"), small.get(b"third") is not None)
+    print("Expected Result: 1 None True")
+    store.close(), reopened.close(), small.close()
+
+# a session builds again only the neurons whose rows changed, and composes again what depends on them
+session = ExtractionSession()
+session.update(CReLU)
+tuned_weights = [weight.clone() for weight in CReLU.weights]
+tuned_weights[0][1, 11] = -0.5
+tuned = CReLUNetwork(tuned_weights, CReLU.biases)
+report = session.update(tuned)
+print(session.formula() == compose_MV_terms(tuned, construct_MV_terms(tuned)), report["neurons_reused"], report["neurons_rebuilt"], report["composed_rebuilt"])
+print("Expected Result: True 2 1 2")
+print(session.update(tuned)["neurons_rebuilt"], session.update(CReLU)["neurons_rebuilt"], session.formula())
+print("Expected Result: 0 1 ((x10⊕x1)⊙(¬x12))")
+# the nodes and terms of the replaced neurons do not stay in the session
+fresh = ExtractionSession()
+fresh.update(CReLU)
+terms = {term for layer_terms in session.terms for term in layer_terms}
+print(len(session.table) == len(fresh.table), set(session.term_atoms) <= terms)
+print("Expected Result: True True")
+
+# a sparse layer is extracted from its stored entries, to the same formula
+sparse_CReLU = CReLUNetwork([weight.to_sparse() for weight in CReLU.weights], CReLU.biases)
+print(Lukasiewicz.generate_formula_from_ast(extract_MV_term(sparse_CReLU)[0]), predict_extraction_size(sparse_CReLU, build_terms=True)["formula_chars"])
+print("Expected Result: ((x10⊕x1)⊙(¬x12)) 17")
+
+# the constructions get every row as exact integers, with the lcm that scaled it
+print([(w.tolist(), b, lcm) for _, _, w, b, lcm, _ in layer_tasks(torch.tensor([[1 / 3, 0.5]], dtype=torch.float64), torch.tensor([-1 / 6], dtype=torch.float64), 0)])
+print("Expected Result: [([2, 3], -1, 6)]")
+
+# the terms computed on a process pool are the same and come in the same order
+# (guarded, with the spawn and forkserver start methods the workers import this script)
+if __name__ == "__main__":
+    print(construct_MV_terms(CReLU, workers=2, chunksize=1) == construct_MV_terms(CReLU))
+    print("Expected Result: True")
@@ -0,0 +1,94 @@
+import sys
+import os
+import time
+from copy import deepcopy
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from src.CReLUNetwork import *
+
+# The transformation used before the vectorized one, kept here as a reference for the timings
+def transform_ReLU_to_CReLU_stack(ReLU: ReLUNetwork) -> 'CReLUNetwork':
+    CReLUNet = CReLUNetwork([], [])
+    CReLUNet.num_layers = ReLU.num_layers
+    # Last layer doesn't need to be transformed!
+    for i in range(ReLU.num_layers - 1):
+        ReLU_weight = ReLU.weights[i]
+        ReLU_bias = ReLU.biases[i]
+        num_neurons = ReLU_weight.shape[0]
+
+        CReLU_weight = None
+        CReLU_bias = None
+        updated_ReLU_weight = None
+
+        for j in range(num_neurons):
+            contributing_weight = ReLU_weight[j]
+            contributing_bias = ReLU_bias[j]
+            max_weighted_input = int(torch.ceil(torch.sum(contributing_weight[contributing_weight > 0]) + contributing_bias).item())  # bound of the maximum output in the ReLU Network
+            # if the max_weighted_input exceeds one then we have to add "neurons", meaning we have to expand the weight matrix and updated the bias
+            if max_weighted_input > 1:
+                for u in range(0, max_weighted_input):
+
+                    if CReLU_weight is None:
+                        CReLU_weight = contributing_weight
+                    else:
+                        CReLU_weight = torch.vstack((CReLU_weight, contributing_weight))
+
+                    if CReLU_bias is None:
+                        CReLU_bias = torch.tensor([contributing_bias.item()], dtype=torch.float64)
+                    else:
+                        CReLU_bias = torch.hstack((CReLU_bias, torch.tensor([contributing_bias.item() - u], dtype=torch.float64)))
+
+                    if updated_ReLU_weight is None:
+                        updated_ReLU_weight = ReLU.weights[i + 1][:, j].view(-1, 1)
+                    else:
+                        updated_ReLU_weight = torch.hstack((updated_ReLU_weight, ReLU.weights[i + 1][:, j].view(-1, 1)))
+            else:
+                if CReLU_weight is None:
+                    CReLU_weight = contributing_weight
+                else:
+                    CReLU_weight = torch.vstack((CReLU_weight, contributing_weight))
+
+                if CReLU_bias is None:
+                    CReLU_bias = torch.tensor([contributing_bias.item()], dtype=torch.float64)
+                else:
+                    CReLU_bias = torch.hstack((CReLU_bias, torch.tensor([contributing_bias.item()], dtype=torch.float64)))
+
+                if updated_ReLU_weight is None:
+                    updated_ReLU_weight = ReLU.weights[i + 1][:, j].view(-1, 1)
+                else:
+                    updated_ReLU_weight = torch.hstack((updated_ReLU_weight, ReLU.weights[i + 1][:, j].view(-1, 1)))
+
+        CReLUNet.weights.append(CReLU_weight)
+        CReLUNet.biases.append(CReLU_bias)
+        ReLU.weights[i + 1] = updated_ReLU_weight
+    
+    CReLUNet.weights.append(ReLU.weights[-1])
+    CReLUNet.biases.append(ReLU.biases[-1])
+
+    return CReLUNet
+
+def random_ReLU(widths: list[int], seed: int = 0) -> ReLUNetwork:
+    # weights in [-4 / inputs, 4 / inputs], so the neurons are split in one to three copies
+    generator = torch.Generator().manual_seed(seed)
+    weights = [(torch.rand((outputs, inputs), generator=generator, dtype=torch.float64) - 0.5) * 8 / inputs for inputs, outputs in zip(widths, widths[1:])]
+    biases = [torch.rand((outputs,), generator=generator, dtype=torch.float64) for outputs in widths[1:]]
+    return ReLUNetwork(weights, biases)
+
+print("transform_ReLU_to_CReLU: stacking one copy at a time against the vectorized version")
+print(f"{'widths':>24} {'CReLU neurons':>14} {'stacking (s)':>13} {'vectorized (s)':>15}")
+for widths in [[20, 100, 100, 1], [50, 1000, 1000, 1], [100, 2000, 2000, 1], [100, 4000, 4000, 1]]:
+    ReLU = random_ReLU(widths)
+    start = time.perf_counter()
+    CReLU = transform_ReLU_to_CReLU(ReLU)
+    vectorized_time = time.perf_counter() - start
+
+    stacking_time = float('nan')
+    if widths[1] <= 1000:
+        start = time.perf_counter()
+        transform_ReLU_to_CReLU_stack(deepcopy(ReLU))
+        stacking_time = time.perf_counter() - start
+    num_neurons = sum(weight.shape[0] for weight in CReLU.weights[:-1])
+    print(f"{str(widths):>24} {num_neurons:>14} {stacking_time:>13.4f} {vectorized_time:>15.4f}")
@@ -25,4 +25,21 @@ print(ReLUNetwork.layers)
 print(CReLUNetwork.layers)
 
 print(ReLUNetwork(torch.tensor([0.5, 1, 2], dtype=torch.float64)))
-print(CReLUNetwork(torch.tensor([0.5, 1, 2], dtype=torch.float64)))
\ No newline at end of file
+print(CReLUNetwork(torch.tensor([0.5, 1, 2], dtype=torch.float64)))
+# the network given to transform_ReLU_to_CReLU is left as it was
+weights = [weight.clone() for weight in ReLUNetwork.weights]
+CReLUNetwork = transform_ReLU_to_CReLU(ReLUNetwork)
+assert all(torch.equal(weight, original) for weight, original in zip(ReLUNetwork.weights, weights))
+print([weight.shape[0] for weight in CReLUNetwork.weights])
+print("Expected Result: [9, 18, 37, 1]")
+
+# sparse weights stay sparse through the transformation and give the same network
+sparse_ReLU = ReLUNetwork.__class__([weight.to_sparse() for weight in ReLUNetwork.weights], ReLUNetwork.biases)
+sparse_CReLU = transform_ReLU_to_CReLU(sparse_ReLU)
+print(all(weight.is_sparse for weight in sparse_CReLU.weights), all(torch.equal(sparse.to_dense(), dense) for sparse, dense in zip(sparse_CReLU.weights, CReLUNetwork.weights)))
+print("Expected Result: True True")
+sparse_CReLU.construct_layers()
+CReLUNetwork.construct_layers()
+input_tensor = torch.tensor([[0.5, 1, 2], [0.1, 0.2, 0.3]], dtype=torch.float64)
+print(torch.allclose(sparse_CReLU(input_tensor), CReLUNetwork(input_tensor)), torch.allclose(sparse_CReLU(input_tensor[0]), CReLUNetwork(input_tensor[0])))
+print("Expected Result: True True")
@@ -0,0 +1,59 @@
+import sys
+import os
+import io
+from itertools import product
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from src.ExpressoMVParser import *
+
+Lukasiewicz = Lukasiewicz()
+
+values = [0, 0.5, 1]
+variables = ["x1", "x2", "x3"]
+formula = "(¬((x3⊙(¬x2))⊕(x1⇒x3)))"
+value_to_binary_vector, binary_vector_to_value = BinaryVectorEncoder(values)
+
+# the table row by row, as it was built before the blocks
+expected_table = {}
+for combination in product(values, repeat=len(variables)):
+    output = Lukasiewicz.evaluate_formula(Lukasiewicz.generate_ast(formula)[0], dict(zip(variables, combination)))
+    expected_table[''.join([value_to_binary_vector[value] for value in combination])] = value_to_binary_vector[output]
+
+truth_table = FormulaToTruthTable(formula, Lukasiewicz, variables, values, value_to_binary_vector)
+print(len(truth_table), truth_table["000000"], truth_table["101010"])
+print("Expected Result: 27 00 00")
+assert truth_table == expected_table and list(truth_table) == list(expected_table)
+
+# blocks smaller than the table give the same rows in the same order
+pla_file = io.StringIO()
+WriteTruthTableRows(pla_file, formula, Lukasiewicz, variables, values, value_to_binary_vector, chunk_size=5)
+assert pla_file.getvalue() == ''.join(f'{inputs} {output}\n' for inputs, output in expected_table.items())
+
+try:
+    FormulaToTruthTable("(δ_2 x1)", Lukasiewicz, ["x1"], values, value_to_binary_vector)
+    assert False
+except ValueError as error:
+    print(error)
+    print("Expected Result: The formula takes the value 0.25, which is not one of the truth values [0.0, 0.5, 1.0].")
+
+# δ_2 leaves L_2 but the sums and products of its values come back to it, those rows are evaluated with floats
+print(FormulaToTruthTable("((δ_2 x1)⊕(δ_2 x1))", Lukasiewicz, ["x1"], values, value_to_binary_vector))
+print("Expected Result: {'00': '00', '01': '01', '10': '10'}")
+print(FormulaToTruthTable("((δ_2 x1)⊙0)", Lukasiewicz, ["x1"], values, value_to_binary_vector))
+print("Expected Result: {'00': '00', '01': '00', '10': '00'}")
+delta_formula = "(((δ_2 x1)⊕(δ_2 x1))⊙(¬((δ_2 x2)⊕(δ_2 x2))))"
+delta_table = FormulaToTruthTable(delta_formula, Lukasiewicz, ["x1", "x2"], values, value_to_binary_vector)
+for combination in product(values, repeat=2):
+    output = Lukasiewicz.evaluate_formula(Lukasiewicz.generate_ast(delta_formula)[0], dict(zip(["x1", "x2"], combination)))
+    assert delta_table[''.join([value_to_binary_vector[value] for value in combination])] == value_to_binary_vector[output]
+
+# the chain in another order is still evaluated with the lookup tables of L_2, values that are not a chain in floating point
+for other_values in [[1, 0, 0.5], [0, 0.4, 0.6, 1]]:
+    other_value_to_binary_vector, _ = BinaryVectorEncoder(other_values)
+    other_table = FormulaToTruthTable("((x1∧x2)V(¬x1))", Lukasiewicz, ["x1", "x2"], other_values, other_value_to_binary_vector)
+    for combination in product(other_values, repeat=2):
+        output = Lukasiewicz.evaluate_formula(Lukasiewicz.generate_ast("((x1∧x2)V(¬x1))")[0], dict(zip(["x1", "x2"], combination)))
+        assert other_table[''.join([other_value_to_binary_vector[value] for value in combination])] == other_value_to_binary_vector[output]
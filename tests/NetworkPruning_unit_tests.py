@@ -0,0 +1,83 @@
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from src.NetworkPruning import *
+from src.CReluToTLogic import *
+
+Lukasiewicz = Lukasiewicz()
+
+# ------------------------- #
+#  INTERVAL BOUND PRUNING   #
+# ------------------------- #
+
+# neuron 1 is dead (at most -1), neuron 3 copies neuron 2 and neuron 4 is saturated (at least 1),
+# once merged the columns of neurons 2 and 3 cancel, so the network is the constant 0.5
+CReLU = CReLUNetwork(
+    [torch.tensor([[1.0, -1.0], [0.5, 0.5], [0.5, 0.5], [1.0, 1.0]], dtype=torch.float64), torch.tensor([[1.0, 1.0, -1.0, 0.5]], dtype=torch.float64)],
+    [torch.tensor([-2.0, 0.0, 0.0, 1.0], dtype=torch.float64), torch.tensor([0.0], dtype=torch.float64)]
+)
+print([(lower.tolist(), upper.tolist()) for lower, upper in interval_bounds(CReLU)][0])
+print("Expected Result: ([-3.0, 0.0, 0.0, 1.0], [-1.0, 1.0, 1.0, 3.0])")
+
+pruned, report = prune_network(CReLU)
+print(pruned.weights, pruned.biases)
+print("Expected Result: [tensor([[0., 0.]], dtype=torch.float64), tensor([[0.]], dtype=torch.float64)] [tensor([0.], dtype=torch.float64), tensor([0.5000], dtype=torch.float64)]")
+print(report["layers"][0], report["neurons_before"], report["neurons_after"])
+print("Expected Result: {'neurons_before': 4, 'dead': 1, 'saturated': 1, 'constant': 0, 'duplicates': 1, 'unused': 1, 'neurons_after': 1} 4 1")
+
+# the formula of the pruned network is smaller and computes the same function
+input_tensor = torch.tensor([[0.3, 0.9]], dtype=torch.float64)
+formula = Lukasiewicz.generate_formula_from_ast(extract_MV_term(pruned)[0])
+print(formula, round(network_outputs(CReLU, input_tensor).item(), 9), network_outputs(pruned, input_tensor).item())
+print("Expected Result: ((δ_2 1)⊕(δ_2 0)) 0.5 0.5")
+
+# ReLU neurons are not clipped, so only the dead ones are constant
+ReLU = ReLUNetwork(
+    [torch.tensor([[1.0, -1.0], [1.0, 1.0]], dtype=torch.float64), torch.tensor([[1.0, 1.0]], dtype=torch.float64)],
+    [torch.tensor([-2.0, 1.0], dtype=torch.float64), torch.tensor([0.0], dtype=torch.float64)]
+)
+pruned, report = prune_network(ReLU)
+print(pruned.weights[0].tolist(), report["layers"][0]["dead"], report["layers"][0]["saturated"], type(pruned).__name__)
+print("Expected Result: [[1.0, 1.0]] 1 0 ReLUNetwork")
+
+# sparse weights are pruned the same way and stay sparse
+sparse_CReLU = CReLUNetwork([weight.to_sparse() for weight in CReLU.weights], [bias.clone() for bias in CReLU.biases])
+pruned, report = prune_network(sparse_CReLU)
+print(pruned.weights[0].is_sparse, [weight.to_dense().tolist() for weight in pruned.weights], pruned.biases[1].tolist(), report["neurons_after"])
+print("Expected Result: True [[[0.0, 0.0]], [[0.0]]] [0.5] 1")
+
+# the original network is left as it was
+print(CReLU.weights[0].shape, ReLU.weights[0].shape)
+print("Expected Result: torch.Size([4, 2]) torch.Size([2, 2])")
+
+# ------------------------- #
+#       LAYER FUSION        #
+# ------------------------- #
+
+# the first layer only passes x, y and x + y on, all at least 0, so its ReLU changes nothing and it is fused into the
+# second one, whose outputs x - y + 0.5 (x + y) go below 0 and keep their ReLU
+ReLU = ReLUNetwork(
+    [torch.tensor([[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]], dtype=torch.float64), torch.tensor([[1.0, -1.0, 0.5]], dtype=torch.float64), torch.tensor([[2.0]], dtype=torch.float64)],
+    [torch.tensor([0.0, 0.0, 0.0], dtype=torch.float64), torch.tensor([0.0], dtype=torch.float64), torch.tensor([1.0], dtype=torch.float64)]
+)
+fused, report = fuse_network(ReLU)
+print(fused.weights, fused.biases)
+print("Expected Result: [tensor([[ 1.5000, -0.5000]], dtype=torch.float64), tensor([[2.]], dtype=torch.float64)] [tensor([0.], dtype=torch.float64), tensor([1.], dtype=torch.float64)]")
+print(report["layers_before"], report["layers_after"], report["fused_layers"], report["pass_through_removed"], report["parameters_before"], report["parameters_after"])
+print("Expected Result: 3 2 1 2 15 5")
+
+# a CReLU is only the identity inside [0,1], x + y reaches 2 so nothing is fused
+CReLU = CReLUNetwork([weight.clone() for weight in ReLU.weights], [bias.clone() for bias in ReLU.biases])
+fused, report = fuse_network(CReLU)
+print(fused.num_layers, report["fused_layers"], type(fused).__name__)
+print("Expected Result: 3 0 CReLUNetwork")
+
+# sparse weights are fused into a sparse weight, with the same outputs
+sparse_ReLU = ReLUNetwork([weight.to_sparse() for weight in ReLU.weights], [bias.clone() for bias in ReLU.biases])
+fused, report = fuse_network(sparse_ReLU)
+print(fused.weights[0].is_sparse, fused.weights[0].to_dense().tolist(), network_outputs(fused, input_tensor).item(), network_outputs(ReLU, input_tensor).item())
+print("Expected Result: True [[1.5, -0.5]] 1.0 1.0")
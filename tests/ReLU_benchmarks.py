@@ -0,0 +1,55 @@
+import torch
+import sys
+import os
+import time
+from fractions import Fraction
+import math
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from src.ReLUNetwork import ReLUNetwork
+from src.utils.math_utils import rational_to_integer
+
+# The lcm used before the vectorized continued fractions, kept here as a reference for the timings
+def get_lcm_fractions(coefficients: list[float]) -> int:
+    return math.lcm(*[Fraction(coefficient).limit_denominator().denominator for coefficient in coefficients])
+
+def random_rational_ReLU(widths: list[int], seed: int = 0) -> ReLUNetwork:
+    # coefficients with denominators up to 8
+    generator = torch.Generator().manual_seed(seed)
+    weights, biases = [], []
+    for inputs, outputs in zip(widths, widths[1:]):
+        weights.append(torch.randint(-40, 41, (outputs, inputs), generator=generator).to(torch.float64) / torch.randint(1, 9, (outputs, inputs), generator=generator))
+        biases.append(torch.randint(-40, 41, (outputs,), generator=generator).to(torch.float64) / torch.randint(1, 9, (outputs,), generator=generator))
+    return ReLUNetwork(weights, biases)
+
+print("lcm of every coefficient of the network: Fraction per coefficient against vectorized continued fractions")
+print(f"{'parameters':>11} {'Fraction (s)':>13} {'vectorized (s)':>15} {'row lcms + integers (s)':>24}")
+for widths in [[100, 100, 1], [1000, 1000, 1], [2000, 1000, 1000, 1]]:
+    ReLU = random_rational_ReLU(widths)
+    num_parameters = sum(weight.numel() for weight in ReLU.weights) + sum(bias.numel() for bias in ReLU.biases)
+
+    fraction_time = float('nan')
+    if num_parameters <= 2 * 10 ** 6:
+        start = time.perf_counter()
+        coefficients = []
+        for weight in ReLU.weights:
+            coefficients += weight.flatten().tolist()
+        for bias in ReLU.biases:
+            coefficients += bias.flatten().tolist()
+        expected = get_lcm_fractions(coefficients)
+        fraction_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lcm = ReLU.get_general_lcm()
+    vectorized_time = time.perf_counter() - start
+    if num_parameters <= 2 * 10 ** 6:
+        assert lcm == expected
+
+    start = time.perf_counter()
+    for weight, bias in zip(ReLU.weights, ReLU.biases):
+        rational_to_integer(weight.numpy(), bias.numpy())
+    rows_time = time.perf_counter() - start
+    print(f"{num_parameters:>11} {fraction_time:>13.4f} {vectorized_time:>15.4f} {rows_time:>24.4f}")
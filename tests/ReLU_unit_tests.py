@@ -52,4 +52,24 @@ ReLU3 = ReLUNetwork.horizontally_append_ReLUs(ReLU1, ReLU2)
 for expected, actual in zip(expected_weights, ReLU3.weights):
     assert torch.equal(expected, actual)
 for expected, actual in zip(expected_biases, ReLU3.biases):
-    assert torch.equal(expected, actual)
\ No newline at end of file
+    assert torch.equal(expected, actual)
+# lcm of the denominators of all the coefficients, with the paper's rounded 2/3 read back as 2/3 given a tolerance
+ReLU = ReLUNetwork([torch.tensor([[0.5, 1 / 3], [0.66666667, 0.25]], dtype=torch.float64)], [torch.tensor([0.1, 1], dtype=torch.float64)])
+print(ReLU.get_general_lcm(tolerance=1e-6))
+print("Expected Result: 60")
+assert ReLU.get_general_lcm(tolerance=1e-6) == 60
+
+from src.utils.math_utils import rational_to_integer
+row_lcms, integer_weights, integer_biases = rational_to_integer(ReLU.weights[0].numpy(), ReLU.biases[0].numpy(), tolerance=1e-6)
+print(row_lcms, integer_weights.tolist(), integer_biases)
+print("Expected Result: [30 12] [[15, 10], [8, 3]] [ 3 12]")
+
+# near-ties are settled exactly, like Fraction(value).limit_denominator(max_denominator)
+from fractions import Fraction
+from src.utils.math_utils import rationalize
+for value, max_denominator in [(1.95, 10), (-4.3453827193039904, 1000000)]:
+    numerators, denominators = rationalize([value], max_denominator)
+    print(f"{numerators[0]}/{denominators[0]}", Fraction(value).limit_denominator(max_denominator))
+    assert Fraction(int(numerators[0]), int(denominators[0])) == Fraction(value).limit_denominator(max_denominator)
+print("Expected Result: 19/10 19/10")
+print("Expected Result: -4095206/942427 -4095206/942427")
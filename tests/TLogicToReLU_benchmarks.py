@@ -0,0 +1,190 @@
+import sys
+import os
+import time
+import random
+import numpy as np
+from copy import deepcopy
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from src.TLogicToReLU import *
+from src.NetworkPruning import *
+
+Lukasiewicz = Lukasiewicz()
+
+def construct_lukasiewicz_delta_ReLU(i: int):
+    x = np.float64(1 / int(i))
+    return ReLUNetwork(
+        [torch.tensor([[x]], dtype=torch.float64), torch.tensor([[1.]], dtype=torch.float64)],
+        [torch.tensor([0.], dtype=torch.float64), torch.tensor([0.], dtype=torch.float64)]
+    )
+
+Lukasiewicz_connectives_to_ReLU = {
+    "⊙": ReLUNetwork(
+        [torch.tensor([[1., 1.]], dtype=torch.float64), torch.tensor([[1.]], dtype=torch.float64)],
+        [torch.tensor([-1.], dtype=torch.float64), torch.tensor([0.], dtype=torch.float64)]
+    ),
+    "¬": ReLUNetwork(
+        [torch.tensor([[1.]], dtype=torch.float64), torch.tensor([[-1.]], dtype=torch.float64)],
+        [torch.tensor([0.], dtype=torch.float64), torch.tensor([1.], dtype=torch.float64)]
+    ),
+    "⊕": ReLUNetwork(
+        [torch.tensor([[-1., -1.]], dtype=torch.float64), torch.tensor([[-1.]], dtype=torch.float64)],
+        [torch.tensor([1.], dtype=torch.float64), torch.tensor([1.], dtype=torch.float64)]
+    ),
+    "⇒": ReLUNetwork(
+        [torch.tensor([[1., -1.]], dtype=torch.float64), torch.tensor([[-1.]], dtype=torch.float64)],
+        [torch.tensor([0.], dtype=torch.float64), torch.tensor([1.], dtype=torch.float64)]
+    ),
+    "": ReLUNetwork(
+        [torch.tensor([[1.]], dtype=torch.float64), torch.tensor([[1.]], dtype=torch.float64)],
+        [torch.tensor([0.], dtype=torch.float64), torch.tensor([0.], dtype=torch.float64)]
+    ),
+    "δ": construct_lukasiewicz_delta_ReLU
+}
+
+LukasiewiczToReLU = LogicToRelu(Lukasiewicz_connectives_to_ReLU, Lukasiewicz)
+
+# The recursive calculate_maximum_depth over formula strings, kept here as a reference for the timings
+def calculate_maximum_depth_recursive(formula: str) -> int:
+    if len(formula) == 1:
+        return 0
+    lformula, rformula, connective = Lukasiewicz.subdivide_formula(formula)
+    num_layers = Lukasiewicz_connectives_to_ReLU[connective].num_layers
+    if connective == "¬":
+        return num_layers + calculate_maximum_depth_recursive(lformula)
+    return num_layers + max(calculate_maximum_depth_recursive(lformula), calculate_maximum_depth_recursive(rformula))
+
+# ast_to_ReLU before the levels were planned and stacked once, kept here as a reference for the timings
+def ast_to_ReLU_appends(root: Tree.Node, max_depth: int) -> ReLUNetwork:
+    connectives_to_ReLU = Lukasiewicz_connectives_to_ReLU
+    ReLU = ReLUNetwork()
+    ReLU_v = ReLUNetwork()
+    expand_queue = [root]
+    connectives = set(connectives_to_ReLU.keys())
+
+    while expand_queue:
+        node = expand_queue.pop(0)
+        connective = node.data[0] if node.data[0] in connectives else ""
+
+        if connective == "" and node.depth < max_depth - 1:
+            expand_queue.append(Tree.Node(node.data, node.depth + 1))
+        else:
+            for children in Tree.get_children(node):
+                if children.data[0] in connectives or (children.depth < max_depth and children.data[0] not in connectives):
+                    expand_queue.append(children)
+
+        network = connectives_to_ReLU[connective](node.data[1:]) if connective == "δ" else connectives_to_ReLU[connective]
+        if ReLU_v.weights:
+            ReLU_v.vertically_append_ReLUs(network)
+        else:
+            ReLU_v = deepcopy(network)
+
+        if not expand_queue or node.depth != expand_queue[0].depth:
+            if ReLU.weights:
+                ReLU.horizontally_append_ReLUs(ReLU_v)
+            else:
+                ReLU = deepcopy(network)
+            ReLU_v = ReLUNetwork()
+
+    return ReLU
+
+def time_function(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+random.seed(0)
+
+print("calculate_maximum_depth on shallow formulas")
+print(f"{'chars':>10} {'explicit stack (s)':>20} {'recursive (s)':>15}")
+for max_depth in [4, 8, 12, 16]:
+    formula = Lukasiewicz.random_formula(["w", "x", "y", "z"], ["¬", "⊙", "⊕", "⇒"], max_depth)
+    assert LukasiewiczToReLU.calculate_maximum_depth(formula) == calculate_maximum_depth_recursive(formula)
+    new_time = time_function(LukasiewiczToReLU.calculate_maximum_depth, formula)
+    old_time = time_function(calculate_maximum_depth_recursive, formula)
+    print(f"{len(formula):>10} {new_time:>20.5f} {old_time:>15.5f}")
+
+print()
+print("ast_to_ReLU: levels stacked once against repeated vertically_append_ReLUs")
+print(f"{'AST nodes':>10} {'layers':>7} {'stacked (s)':>12} {'appends (s)':>12}")
+for max_depth in [8, 12, 14, 16]:
+    formula = Lukasiewicz.random_formula(["w", "x", "y", "z"], ["¬", "⊙", "⊕", "⇒", "δ"], max_depth)
+    root, depth = Lukasiewicz.generate_ast(formula)
+    new_ReLU, old_ReLU = LukasiewiczToReLU.ast_to_ReLU(root, depth), ast_to_ReLU_appends(root, depth)
+    assert all(torch.equal(new, old) for new, old in zip(new_ReLU.weights + new_ReLU.biases, old_ReLU.weights + old_ReLU.biases))
+    new_time = time_function(LukasiewiczToReLU.ast_to_ReLU, root, depth)
+    old_time = time_function(ast_to_ReLU_appends, root, depth)
+    print(f"{Tree.count_nodes(root)[0]:>10} {new_ReLU.num_layers:>7} {new_time:>12.4f} {old_time:>12.4f}")
+
+print()
+print("ast_to_ReLU with dense and sparse weights")
+print(f"{'AST nodes':>10} {'dense (MB)':>11} {'sparse (MB)':>12} {'dense (s)':>10} {'sparse (s)':>11} {'forward dense (s)':>18} {'forward sparse (s)':>19}")
+for max_depth in [8, 12, 14, 16]:
+    formula = Lukasiewicz.random_formula(["w", "x", "y", "z"], ["¬", "⊙", "⊕", "⇒", "δ"], max_depth)
+    root, depth = Lukasiewicz.generate_ast(formula)
+    dense_time = time_function(LukasiewiczToReLU.ast_to_ReLU, root, depth)
+    sparse_time = time_function(LukasiewiczToReLU.ast_to_ReLU, root, depth, True)
+    dense_ReLU, sparse_ReLU = LukasiewiczToReLU.ast_to_ReLU(root, depth), LukasiewiczToReLU.ast_to_ReLU(root, depth, True)
+    dense_bytes = sum(weight.numel() * weight.element_size() for weight in dense_ReLU.weights)
+    sparse_bytes = sum(weight._nnz() * (weight.element_size() + 2 * weight.indices().element_size()) for weight in sparse_ReLU.weights)
+    dense_ReLU.construct_layers()
+    sparse_ReLU.construct_layers()
+    inputs = torch.rand((256, dense_ReLU.weights[0].shape[1]), dtype=torch.float64)
+    assert torch.allclose(dense_ReLU(inputs), sparse_ReLU(inputs))
+    print(f"{Tree.count_nodes(root)[0]:>10} {dense_bytes / 2 ** 20:>11.2f} {sparse_bytes / 2 ** 20:>12.2f} {dense_time:>10.4f} {sparse_time:>11.4f} "
+          f"{time_function(dense_ReLU, inputs):>18.4f} {time_function(sparse_ReLU, inputs):>19.4f}")
+
+print()
+print("Formulas with repeated subformulas: ast_to_ReLU on the tree against dag_to_ReLU")
+print(f"{'tree nodes':>11} {'unique':>7} {'tree width':>11} {'dag width':>10} {'tree params':>12} {'dag params':>11} {'tree (s)':>9} {'dag (s)':>8}")
+for max_depth in [4, 6, 8, 10]:
+    # every atom w is the same subformula, every atom z another one built on it
+    shared = Lukasiewicz.random_formula(["x", "y"], ["¬", "⊙", "⊕", "⇒"], 3)
+    formula = Lukasiewicz.random_formula(["w", "x", "y", "z"], ["¬", "⊙", "⊕", "⇒", "δ"], max_depth).replace("z", f"(¬{shared})").replace("w", shared)
+    root, depth = Lukasiewicz.generate_ast(formula)
+    tree_ReLU = LukasiewiczToReLU.ast_to_ReLU(root, depth)
+    dag_ReLU, inputs = LukasiewiczToReLU.dag_to_ReLU(root)
+    tree_nodes, unique_nodes = Tree.count_nodes(Lukasiewicz.generate_dag(formula)[0])
+    print(f"{tree_nodes:>11} {unique_nodes:>7} {max(weight.shape[0] for weight in tree_ReLU.weights):>11} {max(weight.shape[0] for weight in dag_ReLU.weights):>10} "
+          f"{sum(weight.numel() for weight in tree_ReLU.weights):>12} {sum(weight.numel() for weight in dag_ReLU.weights):>11} "
+          f"{time_function(LukasiewiczToReLU.ast_to_ReLU, root, depth):>9.4f} {time_function(LukasiewiczToReLU.dag_to_ReLU, root):>8.4f}")
+
+print()
+print("fuse_network on ast_to_ReLU networks: every identity ReLU between two levels removed")
+print(f"{'AST nodes':>10} {'layers':>7} {'after':>6} {'pass-through':>13} {'params':>9} {'fused params':>13} {'fuse (s)':>9} {'forward (s)':>12} {'fused forward (s)':>18}")
+for max_depth in [8, 12, 14, 16]:
+    formula = Lukasiewicz.random_formula(["w", "x", "y", "z"], ["¬", "⊙", "⊕", "⇒", "δ"], max_depth)
+    root, depth = Lukasiewicz.generate_ast(formula)
+    ReLU = LukasiewiczToReLU.ast_to_ReLU(root, depth, True)
+    fused, report = fuse_network(ReLU)
+    inputs = torch.rand((256, ReLU.weights[0].shape[1]), dtype=torch.float64)
+    print(f"{Tree.count_nodes(root)[0]:>10} {report['layers_before']:>7} {report['layers_after']:>6} {report['pass_through_removed']:>13} {report['parameters_before']:>9} "
+          f"{report['parameters_after']:>13} {time_function(fuse_network, ReLU):>9.4f} {time_function(network_outputs, ReLU, inputs):>12.4f} {time_function(network_outputs, fused, inputs):>18.4f}")
+
+print()
+print("Many small rule formulas on the same inputs: one network per formula against formulas_to_ReLU")
+print(f"{'formulas':>9} {'separate nonzeros':>18} {'batch nonzeros':>15} {'compile (s)':>12} {'batch compile (s)':>18} {'forward (s)':>12} {'batch forward (s)':>18}")
+rule_atoms = [f"p{i}" for i in range(8)]
+for num_formulas in [10, 100, 1000]:
+    formulas = [Lukasiewicz.random_formula(rule_atoms, ["¬", "⊙", "⊕", "⇒"], random.randint(1, 4)) for _ in range(num_formulas)]
+    vals = [{atom: random.random() for atom in rule_atoms} for _ in range(256)]
+    start = time.perf_counter()
+    networks = [LukasiewiczToReLU.formulas_to_ReLU([formula]) for formula in formulas]
+    separate_time = time.perf_counter() - start
+    batch_time = time_function(LukasiewiczToReLU.formulas_to_ReLU, formulas)
+    batch_ReLU, inputs = LukasiewiczToReLU.formulas_to_ReLU(formulas)
+    batch_ReLU.construct_layers()
+    separate_inputs = []
+    for network, network_atoms in networks:
+        network.construct_layers()
+        separate_inputs.append(LogicToRelu.valuations_to_tensor(vals, network_atoms))
+    batch_inputs = LogicToRelu.valuations_to_tensor(vals, inputs)
+    start = time.perf_counter()
+    separate_outputs = torch.cat([network(network_inputs) for (network, _), network_inputs in zip(networks, separate_inputs)], dim=1)
+    forward_time = time.perf_counter() - start
+    assert torch.allclose(separate_outputs, batch_ReLU(batch_inputs))
+    print(f"{num_formulas:>9} {sum(sum(int(weight.count_nonzero()) for weight in network.weights) for network, _ in networks):>18} {sum(int(weight.count_nonzero()) for weight in batch_ReLU.weights):>15} "
+          f"{separate_time:>12.4f} {batch_time:>18.4f} {forward_time:>12.4f} {time_function(batch_ReLU, batch_inputs):>18.4f}")
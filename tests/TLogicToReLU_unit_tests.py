@@ -109,3 +109,63 @@ for i in range(0, 50):
 print("All Good for Godel")
 print()
 
+
+print(LukasiewiczToReLU.calculate_maximum_depth("(x⊙((¬y)⊙z))"))
+print("Expected Result: 6")
+
+deep_formula = "(¬" * 100000 + "x" + ")" * 100000
+assert LukasiewiczToReLU.calculate_maximum_depth(deep_formula) == 200000
+
+# sparse weights: the same network, with only the entries of the connective networks stored
+root, max_depth = Lukasiewicz.generate_ast("((x⊙(¬y))⊕(δ_3 z))")
+dense_ReLU = LukasiewiczToReLU.ast_to_ReLU(root, max_depth)
+sparse_ReLU = LukasiewiczToReLU.ast_to_ReLU(root, max_depth, sparse=True)
+print(all(torch.equal(sparse.to_dense(), dense) for sparse, dense in zip(sparse_ReLU.weights, dense_ReLU.weights)), sum(weight._nnz() for weight in sparse_ReLU.weights), sum(weight.numel() for weight in dense_ReLU.weights))
+print("Expected Result: True 14 31")
+sparse_ReLU.construct_layers()
+val = {"x": 0.7, "y": 0.2, "z": 0.9}
+print(sparse_ReLU(LogicToRelu.valuation_to_tensor(val, "((x⊙(¬y))⊕(δ_3 z))")).item() - Lukasiewicz.evaluate_formula(root, val))
+print("Expected Result: 0.0")
+
+# a repeated subformula is computed once and fans out to its parents, the inputs are the distinct atoms
+formula = "(((x⊙y)⊕z)⇒(¬(x⊙y)))"
+root, max_depth = Lukasiewicz.generate_ast(formula)
+tree_ReLU = LukasiewiczToReLU.ast_to_ReLU(root, max_depth)
+dag_ReLU, inputs = LukasiewiczToReLU.dag_to_ReLU(root)
+print(inputs, [weight.shape[0] for weight in tree_ReLU.weights], [weight.shape[0] for weight in dag_ReLU.weights])
+print("Expected Result: ['x', 'y', 'z'] [3, 3, 2, 2, 1, 1] [2, 2, 2, 2, 1, 1]")
+dag_ReLU.construct_layers()
+val = {"x": 0.8, "y": 0.7, "z": 0.1}
+print(round(dag_ReLU(LogicToRelu.atoms_to_tensor(val, inputs)).item() - Lukasiewicz.evaluate_formula(root, val), 12))
+print("Expected Result: 0.0")
+
+for i in range(0, 50):
+    val = {"w": np.random.random_sample(), "x": np.random.random_sample(), "y": np.random.random_sample(), "z": np.random.random_sample()}
+    formula = Lukasiewicz.random_formula(atoms, ["¬", "⊙", "⊕", "⇒", "δ"], max_depth=6).replace("w", "(x⊙(¬y))")
+    root, max_depth = Lukasiewicz.generate_dag(formula)
+    dag_ReLU, inputs = LukasiewiczToReLU.dag_to_ReLU(root, sparse=i % 2 == 1)
+    dag_ReLU.construct_layers()
+    assert abs(dag_ReLU(LogicToRelu.atoms_to_tensor(val, inputs)).item() - Lukasiewicz.evaluate_formula(root, val)) < 1e-9
+print("All Good for shared subformulas")
+
+# one network for several formulas: (x⊙y) is computed once for the first, second and last output,
+# and the shallower formulas are carried to the last stage
+formulas = ["(x⊙y)", "((x⊙y)⊕z)", "(¬z)", "(x⊙y)"]
+batch_ReLU, inputs = LukasiewiczToReLU.formulas_to_ReLU(formulas)
+print(inputs, [weight.shape[0] for weight in batch_ReLU.weights])
+print("Expected Result: ['x', 'y', 'z'] [2, 2, 3, 4]")
+batch_ReLU.construct_layers()
+vals = [{"x": 0.8, "y": 0.7, "z": 0.1}, {"x": 0.2, "y": 0.4, "z": 0.9}]
+print(batch_ReLU(LogicToRelu.valuations_to_tensor(vals, inputs)).round(decimals=9).tolist())
+print("Expected Result: [[0.5, 0.6, 0.9, 0.5], [0.0, 0.9, 0.1, 0.0]]")
+
+for i in range(0, 20):
+    formulas = [Lukasiewicz.random_formula(atoms, ["¬", "⊙", "⊕", "⇒", "δ"], max_depth=np.random.randint(0, 6)) for _ in range(10)]
+    batch_ReLU, inputs = LukasiewiczToReLU.formulas_to_ReLU(formulas, sparse=i % 2 == 1)
+    batch_ReLU.construct_layers()
+    vals = [{"w": np.random.random_sample(), "x": np.random.random_sample(), "y": np.random.random_sample(), "z": np.random.random_sample()} for _ in range(5)]
+    outputs = batch_ReLU(LogicToRelu.valuations_to_tensor(vals, inputs))
+    for row, val in enumerate(vals):
+        for column, formula in enumerate(formulas):
+            assert abs(outputs[row, column].item() - Lukasiewicz.evaluate_formula(Lukasiewicz.generate_ast(formula)[0], val)) < 1e-9
+print("All Good for batches of formulas")
@@ -0,0 +1,174 @@
+import sys
+import os
+import time
+import random
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from src.TLogics import *
+
+Lukasiewicz = Lukasiewicz()
+
+# The parser generate_ast used before the tokenizer, kept here as a reference for the timings
+def generate_ast_subdivide(formula: str, depth: int = 0) -> tuple[Tree.Node, int]:
+    if Lukasiewicz.is_constant(formula):
+        return Tree.Node(formula, depth), depth
+
+    l_formula, r_formula, connective = Lukasiewicz.subdivide_formula(formula)
+    root = Tree.Node(connective, depth)
+    if connective[0] == "¬" or connective[0] == "δ":
+        root.left, max_depth = generate_ast_subdivide(l_formula, depth + 1)
+    else:
+        root.left, left_max_depth = generate_ast_subdivide(l_formula, depth + 1)
+        root.right, right_max_depth = generate_ast_subdivide(r_formula, depth + 1)
+        max_depth = max(left_max_depth, right_max_depth)
+    return root, max_depth
+
+def chain_formula(length: int) -> str:
+    # ((((x1⊕x2)⊙x3)⊕x4)...) the shape sigma_construct produces
+    formula = "x1"
+    for i in range(2, length + 2):
+        formula = f"({formula}{'⊕' if i % 2 else '⊙'}(¬x{i % 7 + 1}))"
+    return formula
+
+def time_function(function, formula: str) -> float:
+    start = time.perf_counter()
+    function(formula)
+    return time.perf_counter() - start
+
+sys.setrecursionlimit(100000)
+random.seed(0)
+
+print("Parse time of random balanced formulas")
+print(f"{'chars':>10} {'tokenizer (s)':>15} {'subdivide (s)':>15}")
+for max_depth in range(6, 19, 2):
+    formula = Lukasiewicz.random_formula(["x1", "x2", "x3", "x4"], ["¬", "⊙", "⊕", "⇒", "δ"], max_depth)
+    new_time = time_function(Lukasiewicz.generate_ast, formula)
+    old_time = time_function(generate_ast_subdivide, formula)
+    print(f"{len(formula):>10} {new_time:>15.4f} {old_time:>15.4f}")
+
+print()
+print("Parse time of nested chains")
+print(f"{'chars':>10} {'tokenizer (s)':>15} {'subdivide (s)':>15}")
+for length in [250, 500, 1000, 2000, 4000]:
+    formula = chain_formula(length)
+    new_time = time_function(Lukasiewicz.generate_ast, formula)
+    old_time = time_function(generate_ast_subdivide, formula)
+    print(f"{len(formula):>10} {new_time:>15.4f} {old_time:>15.4f}")
+
+print()
+print("Parse time of large formulas (tokenizer only)")
+print(f"{'chars':>10} {'tokenizer (s)':>15} {'us / char':>15}")
+for length in [25000, 50000, 100000, 200000]:
+    formula = chain_formula(length)
+    new_time = time_function(Lukasiewicz.generate_ast, formula)
+    print(f"{len(formula):>10} {new_time:>15.4f} {1e6 * new_time / len(formula):>15.4f}")
+
+print()
+print("Evaluation time over many valuations")
+print(f"{'rows':>10} {'evaluate_formula (s)':>22} {'evaluate_formula_batch (s)':>28}")
+formula = Lukasiewicz.random_formula(["x1", "x2", "x3", "x4"], ["¬", "⊙", "⊕", "⇒", "δ"], 12)
+root, _ = Lukasiewicz.generate_ast(formula)
+for num_rows in [1000, 10000, 100000]:
+    valuations = np.random.random_sample((num_rows, 4))
+
+    start = time.perf_counter()
+    for row in valuations[:1000]:
+        Lukasiewicz.evaluate_formula(root, {"x1": row[0], "x2": row[1], "x3": row[2], "x4": row[3]})
+    old_time = (time.perf_counter() - start) * num_rows / 1000 # extrapolated from the first 1000 rows
+
+    start = time.perf_counter()
+    Lukasiewicz.evaluate_formula_batch(root, valuations)
+    new_time = time.perf_counter() - start
+    print(f"{num_rows:>10} {old_time:>22.4f} {new_time:>28.4f}")
+
+print()
+print("Scalar evaluation of 1000 valuations")
+program = Lukasiewicz.compile_formula(formula)
+assignments = [{"x1": row[0], "x2": row[1], "x3": row[2], "x4": row[3]} for row in np.random.random_sample((1000, 4))]
+
+start = time.perf_counter()
+for assignment in assignments:
+    Lukasiewicz.evaluate_formula(root, assignment)
+print(f"evaluate_formula: {time.perf_counter() - start:.4f} s")
+
+start = time.perf_counter()
+for assignment in assignments:
+    Lukasiewicz.run_program(program, assignment)
+print(f"run_program:      {time.perf_counter() - start:.4f} s ({len(program)} instructions)")
+
+# The recursive traversals used before the explicit stack versions, kept here as a reference for the timings
+def evaluate_formula_recursive(root: Tree.Node, val: dict) -> np.float64:
+    if root.left == None:
+        return val[root.data] if root.data in val else float(root.data)
+
+    function = Lukasiewicz.get_function_name(root.data)
+    if root.data[0] == "¬":
+        return function(evaluate_formula_recursive(root.left, val))
+    elif root.data[0] == "δ":
+        return function(root.data[1:], evaluate_formula_recursive(root.left, val))
+    return function(evaluate_formula_recursive(root.left, val), evaluate_formula_recursive(root.right, val))
+
+def generate_formula_from_ast_recursive(root: Tree.Node) -> str:
+    if root.left == None:
+        return root.data
+    if root.data[0] == "¬":
+        return f'(¬{generate_formula_from_ast_recursive(root.left)})'
+    elif root.data[0] == "δ":
+        return f'(δ_{root.data[1:]} {generate_formula_from_ast_recursive(root.left)})'
+    return f'({generate_formula_from_ast_recursive(root.left)}{root.data}{generate_formula_from_ast_recursive(root.right)})'
+
+def time_repeated(function, *args, repetitions: int = 20) -> float:
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        function(*args)
+    return (time.perf_counter() - start) / repetitions
+
+print()
+print("Explicit stack against recursive traversals on shallow formulas")
+print(f"{'chars':>10} {'depth':>6} {'evaluate it/rec (s)':>24} {'to string it/rec (s)':>24}")
+for max_depth in [4, 8, 12, 16]:
+    formula = Lukasiewicz.random_formula(["x1", "x2", "x3", "x4"], ["⊙", "⊕", "⇒", "¬"], max_depth)
+    root, depth = Lukasiewicz.generate_ast(formula)
+    val = {"x1": 0.1, "x2": 0.4, "x3": 0.7, "x4": 0.9}
+    evaluate_times = (time_repeated(Lukasiewicz.evaluate_formula, root, val), time_repeated(evaluate_formula_recursive, root, val))
+    string_times = (time_repeated(Lukasiewicz.generate_formula_from_ast, root), time_repeated(generate_formula_from_ast_recursive, root))
+    print(f"{len(formula):>10} {depth:>6} {evaluate_times[0]:>11.5f} / {evaluate_times[1]:>10.5f} {string_times[0]:>11.5f} / {string_times[1]:>10.5f}")
+
+print()
+print("Memory held by Node trees against ArrayTree (tracemalloc, the parse is included in the peak and the time)")
+import tracemalloc
+formula = "x1"
+for i in range(2, 200):
+    formula = f"(x{i}⊕{formula})" if i % 2 else f"(¬{formula})"
+for _ in range(12): # about 1.2 million nodes
+    formula = f"({formula}⊙(¬{formula}))"
+print(f"{'representation':>16} {'nodes':>10} {'held (MB)':>10} {'peak (MB)':>10} {'time (s)':>9}")
+for name, generate in [("Node", Lukasiewicz.generate_ast), ("ArrayTree", Lukasiewicz.generate_array_ast)]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    root, depth = generate(formula)
+    elapsed = time.perf_counter() - start
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:>16} {Tree.count_nodes(root)[0]:>10} {held / 1e6:>10.1f} {peak / 1e6:>10.1f} {elapsed:>9.2f}")
+    del root
+
+print()
+print("Exact evaluation against floating point and per node Fractions")
+formula = Lukasiewicz.random_formula(["x1", "x2", "x3"], ["⊙", "⊕", "⇒", "¬", "δ"], 10)
+root, depth = Lukasiewicz.generate_ast(formula)
+program = Lukasiewicz.compile_ast(root)
+numerators = np.random.randint(0, 101, size=(100000, 3))
+start = time.perf_counter()
+Lukasiewicz.evaluate_formula_batch(program, numerators / 100)
+print(f"float batch:      {time.perf_counter() - start:.4f} s")
+start = time.perf_counter()
+exact, denominator = Lukasiewicz.evaluate_formula_batch_exact(program, numerators, 100)
+print(f"exact batch:      {time.perf_counter() - start:.4f} s (denominator with {len(str(denominator))} digits, {exact.dtype})")
+start = time.perf_counter()
+for row in numerators[:1000]:
+    Lukasiewicz.evaluate_formula(root, {f"x{i + 1}": Fraction(int(value), 100) for i, value in enumerate(row)})
+print(f"Fraction nodes:   {(time.perf_counter() - start) * 100:.4f} s (extrapolated from 1000 rows)")
@@ -69,3 +69,156 @@ print_tree(tree_with_degs)
 
 print(Lukasiewicz.evaluate_formula(tree_with_degs, val) - Lukasiewicz.evaluate_formula(tree_no_degs, val))
 
+
+# ----------------------------------------------------------- #
+
+print(Lukasiewicz.tokenize_formula("(δ_12 x1)⊕1"))
+print("Expected Result: [('(', '('), ('unary', 'δ12'), ('atom', 'x1'), (')', ')'), ('binary', '⊕'), ('atom', '1')]")
+
+result, depth = Lukasiewicz.generate_ast("((x1==0)∧(x2!=1))V(δ_2 x3)")
+assert Tree.level_order_traversal(result) == [('V', 0), ('∧', 1), ('δ2', 1), ('==', 2), ('!=', 2), ('x3', 2), ('x1', 3), ('0', 3), ('x2', 3), ('1', 3)]
+assert depth == 3
+
+# prefix connectives scope over the rest of the group and binary connectives associate to the right
+result, depth = Lukasiewicz.generate_ast("¬A⊙B⊕A")
+assert Tree.level_order_traversal(result) == [('¬', 0), ('⊙', 1), ('A', 2), ('⊕', 2), ('B', 3), ('A', 3)]
+
+for formula in ["(A⊙B", "A⊙B)", "()", "(A B)", "(A⊙)"]:
+    try:
+        Lukasiewicz.generate_ast(formula)
+        assert False, formula
+    except ValueError as error:
+        print(error)
+
+# ----------------------------------------------------------- #
+
+Godel = Godel()
+
+valuations = np.random.random_sample((1000, 3))
+for logic, choosable_connectives in [(Lukasiewicz, ["¬", "⊙", "⊕", "⇒", "δ", "V", "∧"]), (Godel, ["⊙", "⊕", "⇒"])]:
+    for i in range(0, 20):
+        formula = logic.random_formula(["x1", "x2", "x3"], choosable_connectives, max_depth=6)
+        root, _ = logic.generate_ast(formula)
+
+        batch_result = logic.evaluate_formula_batch(root, valuations, chunk_size=300)
+        columns_result = logic.evaluate_formula_batch(root, {"x1": valuations[:, 0], "x2": valuations[:, 1], "x3": valuations[:, 2]})
+        expected_result = np.array([logic.evaluate_formula(root, {"x1": x1, "x2": x2, "x3": x3}) for x1, x2, x3 in valuations])
+
+        assert np.array_equal(batch_result, expected_result)
+        assert np.array_equal(columns_result, expected_result)
+print("Batch evaluation matches evaluate_formula")
+
+# ----------------------------------------------------------- #
+
+program = Lukasiewicz.compile_formula("(A⇒(δ_3 (B⊕(¬A))))")
+print(program.opcodes, program.arguments, program.atoms)
+print("Expected Result: [0 0 0 4 6 8 7] [0 1 0 0 0 3 0] ['A', 'B']")
+assert Lukasiewicz.compile_formula("(A⇒(δ_3 (B⊕(¬A))))") is program
+
+root, _ = Lukasiewicz.generate_ast("(A⇒(δ_3 (B⊕(¬A))))")
+assert Lukasiewicz.run_program(program, val) == Lukasiewicz.evaluate_formula(root, val)
+
+for i in range(0, 20):
+    formula = Lukasiewicz.random_formula(["x1", "x2", "x3"], ["¬", "⊙", "⊕", "⇒", "δ", "V", "∧"], max_depth=6)
+    root, _ = Lukasiewicz.generate_ast(formula)
+    program = Lukasiewicz.compile_formula(formula)
+    for x1, x2, x3 in valuations[:20]:
+        assignment = {"x1": x1, "x2": x2, "x3": x3}
+        assert Lukasiewicz.run_program(program, assignment) == Lukasiewicz.evaluate_formula(root, assignment)
+print("Compiled programs match evaluate_formula")
+
+# the steps of run_program are resolved once per program and logic, a logic without Python float truth functions uses its methods
+assert Lukasiewicz.scalar_steps(program) is Lukasiewicz.scalar_steps(program)
+godel_program = Godel.compile_formula("(A⇒(B⊙A))")
+print(Godel.run_program(godel_program, {"A": 0.7, "B": 0.4}), Godel.run_program(godel_program, {"A": 0.3, "B": 0.4}))
+print("Expected Result: 0.4 1.0")
+
+# ----------------------------------------------------------- #
+
+dag, depth = Lukasiewicz.generate_dag("((A⊙B)⊙(A⊙B))")
+assert dag.left is dag.right
+print("Tree size, unique nodes: " + str(Tree.count_nodes(dag)) + " Expected Result: (7, 4)")
+
+# every call builds its own node table
+other_dag, depth = Lukasiewicz.generate_ast_with_degs("((A⊙B)⊙(A⊙B))")
+assert other_dag.left is not dag.left
+
+program = Lukasiewicz.compile_formula(dag)
+assert Lukasiewicz.run_program(program, val) == Lukasiewicz.evaluate_formula(dag, val) == Lukasiewicz.evaluate_formula(Lukasiewicz.generate_ast("((A⊙B)⊙(A⊙B))")[0], val)
+print(program.opcodes, program.arguments)
+print("Expected Result: [0 0 5 3 2 5] [0 1 0 0 0 0]")
+
+tree, _ = Lukasiewicz.generate_ast("(((A⊕0)⊙1)⊕((δ_2 0)⊙(B⊙(A⊕0))))")
+dag, _ = Lukasiewicz.generate_dag("(((A⊕0)⊙1)⊕((δ_2 0)⊙(B⊙(A⊕0))))")
+print(Lukasiewicz.minimize_formula(tree) + " Expected Result: A")
+assert Lukasiewicz.minimize_formula(dag) == "A"
+
+# rules of the MV-algebra and constant folding
+for formula, expected in [("(¬(¬A))", "A"), ("(A⊕(¬A))", "1"), ("((¬A)⊙A)", "0"), ("((A⊙B)∧(A⊙B))", "(A⊙B)"),
+                          ("(δ_1 A)", "A"), ("((δ_2 1)⊕(δ_4 1))", "0.75"), ("(δ_3 1)", "(δ_3 1)"), ("((¬A)⇒0)", "A")]:
+    minimized = Lukasiewicz.minimize_formula(Lukasiewicz.generate_ast(formula)[0])
+    print(minimized + " Expected Result: " + expected)
+    assert minimized == expected
+
+# ----------------------------------------------------------- #
+
+# formulas far deeper than the recursion limit
+deep_formula = "(¬" * 200000 + "A" + ")" * 200000
+root, depth = Lukasiewicz.generate_ast(deep_formula)
+assert depth == 200000
+assert Lukasiewicz.evaluate_formula(root, val) == val['A']
+assert Lukasiewicz.generate_formula_from_ast(root) == deep_formula
+assert Lukasiewicz.minimize_formula(root) == "A"
+
+deep_formula = "A"
+for i in range(0, 100000):
+    deep_formula = f"({deep_formula}⊕(B⊙0))"
+root, depth = Lukasiewicz.generate_ast(deep_formula)
+assert depth == 100001
+assert Lukasiewicz.minimize_formula(root) == "A"
+print("Deep formulas are handled")
+
+# ----------------------------------------------------------- #
+
+# array backed trees give the same answers as Node trees
+formula = "((δ_2 (A⊕0.5))⊙(¬(A⇒B)))"
+array_root, depth = Lukasiewicz.generate_array_ast(formula)
+root, _ = Lukasiewicz.generate_ast(formula)
+print(depth, len(array_root.tree))
+print("Expected Result: 3 9")
+assert Tree.level_order_traversal(array_root) == Tree.level_order_traversal(root)
+assert Lukasiewicz.generate_formula_from_ast(array_root) == formula
+assert Lukasiewicz.evaluate_formula(array_root, val) == Lukasiewicz.evaluate_formula(root, val)
+array_program, program = Lukasiewicz.compile_ast(array_root), Lukasiewicz.compile_ast(root)
+assert np.array_equal(array_program.opcodes, program.opcodes) and np.array_equal(array_program.arguments, program.arguments)
+assert array_program.atoms == program.atoms and np.array_equal(array_program.constants, program.constants)
+
+array_dag, _ = Lukasiewicz.generate_array_ast("(((A⊕0)⊙1)⊕((δ_2 0)⊙(B⊙(A⊕0))))", share_subterms=True)
+print(len(array_dag.tree), Lukasiewicz.minimize_formula(array_dag))
+print("Expected Result: 10 A")
+
+# ----------------------------------------------------------- #
+
+# exact evaluation, in floating point 0.1 + 0.2 is not 0.3
+root, depth = Lukasiewicz.generate_ast("(((δ_10 1)⊕(δ_5 1))==(δ_10 3))")
+print(Lukasiewicz.evaluate_formula(root, {}), Lukasiewicz.evaluate_formula_exact(root, {}))
+print("Expected Result: 0.0 1")
+assert Lukasiewicz.evaluate_formula_exact(root, {}) == 1
+
+root, depth = Lukasiewicz.generate_ast("((δ_3 x1)⊕(δ_2 x2))")
+print(Lukasiewicz.evaluate_formula_exact(root, {"x1": Fraction(1, 2), "x2": 0.25}))
+print("Expected Result: 7/24")
+numerators, denominator = Lukasiewicz.evaluate_formula_batch_exact(root, np.array([[0, 0], [1, 2], [4, 4]]), 4)
+print(numerators, denominator)
+print("Expected Result: [ 0  8 20] 24")
+
+# ----------------------------------------------------------- #
+
+# lookup tables of the chain L_4 = {0, 1/4, 1/2, 3/4, 1}, δ_2 of 1/4 is not in the chain
+chain = FiniteLukasiewicz(4)
+program = chain.compile_formula("((δ_2 x1)⊕(x2⇒(¬x1)))")
+indices = chain.evaluate_formula_indices(program, np.array([[0, 4], [2, 3], [4, 4], [1, 0]]))
+print(indices, indices.dtype)
+print("Expected Result: [4 4 2 5] uint8")
+print(chain.indices_to_values(indices))
+print("Expected Result: [1.  1.  0.5 nan]")
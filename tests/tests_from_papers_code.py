@@ -1,5 +1,6 @@
 import sys
 import os
+from copy import deepcopy
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)